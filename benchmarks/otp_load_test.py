@@ -0,0 +1,221 @@
+"""Replay a routing workload through the ``3_OTP_routing`` client.
+
+The workload is built the way ``3_OTP_routing.main`` builds it: random
+origin-destination pairs, a commute departure time per pair, and one request
+per mode (bicycle only up to 30 km). Each request goes through
+``generate_route`` and ``process_route``, from a pool of client threads, for
+every concurrency level given:
+
+    python benchmarks/otp_load_test.py --requests 300 --concurrency 1 4 16
+    python benchmarks/otp_load_test.py --latency lognormal:400,0.7 --error-rate 0.02 --hang-rate 0.01 --timeout 5
+    python benchmarks/otp_load_test.py --url http://localhost:8080/otp/routers/default/plan
+
+Without ``--url`` the mock planner of ``otp_mock.py`` is started in-process
+(its options select the latency and failures to inject). The report gives the
+throughput, the client-side latency percentiles and how every request ended:
+routed, no route, or failed (timeouts, HTTP errors, refused connections); for
+the in-process mock, the outcomes the server injected are listed alongside.
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import otp_mock
+import synthetic
+
+# The stage scripts and the utils package live in scripts/
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(benchmarks_dir), 'scripts'))
+
+from utils.geodesy import geodesic_distance_km
+
+routing = importlib.import_module('3_OTP_routing')
+
+MODES = ['BICYCLE', 'CAR', 'TRANSIT']
+
+# Longest bicycle trip routed by 3_OTP_routing (km)
+MAX_BICYCLE_KM = 30
+
+
+def load_addresses(origins_path=None, destinations_path=None, n_synthetic=200, seed=0):
+    """
+    Load the origin and destination addresses, or draw synthetic ones at PC4 centroids.
+
+    Returns:
+    tuple: (origins, destinations) DataFrames with Address, Latitude and Longitude.
+    """
+    if origins_path and destinations_path:
+        return pd.read_csv(origins_path), pd.read_csv(destinations_path)
+    codes, lat, lon = synthetic.postcodes(seed)
+    rng = np.random.default_rng(seed + 6)
+    addresses = []
+    for _ in range(2):
+        index = rng.integers(len(codes), size=n_synthetic)
+        addresses.append(pd.DataFrame({
+            'Address': [f"Street {k}, {codes[i]}" for k, i in enumerate(index)],
+            'Latitude': lat[index] + rng.normal(0, 0.003, n_synthetic),
+            'Longitude': lon[index] + rng.normal(0, 0.005, n_synthetic),
+        }))
+    return addresses[0], addresses[1]
+
+
+def build_workload(origins, destinations, n_requests, seed=0):
+    """
+    Build the requests of a routing run.
+
+    Parameters:
+    origins, destinations (pd.DataFrame): The addresses.
+    n_requests (int): The number of requests.
+    seed (int): The random seed.
+
+    Returns:
+    list: (origin, destination, departure_time, mode) tuples.
+    """
+    random.seed(seed)
+    origin_rows = origins.to_dict('records')
+    destination_rows = destinations.to_dict('records')
+    workload = []
+    while len(workload) < n_requests:
+        origin = random.choice(origin_rows)
+        destination = random.choice(destination_rows)
+        _, departure_time = routing.get_random_commute_time()
+        distance = float(geodesic_distance_km(origin['Latitude'], origin['Longitude'],
+                                              destination['Latitude'], destination['Longitude']))
+        for mode in MODES:
+            if mode == 'BICYCLE' and distance > MAX_BICYCLE_KM:
+                continue
+            workload.append((origin, destination, departure_time, mode))
+    return workload[:n_requests]
+
+
+def timed_request(request):
+    origin, destination, departure_time, mode = request
+    start = time.perf_counter()
+    route = routing.generate_route(origin, destination, departure_time, mode)
+    summary = routing.process_route(route, mode)
+    elapsed = time.perf_counter() - start
+    if summary is not None:
+        outcome = 'routed'
+    elif route is not None:
+        outcome = 'no_route'
+    elif elapsed >= routing.OTP_TIMEOUT:
+        outcome = 'timeout'
+    else:
+        outcome = 'failed'
+    return mode, outcome, elapsed
+
+
+def percentiles_ms(latencies):
+    if not latencies:
+        return {'p50': None, 'p90': None, 'p99': None, 'max': None}
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000
+    return {'p50': round(p50, 1), 'p90': round(p90, 1), 'p99': round(p99, 1), 'max': round(max(latencies) * 1000, 1)}
+
+
+def run_level(workload, concurrency, planner=None):
+    """
+    Replay the workload with a number of client threads.
+
+    Parameters:
+    workload (list): The requests, see ``build_workload``.
+    concurrency (int): The number of client threads.
+    planner (MockPlanner, optional): The in-process mock, whose injected outcomes are reported.
+
+    Returns:
+    dict: The throughput, latency percentiles and outcome counts.
+    """
+    if planner is not None:
+        planner.reset_counts()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed_request, workload))
+    wall = time.perf_counter() - start
+
+    outcomes = {}
+    for _, outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    routed = [elapsed for _, outcome, elapsed in results if outcome == 'routed']
+    report = {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'wall_seconds': round(wall, 3),
+        'throughput_per_second': round(len(results) / wall, 2),
+        'routed_per_second': round(len(routed) / wall, 2),
+        'latency_ms': percentiles_ms([elapsed for _, _, elapsed in results]),
+        'routed_latency_ms': percentiles_ms(routed),
+        'latency_ms_by_mode': {mode: percentiles_ms([elapsed for m, outcome, elapsed in results
+                                                      if m == mode and outcome == 'routed'])
+                               for mode in MODES},
+        'outcomes': outcomes,
+    }
+    if planner is not None:
+        report['server_outcomes'] = dict(planner.counts)
+    return report
+
+
+def print_report(reports):
+    print(f"{'Threads':>7} {'Req/s':>8} {'Routed/s':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}  Outcomes")
+    for report in reports:
+        latency = report['latency_ms']
+        outcomes = ', '.join(f"{name} {count}" for name, count in sorted(report['outcomes'].items()))
+        print(f"{report['concurrency']:>7} {report['throughput_per_second']:>8.1f} {report['routed_per_second']:>9.1f} "
+              f"{latency['p50']:>8.1f} {latency['p90']:>8.1f} {latency['p99']:>8.1f} {latency['max']:>8.1f}  {outcomes}")
+        if 'server_outcomes' in report:
+            injected = ', '.join(f"{name} {count}" for name, count in sorted(report['server_outcomes'].items()))
+            print(f"{'':>54}  (server: {injected})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the OTP routing client.")
+    parser.add_argument('--url', default=None, help="OTP plan endpoint to load (default: start the mock planner in-process).")
+    parser.add_argument('--requests', type=int, default=300, help="Requests per concurrency level (default: 300).")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help="Client threads (default: 1 4 16).")
+    parser.add_argument('--timeout', type=float, default=None, help="Client timeout in seconds (default: OTP_TIMEOUT of 3_OTP_routing).")
+    parser.add_argument('--origins', default=None, help="Origin addresses CSV (default: synthetic addresses).")
+    parser.add_argument('--destinations', default=None, help="Destination addresses CSV (default: synthetic addresses).")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="Also write the reports to this JSON file.")
+    parser.add_argument('--log-level', default='CRITICAL',
+                        help="Log level of the routing client (default: CRITICAL; failures are counted in the report).")
+    otp_mock.add_planner_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s - %(levelname)s - %(message)s')
+
+    server = planner = None
+    if args.url:
+        routing.OTP_URL = args.url
+    else:
+        planner = otp_mock.planner_from_arguments(args, args.seed)
+        server, routing.OTP_URL = otp_mock.start_server(planner)
+    if args.timeout is not None:
+        routing.OTP_TIMEOUT = args.timeout
+
+    origins, destinations = load_addresses(args.origins, args.destinations, seed=args.seed)
+    workload = build_workload(origins, destinations, args.requests, args.seed)
+    print(f"Replaying {len(workload)} requests against {routing.OTP_URL} (client timeout {routing.OTP_TIMEOUT:g} s)")
+
+    reports = []
+    try:
+        for concurrency in args.concurrency:
+            reports.append(run_level(workload, concurrency, planner))
+    finally:
+        if server is not None:
+            server.shutdown()
+    print_report(reports)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'url': routing.OTP_URL, 'timeout': routing.OTP_TIMEOUT, 'reports': reports}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""Mock OpenTripPlanner server for routing load tests.
+
+Serves ``/otp/routers/default/plan`` with itineraries synthesised between the
+requested places: the trip distance is the geodesic distance times a detour
+factor, transit trips get access/egress walks, transfers and agency/stop
+metadata, and every leg carries an encoded polyline along the OD line.
+
+Latency and failures are configurable, so client concurrency can be tuned
+without the real server:
+
+- ``latency``: 'fixed:MS', 'uniform:LOW_MS,HIGH_MS' or 'lognormal:MEDIAN_MS,SIGMA',
+  scaled per mode (transit searches are slower than car or bicycle ones).
+- ``error_rate``: share of requests answered with HTTP 500.
+- ``no_route_rate``: share answered with OTP's PATH_NOT_FOUND error and no plan.
+- ``hang_rate``: share held for ``hang_seconds`` before answering, to exercise client timeouts.
+- ``threads`` and ``max_queue``: like OTP's fixed worker pool, at most ``threads``
+  requests are planned at once; once ``max_queue`` more are waiting, requests are
+  rejected with HTTP 503.
+
+Run it standalone and point the routing script at it:
+
+    python benchmarks/otp_mock.py --port 8080 --latency lognormal:300,0.5 --error-rate 0.01
+    OTP_URL=http://localhost:8080/otp/routers/default/plan python scripts/3_OTP_routing.py
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import polyline
+
+import synthetic
+
+# The utils package lives in scripts/
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(benchmarks_dir), 'scripts'))
+
+from utils.geodesy import geodesic_distance_km
+
+PLAN_PATH = '/otp/routers/default/plan'
+
+# Network distance over geodesic distance per requested mode
+DETOUR_FACTORS = {'CAR': 1.3, 'BICYCLE': 1.25, 'TRANSIT': 1.4}
+
+# Planning time per mode relative to the configured latency
+MODE_LATENCY_FACTORS = {'CAR': 1.0, 'BICYCLE': 0.8, 'TRANSIT': 2.0}
+
+# Spacing of the polyline points (metres)
+POINT_SPACING_M = 150
+
+
+def parse_latency(spec):
+    """
+    Parse a latency distribution.
+
+    Parameters:
+    spec (str): 'fixed:MS', 'uniform:LOW_MS,HIGH_MS' or 'lognormal:MEDIAN_MS,SIGMA'.
+
+    Returns:
+    callable: Draws one latency in seconds from a numpy Generator.
+    """
+    kind, _, values = spec.partition(':')
+    try:
+        values = [float(value) for value in values.split(',')] if values else []
+    except ValueError:
+        raise ValueError(f"Invalid latency '{spec}'")
+    if kind == 'fixed' and len(values) == 1:
+        return lambda rng: values[0] / 1000
+    if kind == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == 'lognormal' and len(values) == 2:
+        return lambda rng: rng.lognormal(np.log(values[0]), values[1]) / 1000
+    raise ValueError(f"Invalid latency '{spec}', expected fixed:MS, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA")
+
+
+def _leg_geometry(rng, start, end, distance_m):
+    # Points along the straight line with some sideways jitter, like a street network
+    n_points = int(np.clip(distance_m / POINT_SPACING_M, 2, 300))
+    fraction = np.linspace(0, 1, n_points)[:, None]
+    points = start + (end - start) * fraction
+    points[1:-1] += rng.normal(0, 0.0005, (n_points - 2, 2))
+    return polyline.encode([tuple(point) for point in points.round(5)])
+
+
+class MockPlanner:
+    """
+    Plans synthetic itineraries with injected latency and failures.
+
+    Parameters:
+    latency (str): The latency distribution, see ``parse_latency``.
+    error_rate (float): Share of requests answered with HTTP 500.
+    no_route_rate (float): Share of requests answered with PATH_NOT_FOUND.
+    hang_rate (float): Share of requests held for ``hang_seconds``.
+    hang_seconds (float): How long hanging requests are held.
+    threads (int, optional): Requests planned at once (default: unlimited).
+    max_queue (int, optional): Waiting requests before rejecting with HTTP 503 (default: unlimited).
+    seed (int): The random seed.
+    """
+
+    def __init__(self, latency='lognormal:250,0.5', error_rate=0.0, no_route_rate=0.0, hang_rate=0.0,
+                 hang_seconds=120.0, threads=None, max_queue=None, seed=0):
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.no_route_rate = no_route_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.max_queue = max_queue
+        self.seed = seed
+        self.workers = threading.BoundedSemaphore(threads) if threads else None
+        self.requests = itertools.count()
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.counts = {}
+
+    def count(self, outcome):
+        with self.lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+    def reset_counts(self):
+        with self.lock:
+            self.counts = {}
+
+    def plan(self, rng, query):
+        """
+        Build the ``/plan`` response for one request.
+
+        Parameters:
+        rng (numpy.random.Generator): The random generator of this request.
+        query (dict): The query parameters (single values).
+
+        Returns:
+        dict: The response JSON.
+        """
+        mode = query.get('mode', 'TRANSIT').upper()
+        origin = np.array([float(value) for value in query['fromPlace'].split(',')])
+        destination = np.array([float(value) for value in query['toPlace'].split(',')])
+        departure = datetime.strptime(f"{query.get('date')} {query.get('time')}", '%Y-%m-%d %H:%M:%S')
+
+        direct_m = float(geodesic_distance_km(origin[0], origin[1], destination[0], destination[1])) * 1000
+        distance_m = max(direct_m * DETOUR_FACTORS.get(mode, 1.3), 100.0)
+        parts = synthetic.itinerary_parts(rng, mode, distance_m)
+
+        # Place the leg ends along the OD line in proportion to the leg distances
+        ends = np.cumsum([0.0] + [leg_distance for _, leg_distance in parts])
+        points = [origin + (destination - origin) * fraction for fraction in ends / ends[-1]]
+        geometries = [_leg_geometry(rng, points[k], points[k + 1], parts[k][1]) for k in range(len(parts))]
+        places = ['Origin'] + [f"Stop {int(rng.integers(1000, 9999))}" for _ in parts[1:]] + ['Destination']
+
+        response = synthetic.build_plan(rng, mode, parts, departure.timestamp(), geometries, places)
+        for leg, start, end in zip(response['plan']['itineraries'][0]['legs'], points, points[1:]):
+            leg['from'].update({'lat': float(start[0]), 'lon': float(start[1])})
+            leg['to'].update({'lat': float(end[0]), 'lon': float(end[1])})
+        response['requestParameters'].update(query)
+        return response
+
+    def respond(self, query):
+        """
+        Answer one request, sleeping for its latency.
+
+        Parameters:
+        query (dict): The query parameters (single values).
+
+        Returns:
+        tuple: (HTTP status, response body as bytes).
+        """
+        rng = np.random.default_rng([self.seed, next(self.requests)])
+        with self.lock:
+            if self.max_queue is not None and self.waiting >= self.max_queue:
+                self.counts['rejected'] = self.counts.get('rejected', 0) + 1
+                return 503, b"Server overloaded"
+            self.waiting += 1
+        if self.workers is not None:
+            self.workers.acquire()
+        with self.lock:
+            self.waiting -= 1
+        try:
+            draw = rng.random()
+            if draw < self.hang_rate:
+                self.count('hang')
+                time.sleep(self.hang_seconds)
+                return 504, b"Request held by the mock"
+            time.sleep(self.latency(rng) * MODE_LATENCY_FACTORS.get(query.get('mode', '').upper(), 1.0))
+            if draw < self.hang_rate + self.error_rate:
+                self.count('error')
+                return 500, b"Internal server error (injected by the mock)"
+            if draw < self.hang_rate + self.error_rate + self.no_route_rate:
+                self.count('no_route')
+                body = {'requestParameters': query,
+                        'error': {'id': 404, 'msg': 'PATH_NOT_FOUND', 'message': 'No trip found.', 'noPath': True}}
+                return 200, json.dumps(body).encode()
+            try:
+                body = self.plan(rng, query)
+            except (KeyError, ValueError) as e:
+                self.count('bad_request')
+                return 400, f"Invalid request: {e}".encode()
+            self.count('ok')
+            return 200, json.dumps(body).encode()
+        finally:
+            if self.workers is not None:
+                self.workers.release()
+
+
+class PlanHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like OTP's HTTP server
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != PLAN_PATH:
+            status, body = 404, b"Not found"
+        else:
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            status, body = self.server.planner.respond(query)
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json' if status == 200 else 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up waiting (timeout), which is what hanging requests are for
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        # One line per request would swamp a load test
+        pass
+
+
+def start_server(planner, host='127.0.0.1', port=0):
+    """
+    Serve a planner from a background thread.
+
+    Parameters:
+    planner (MockPlanner): The planner.
+    host (str): The interface to bind.
+    port (int): The port (0 picks a free one).
+
+    Returns:
+    tuple: (server, plan URL); stop the server with ``server.shutdown()``.
+    """
+    server = ThreadingHTTPServer((host, port), PlanHandler)
+    server.daemon_threads = True
+    server.planner = planner
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}{PLAN_PATH}"
+
+
+def add_planner_arguments(parser):
+    parser.add_argument('--latency', default='lognormal:250,0.5',
+                        help="Latency distribution: fixed:MS, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA (default: lognormal:250,0.5).")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with HTTP 500.")
+    parser.add_argument('--no-route-rate', type=float, default=0.0, help="Share of requests answered with PATH_NOT_FOUND.")
+    parser.add_argument('--hang-rate', type=float, default=0.0, help="Share of requests held for --hang-seconds.")
+    parser.add_argument('--hang-seconds', type=float, default=120.0, help="How long hanging requests are held (default: 120).")
+    parser.add_argument('--server-threads', type=int, default=None, help="Requests planned at once (default: unlimited).")
+    parser.add_argument('--max-queue', type=int, default=None, help="Waiting requests before answering 503 (default: unlimited).")
+
+
+def planner_from_arguments(args, seed=0):
+    return MockPlanner(latency=args.latency, error_rate=args.error_rate, no_route_rate=args.no_route_rate,
+                       hang_rate=args.hang_rate, hang_seconds=args.hang_seconds, threads=args.server_threads,
+                       max_queue=args.max_queue, seed=seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--seed', type=int, default=0)
+    add_planner_arguments(parser)
+    args = parser.parse_args()
+
+    server, url = start_server(planner_from_arguments(args, args.seed), args.host, args.port)
+    print(f"Mock OTP planner listening on {url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
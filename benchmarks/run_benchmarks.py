@@ -0,0 +1,434 @@
+"""Benchmarks of the pipeline stages on synthetic data at 10k, 1M or 10M rows.
+
+Each benchmark prepares its input untimed and yields the work to time, in one
+or more chunks; the chunk times are summed. Results are appended to
+``benchmarks/results/history.jsonl`` together with the git commit, so the
+same benchmark can be compared across commits:
+
+    python benchmarks/run_benchmarks.py --scale 10k
+    python benchmarks/run_benchmarks.py --scale 1m route_parsing co2_calculation
+
+Generated inputs are cached in ``benchmarks/data/<scale>/``. Benchmarks that
+loop in Python over every row are capped (see ``max_rows``) so that the 10M
+scale finishes in reasonable time; the number of rows actually used is
+recorded with every result, and ``--no-caps`` lifts the caps.
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic
+
+# The stage scripts and the utils package live in scripts/
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+repository_dir = os.path.dirname(benchmarks_dir)
+sys.path.insert(0, os.path.join(repository_dir, 'scripts'))
+
+SCALES = {'10k': 10000, '1m': 1000000, '10m': 10000000}
+HISTORY_PATH = os.path.join(benchmarks_dir, 'results', 'history.jsonl')
+
+# name -> (function, description, max_rows)
+BENCHMARKS = {}
+
+
+def benchmark(name, description, max_rows=None):
+    """Register a benchmark generator function taking a BenchmarkData."""
+    def decorator(function):
+        BENCHMARKS[name] = (function, description, max_rows)
+        return function
+    return decorator
+
+
+def load_script(module_name):
+    # The numbered stage scripts are not valid identifiers, so they are imported by name
+    return importlib.import_module(module_name)
+
+
+class BenchmarkData:
+    """
+    The synthetic inputs of one scale, generated on first use.
+
+    Parameters:
+    scale (str): The scale name, e.g. '1m'.
+    rows (int): The number of rows for this benchmark.
+    seed (int): The random seed of the generators.
+    """
+
+    def __init__(self, scale, rows, seed=0):
+        self.scale = scale
+        self.rows = rows
+        self.seed = seed
+        self.data_dir = os.path.join(benchmarks_dir, 'data', scale)
+        self.scratch_dir = tempfile.mkdtemp(prefix='co2commute-bench-')
+
+    def path(self, name):
+        return os.path.join(self.data_dir, f"{name}_{self.rows}_seed{self.seed}.csv")
+
+    def georef_csv(self):
+        return synthetic.ensure(os.path.join(self.data_dir, f"georef_seed{self.seed}.csv"),
+                                synthetic.write_georef, seed=self.seed)
+
+    def odin_csv(self):
+        return synthetic.ensure(self.path('odin'), synthetic.write_odin, self.rows, seed=self.seed)
+
+    def route_summary_csv(self):
+        process_route = load_script('3_OTP_routing').process_route
+        return synthetic.ensure(self.path('route_summary'), synthetic.write_route_summary, self.rows,
+                                process_route, seed=self.seed)
+
+    def co2_summary_csv(self):
+        return synthetic.ensure(self.path('co2_summary'), synthetic.write_co2_summary, self.rows, seed=self.seed)
+
+    def rdw_csvs(self):
+        return (synthetic.ensure(self.path('rdw_registry'), synthetic.write_rdw_registry, self.rows, seed=self.seed),
+                synthetic.ensure(self.path('rdw_fuel'), synthetic.write_rdw_fuel, self.rows, seed=self.seed))
+
+
+@benchmark('odin_load_filter', "EDA_ODiN: chunked load, work-commute filter, column refinement")
+def bench_odin_load_filter(data):
+    eda = load_script('EDA_ODiN')
+    file_path = data.odin_csv()
+
+    def run():
+        df = eda.load_data(file_path)
+        df_filtered = eda.filter_work_related_commutes(df)
+        refined_commutes = eda.add_time_columns(df_filtered, eda.refine_columns(df_filtered))
+        eda.map_mode_of_transport(refined_commutes)
+    yield run
+
+
+@benchmark('top_postcodes', "Top origin/destination PC4 extraction (EDA_ODiN and 1_Zipcode_Processing)")
+def bench_top_postcodes(data):
+    eda = load_script('EDA_ODiN')
+    zipcodes = load_script('1_Zipcode_Processing')
+    df = eda.load_data(data.odin_csv())
+    df_filtered = eda.filter_work_related_commutes(df)
+    refined_commutes = eda.refine_columns(df_filtered)
+    eda.output_dir = data.scratch_dir
+
+    def run():
+        eda.save_top_zipcodes(refined_commutes, refined_commutes.shape[0])
+        zipcodes.generate_top_zipcodes(refined_commutes, data.scratch_dir)
+    yield run
+
+
+@benchmark('polygon_sampling', "2_Address_Processing: rejection sampling of points in PC4 polygons", max_rows=1000000)
+def bench_polygon_sampling(data):
+    import json
+    import numpy as np
+    from shapely.geometry import shape
+    addresses = load_script('2_Address_Processing')
+    from utils.pc4_lookup import load_pc4_shapes
+
+    geo_shapes = load_pc4_shapes(data.georef_csv())
+    polygons = [shape(json.loads(geo_shape)) for geo_shape in geo_shapes]
+    order = np.random.default_rng(data.seed).integers(len(polygons), size=data.rows)
+
+    def run():
+        for index in order:
+            addresses.generate_random_point_within_polygon(polygons[index])
+    yield run
+
+
+@benchmark('route_parsing', "3_OTP_routing.process_route on OTP plan responses", max_rows=1000000)
+def bench_route_parsing(data):
+    routing = load_script('3_OTP_routing')
+    pool = synthetic.geometry_pool(data.seed)
+    plans = synthetic.generate_otp_plans(data.rows, data.seed, pool)
+    chunk_rows = 100000
+    while True:
+        # Plans are generated per chunk (untimed) to bound memory at large scales
+        chunk = [mode_and_plan for _, mode_and_plan in zip(range(chunk_rows), plans)]
+        if not chunk:
+            break
+
+        def run(chunk=chunk):
+            for mode, plan in chunk:
+                routing.process_route(plan, mode)
+        yield run
+
+
+@benchmark('route_store', "utils.route_store: OTP plans into the columnar route store", max_rows=1000000)
+def bench_route_store(data):
+    from datetime import datetime
+    from utils.route_store import RouteStore
+    pool = synthetic.geometry_pool(data.seed)
+    plans = synthetic.generate_otp_plans(data.rows, data.seed, pool)
+    origin = {'Address': 'Street 0, 1000 Netherlands', 'Latitude': 52.37, 'Longitude': 4.89}
+    destination = {'Address': 'Road 0, 3500 Netherlands', 'Latitude': 52.09, 'Longitude': 5.12}
+    departure_time = datetime(2023, 3, 12, 8, 0)
+    chunk_rows = 100000
+    while True:
+        chunk = [mode_and_plan for _, mode_and_plan in zip(range(chunk_rows), plans)]
+        if not chunk:
+            break
+
+        def run(chunk=chunk):
+            store = RouteStore()
+            for mode, plan in chunk:
+                store.add_route(store.add_pair(origin, destination), plan, mode, departure_time, 'morning')
+        yield run
+
+
+@benchmark('co2_calculation', "4_CO2_Calculator: per-leg TTW/WTW emissions and distance groups", max_rows=2000000)
+def bench_co2_calculation(data):
+    import ast
+    import pandas as pd
+    calculator = load_script('4_CO2_Calculator')
+    for chunk in pd.read_csv(data.route_summary_csv(), usecols=['total_km', 'all_legs'], chunksize=200000):
+        trips = [(total_km, ast.literal_eval(all_legs)) for total_km, all_legs in zip(chunk['total_km'], chunk['all_legs'])]
+
+        def run(trips=trips):
+            for total_km, legs in trips:
+                for leg in legs:
+                    calculator.calculate_co2_emissions_method_1(leg['mode'], leg['distance_km'])
+                    calculator.calculate_co2_emissions_method_2(leg['mode'], leg['distance_km'])
+                calculator.classify_commute_distance(total_km)
+        yield run
+
+
+@benchmark('geojson_export', "4_CO2_Calculator: polyline decoding and GeoJSON FeatureCollection export", max_rows=200000)
+def bench_geojson_export(data):
+    import ast
+    import json
+    import pandas as pd
+    from geojson import Feature, FeatureCollection
+    calculator = load_script('4_CO2_Calculator')
+    df = pd.read_csv(data.route_summary_csv(), usecols=['all_legs'])
+    legs = [leg for all_legs in df['all_legs'] for leg in ast.literal_eval(all_legs)]
+    output_file_geojson = os.path.join(data.scratch_dir, 'export.geojson')
+
+    def run():
+        features = []
+        for leg_index, leg in enumerate(legs):
+            geometry = calculator.polyline_to_geojson(leg['leg_geometry'])
+            if geometry:
+                features.append(Feature(geometry=geometry, properties={'leg_id': leg_index, 'mode': leg['mode']}))
+        with open(output_file_geojson, 'w') as geojson_file:
+            json.dump(FeatureCollection(features), geojson_file, indent=4)
+    yield run
+
+
+@benchmark('co2_pipeline', "4_CO2_Calculator.process_trip_legs_for_qgis end to end (CSV + GeoJSON)", max_rows=200000)
+def bench_co2_pipeline(data):
+    calculator = load_script('4_CO2_Calculator')
+    input_file = data.route_summary_csv()
+
+    def run():
+        calculator.process_trip_legs_for_qgis(input_file, os.path.join(data.scratch_dir, 'co2.csv'),
+                                              os.path.join(data.scratch_dir, 'co2.geojson'))
+    yield run
+
+
+@benchmark('hypothesis_tests', "5_Hypothesis_Testing: H1-H7 parametric tests and the H8 streaming regression",
+           max_rows=2000000)
+def bench_hypothesis_tests(data):
+    import numpy as np
+    import pandas as pd
+    from utils.group_stats import GroupedStatistics
+    testing = load_script('5_Hypothesis_Testing')
+    file_path = data.co2_summary_csv()
+    df = pd.read_csv(file_path)
+
+    # Trips with a missing group key belong to no group; the other groups keep their exact statistics
+    column = df.select_dtypes('number').columns[0]
+    missing_mode = df[['mode', column]].copy()
+    missing_mode.loc[missing_mode.index[::7], 'mode'] = None
+    moments = GroupedStatistics(missing_mode).moments('mode', [column])
+    for mode, rows in missing_mode.dropna(subset=['mode']).groupby('mode')[column]:
+        rows = rows.dropna()
+        if moments[mode].n != len(rows) or not np.isclose(moments[mode].mean_of(column), rows.mean()):
+            raise RuntimeError(f"Wrong {column} statistics of mode {mode} with missing modes in the data")
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            testing.run_parametric_tests(testing.prepare_trips(df))
+            testing.run_regression(file_path)
+    yield run
+
+
+@benchmark('distance_computation', "PC4 centroid lookup and vectorised geodesic distances")
+def bench_distance_computation(data):
+    import numpy as np
+    import pandas as pd
+    from utils.geodesy import geodesic_distance_km
+    from utils.pc4_lookup import PC4Centroids
+
+    centroids = PC4Centroids.from_georef(data.georef_csv())
+    codes, _, _ = synthetic.postcodes(data.seed)
+    rng = np.random.default_rng(data.seed)
+    chunk_rows = 1000000
+    for start in range(0, data.rows, chunk_rows):
+        n = min(chunk_rows, data.rows - start)
+        trips = pd.DataFrame({'OriginZipCode': rng.choice(codes, n), 'DestinationZipCode': rng.choice(codes, n)})
+
+        def run(trips=trips):
+            centroids.attach(trips, 'OriginZipCode', 'lat_origin', 'lon_origin')
+            centroids.attach(trips, 'DestinationZipCode', 'lat_destination', 'lon_destination')
+            geodesic_distance_km(trips['lat_origin'], trips['lon_origin'],
+                                 trips['lat_destination'], trips['lon_destination'])
+        yield run
+
+
+@benchmark('fleet_factors', "Fleet-mix car factors: partitioned join and counts of the RDW exports")
+def bench_fleet_factors(data):
+    from utils.fleet_factors import stream_fleet_counts, weighted_factors
+    registry_path, fuel_path = data.rdw_csvs()
+
+    def run():
+        weighted_factors(stream_fleet_counts(registry_path, fuel_path, work_dir=data.scratch_dir))
+    yield run
+
+
+@benchmark('odin_dataset', "utils.odin_dataset: three survey years to Parquet, then their work commutes by pushdown")
+def bench_odin_dataset(data):
+    from utils.odin_dataset import ROW_GROUP_SIZE, row_groups_read, write_odin_year
+    eda = load_script('EDA_ODiN')
+    file_path = data.odin_csv()
+    dataset_path = os.path.join(data.scratch_dir, 'odin')
+    years = [2021, 2022, 2023]
+    # Smaller row groups at small scales, so a purpose partition still spans several of them
+    row_group_size = max(min(ROW_GROUP_SIZE, data.rows // 100), 1)
+
+    def convert():
+        for year in years:
+            write_odin_year(file_path, dataset_path, year, row_group_size=row_group_size)
+    yield convert
+
+    # The row group statistics have to let a single-mode query skip row groups of its partition
+    partition = row_groups_read(dataset_path, years=years[:1], purposes=[1])[0]
+    single_mode = row_groups_read(dataset_path, years=years[:1], purposes=[1], modes=[1])[0]
+    if not single_mode < partition:
+        raise RuntimeError(f"A single-mode query reads {single_mode} of the {partition} row groups of its partition")
+
+    def extract():
+        df_filtered = eda.filter_work_related_commutes(eda.load_dataset_years(dataset_path, years))
+        refined_commutes = eda.add_time_columns(df_filtered, eda.refine_columns(df_filtered))
+        eda.map_mode_of_transport(refined_commutes)
+    yield extract
+
+
+def run_benchmark(name, scale, repeat=3, seed=0, caps=True):
+    """
+    Time one benchmark.
+
+    Parameters:
+    name (str): The benchmark name.
+    scale (str): The scale name.
+    repeat (int): The number of timed repetitions.
+    seed (int): The random seed of the synthetic data.
+    caps (bool): Apply the benchmark's row cap.
+
+    Returns:
+    dict: The result record (as stored in the history).
+    """
+    function, _, max_rows = BENCHMARKS[name]
+    rows = SCALES[scale] if not caps or max_rows is None else min(SCALES[scale], max_rows)
+    data = BenchmarkData(scale, rows, seed)
+    timings = []
+    for _ in range(repeat):
+        elapsed = 0.0
+        for work in function(data):
+            started = time.perf_counter()
+            work()
+            elapsed += time.perf_counter() - started
+        timings.append(elapsed)
+    shutil.rmtree(data.scratch_dir, ignore_errors=True)
+    return {
+        'benchmark': name,
+        'scale': scale,
+        'rows': rows,
+        'seed': seed,
+        'repeat': repeat,
+        'timings_s': [round(timing, 6) for timing in timings],
+        'best_s': round(min(timings), 6),
+        'median_s': round(statistics.median(timings), 6),
+        'rows_per_s': round(rows / min(timings), 1) if min(timings) > 0 else None,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def git_revision():
+    """Return (commit, dirty) of the repository, or (None, None) outside a git checkout."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repository_dir, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repository_dir,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def environment():
+    commit, dirty = git_revision()
+    return {'commit': commit, 'dirty': dirty, 'python': platform.python_version(),
+            'machine': platform.node(), 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def load_history(path=HISTORY_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path) as history_file:
+        return [json.loads(line) for line in history_file if line.strip()]
+
+
+def previous_result(history, record):
+    """The latest earlier result of the same benchmark, scale, rows and machine."""
+    for entry in reversed(history):
+        if all(entry.get(key) == record[key] for key in ('benchmark', 'scale', 'rows', 'seed', 'machine')):
+            return entry
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data.")
+    parser.add_argument('benchmarks', nargs='*', help=f"Benchmarks to run (default: all): {', '.join(BENCHMARKS)}")
+    parser.add_argument('--scale', choices=SCALES, default='10k', help="Number of synthetic rows (default: 10k).")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed repetitions per benchmark (default: 3).")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic data.")
+    parser.add_argument('--no-caps', action='store_true', help="Use the full scale also for the per-row Python benchmarks.")
+    parser.add_argument('--history', default=HISTORY_PATH, help="JSON-lines file the results are appended to.")
+    parser.add_argument('--list', action='store_true', help="List the benchmarks and exit.")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, (_, description, max_rows) in BENCHMARKS.items():
+            cap = f" (capped at {max_rows:,} rows)" if max_rows else ""
+            print(f"{name:<22} {description}{cap}")
+        return
+
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    history = load_history(args.history)
+    run_environment = environment()
+    os.makedirs(os.path.dirname(args.history), exist_ok=True)
+    print(f"{'Benchmark':<22} {'Rows':>10} {'Best (s)':>10} {'Median (s)':>11} {'Rows/s':>12} {'vs previous':>12}")
+    for name in args.benchmarks or BENCHMARKS:
+        record = run_benchmark(name, args.scale, args.repeat, args.seed, caps=not args.no_caps)
+        record.update(run_environment)
+        record['timestamp'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        previous = previous_result(history, record)
+        change = f"{(record['best_s'] / previous['best_s'] - 1) * 100:+.1f}%" if previous and previous['best_s'] else ''
+        print(f"{name:<22} {record['rows']:>10,} {record['best_s']:>10.3f} {record['median_s']:>11.3f} "
+              f"{record['rows_per_s'] or 0:>12,.0f} {change:>12}")
+        with open(args.history, 'a') as history_file:
+            history_file.write(json.dumps(record) + '\n')
+        history.append(record)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""Synthetic inputs for the benchmarks, shaped like the real pipeline data.
+
+All generators are seeded and stream their output in chunks, so the 10M-row
+scale can be produced without holding it in memory:
+
+- ``write_georef``: PC4 polygons and centroids in the cleaned georef format.
+- ``write_odin``: ODiN 2022 survey rows (';'-separated, latin1) with the
+  columns used by ``EDA_ODiN``; persons without trips have blank trip fields.
+- ``generate_otp_plans``: OTP ``/plan`` responses with walking, cycling, car
+  and transit legs, encoded polylines and transit metadata. ``itinerary_parts``
+  and ``build_plan`` are shared with the mock OTP server.
+- ``write_route_summary``: the ``3_OTP_routing`` output built from those plans.
+- ``write_co2_summary``: the ``4_CO2_Calculator`` summary used by the tests.
+- ``write_rdw_registry`` and ``write_rdw_fuel``: the RDW registered vehicle and
+  fuel exports (one fuel row per vehicle and fuel) read by ``utils.fleet_factors``.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import polyline
+
+# Bounding box of the Netherlands (degrees)
+NL_LAT = (50.75, 53.45)
+NL_LON = (3.40, 7.20)
+
+# Approximate number of PC4 areas
+N_POSTCODES = 4000
+
+# ODiN main mode (Hvm) codes and their approximate share of commuting trips
+HVM_CODES = np.array([1, 2, 3, 4, 5, 6, 7, 9, 11, 12, 13, 17, 19, 22])
+HVM_SHARES = np.array([0.42, 0.03, 0.07, 0.22, 0.04, 0.02, 0.02, 0.01, 0.09, 0.005, 0.02, 0.005, 0.04, 0.01])
+
+# ODiN trip purposes (MotiefV); 1 (to work) and 3 (business) are work related
+MOTIEF_CODES = np.arange(1, 13)
+MOTIEF_SHARES = np.array([0.18, 0.03, 0.05, 0.03, 0.20, 0.06, 0.14, 0.10, 0.12, 0.04, 0.03, 0.02])
+
+# Share of ODiN rows describing persons without trips (blank trip fields)
+NO_TRIP_SHARE = 0.1
+
+# Routed mode shares and log-normal distance parameters (km)
+ROUTE_MODES = ['CAR', 'BICYCLE', 'TRANSIT']
+ROUTE_MODE_SHARES = [0.55, 0.25, 0.20]
+ROUTE_DISTANCE_LOGNORMAL = {'CAR': (2.7, 0.7), 'BICYCLE': (1.6, 0.6), 'TRANSIT': (3.0, 0.6)}
+MODE_SPEED_KMH = {'CAR': 55.0, 'BICYCLE': 16.0, 'WALK': 4.8, 'BUS': 25.0, 'TRAM': 18.0, 'SUBWAY': 32.0, 'RAIL': 80.0}
+TRANSIT_VEHICLES = ['BUS', 'TRAM', 'SUBWAY', 'RAIL']
+TRANSIT_VEHICLE_SHARES = [0.35, 0.1, 0.05, 0.5]
+
+# Number of distinct leg geometries reused by the plan generator (encoding is the slow part)
+GEOMETRY_POOL_SIZE = 2000
+
+
+def postcodes(seed=0, n_postcodes=N_POSTCODES):
+    """
+    Draw the synthetic PC4 codes and their centroids.
+
+    Returns:
+    tuple: (codes, lat, lon) arrays.
+    """
+    rng = np.random.default_rng(seed)
+    codes = np.sort(rng.choice(np.arange(1000, 10000), n_postcodes, replace=False))
+    lat = rng.uniform(*NL_LAT, n_postcodes)
+    lon = rng.uniform(*NL_LON, n_postcodes)
+    return codes, lat, lon
+
+
+def write_georef(path, seed=0, n_postcodes=N_POSTCODES):
+    """
+    Write PC4 areas as irregular star-shaped polygons in the cleaned georef format.
+
+    Parameters:
+    path (str): The output CSV (columns PC4, Geo Point, Geo Shape).
+    seed (int): The random seed.
+    n_postcodes (int): The number of PC4 areas.
+    """
+    codes, lat, lon = postcodes(seed, n_postcodes)
+    rng = np.random.default_rng(seed + 1)
+    rows = []
+    for code, centre_lat, centre_lon in zip(codes, lat, lon):
+        n_vertices = rng.integers(8, 24)
+        angles = np.sort(rng.uniform(0, 2 * np.pi, n_vertices))
+        # 0.5-4 km radius, wider in longitude to keep the areas roughly round at 52 degrees north
+        radius = rng.uniform(0.005, 0.035) * rng.uniform(0.6, 1.0, n_vertices)
+        ring = np.column_stack([centre_lon + 1.6 * radius * np.cos(angles), centre_lat + radius * np.sin(angles)])
+        ring = np.vstack([ring, ring[:1]]).round(6).tolist()
+        rows.append({'PC4': int(code), 'Geo Point': f"{centre_lat:.6f}, {centre_lon:.6f}",
+                     'Geo Shape': json.dumps({'type': 'Polygon', 'coordinates': [ring]})})
+    pd.DataFrame(rows).to_csv(path, index=False)
+
+
+def write_odin(path, n_rows, seed=0, chunk_rows=500000):
+    """
+    Write synthetic ODiN survey rows.
+
+    Origins and destinations follow a Zipf-like popularity over the PC4 codes so
+    the top-postcode rankings look like the real ones.
+
+    Parameters:
+    path (str): The output CSV (';'-separated, latin1, like the ODiN export).
+    n_rows (int): The number of rows.
+    seed (int): The random seed.
+    chunk_rows (int): The number of rows generated and written at a time.
+    """
+    codes, _, _ = postcodes(seed)
+    popularity = 1 / np.arange(1, len(codes) + 1) ** 0.8
+    popularity /= popularity.sum()
+    rng = np.random.default_rng(seed + 2)
+    popularity_order = rng.permutation(codes)
+
+    written = 0
+    with open(path, 'w', encoding='latin1', newline='') as odin_file:
+        while written < n_rows:
+            n = min(chunk_rows, n_rows - written)
+            hour = np.clip(np.rint(rng.normal(np.where(rng.random(n) < 0.6, 8, 17), 1.2)), 0, 23).astype(int)
+            minute = rng.integers(0, 60, n)
+            duration = np.clip(np.rint(rng.lognormal(3.0, 0.6, n)), 1, 300).astype(int)
+            arrival = hour * 60 + minute + duration
+            worker = rng.random(n) < 0.6
+            chunk = pd.DataFrame({
+                'OPID': np.arange(written, written + n) // 3 + 1,
+                'VerplID': np.arange(written, written + n) + 1,
+                'Jaar': 2022,
+                'Maand': rng.integers(1, 13, n),
+                'Dag': rng.integers(1, 29, n),
+                'Geslacht': rng.integers(1, 3, n),
+                'Leeftijd': rng.integers(6, 90, n),
+                'MotiefV': rng.choice(MOTIEF_CODES, n, p=MOTIEF_SHARES),
+                'VertPC': np.where(rng.random(n) < 0.01, 0, rng.choice(popularity_order, n, p=popularity)),
+                'AankPC': np.where(rng.random(n) < 0.01, 0, rng.choice(popularity_order, n, p=popularity)),
+                'Reisduur': duration,
+                'Hvm': rng.choice(HVM_CODES, n, p=HVM_SHARES / HVM_SHARES.sum()),
+                'VertUur': hour,
+                'VertMin': minute,
+                'AankUur': (arrival // 60) % 24,
+                'AankMin': arrival % 60,
+                'WrkVervw': np.where(worker, rng.integers(1, 11, n), rng.integers(11, 14, n)),
+                'WrkVerg': np.where(worker, rng.integers(0, 2, n), 2),
+                # Survey weights (trips and persons represented by the row)
+                'FactorV': rng.lognormal(9.5, 0.6, n).round(3),
+                'FactorP': rng.lognormal(9.0, 0.6, n).round(3),
+            })
+            for column in ['VergVast', 'VergKm', 'VergBrSt', 'VergOV', 'VergAans', 'VergVoer', 'VergBudg',
+                           'VergPark', 'VergStal', 'VergAnd']:
+                # Reimbursement questions are only asked to workers; blank otherwise
+                chunk[column] = pd.Series((rng.random(n) < 0.2).astype(int)).where(worker).astype('Int64')
+
+            # Persons without trips have blank trip fields, which keeps the trip columns textual
+            trip_columns = ['MotiefV', 'VertPC', 'AankPC', 'Reisduur', 'Hvm', 'VertUur', 'VertMin', 'AankUur', 'AankMin']
+            chunk[trip_columns] = chunk[trip_columns].astype(str)
+            chunk.loc[rng.random(n) < NO_TRIP_SHARE, trip_columns] = ' '
+
+            chunk.to_csv(odin_file, sep=';', index=False, header=written == 0)
+            written += n
+
+
+def geometry_pool(seed=0, size=GEOMETRY_POOL_SIZE):
+    """Encoded polylines of random street-like walks of 10-200 points in the Netherlands."""
+    rng = np.random.default_rng(seed + 3)
+    pool = []
+    for _ in range(size):
+        n_points = rng.integers(10, 200)
+        start = [rng.uniform(*NL_LAT), rng.uniform(*NL_LON)]
+        steps = rng.normal(0, 0.0015, (n_points, 2)) + rng.normal(0, 0.0008, 2)
+        pool.append(polyline.encode([tuple(point) for point in (start + np.cumsum(steps, axis=0)).round(5)]))
+    return pool
+
+
+def _leg(rng, mode, distance_m, start_time, geometry, stop_names):
+    duration = distance_m / 1000 / MODE_SPEED_KMH[mode] * 3600
+    leg = {
+        'mode': mode,
+        'distance': float(distance_m),
+        'duration': float(duration),
+        'startTime': int(start_time * 1000),
+        'endTime': int((start_time + duration) * 1000),
+        'from': {'name': stop_names[0], 'lat': 0.0, 'lon': 0.0},
+        'to': {'name': stop_names[1], 'lat': 0.0, 'lon': 0.0},
+        'legGeometry': {'points': geometry, 'length': len(geometry) // 4},
+        'transitLeg': mode in TRANSIT_VEHICLES,
+    }
+    if mode in TRANSIT_VEHICLES:
+        agency = 'NS' if mode == 'RAIL' else str(rng.choice(['RET', 'GVB', 'HTM', 'Arriva', 'Connexxion']))
+        line = int(rng.integers(1, 400))
+        leg.update({
+            'agencyName': agency,
+            'agencyId': agency.upper(),
+            'route': str(line),
+            'routeLongName': f"{stop_names[0]} - {stop_names[1]}",
+            'tripId': f"1:{line}{int(rng.integers(1000, 9999))}",
+        })
+        leg['from']['stopId'] = f"1:{int(rng.integers(100000, 999999))}"
+        leg['to']['stopId'] = f"1:{int(rng.integers(100000, 999999))}"
+    return leg, start_time + duration
+
+
+def itinerary_parts(rng, mode, distance_m):
+    """
+    Split a trip into legs as OTP would plan it for the requested mode.
+
+    Parameters:
+    rng (numpy.random.Generator): The random generator.
+    mode (str): The requested mode (CAR, BICYCLE or TRANSIT).
+    distance_m (float): The trip distance in metres.
+
+    Returns:
+    list: (leg mode, leg distance in metres) tuples.
+    """
+    if mode != 'TRANSIT':
+        return [(mode, distance_m)]
+    vehicle = TRANSIT_VEHICLES[rng.choice(4, p=TRANSIT_VEHICLE_SHARES)]
+    walk_1, walk_2 = rng.uniform(100, 1200, 2)
+    parts = [('WALK', walk_1), (vehicle, max(distance_m - walk_1 - walk_2, 500))]
+    if vehicle == 'RAIL' and rng.random() < 0.4:
+        # Transfer to a bus for the last kilometres
+        parts += [('WALK', rng.uniform(50, 300)), ('BUS', rng.uniform(1000, 6000))]
+    parts.append(('WALK', walk_2))
+    return parts
+
+
+def build_plan(rng, mode, parts, start_time, geometries, places):
+    """
+    Assemble an OTP ``/plan`` response from its legs.
+
+    Parameters:
+    rng (numpy.random.Generator): The random generator (transit metadata).
+    mode (str): The requested mode.
+    parts (list): (leg mode, leg distance in metres) tuples, see ``itinerary_parts``.
+    start_time (float): The departure time (epoch seconds).
+    geometries (list): One encoded polyline per leg.
+    places (list): The names of the places between the legs (one more than the legs).
+
+    Returns:
+    dict: The response JSON.
+    """
+    legs = []
+    time = start_time
+    for k, (leg_mode, leg_distance) in enumerate(parts):
+        leg, time = _leg(rng, leg_mode, leg_distance, time, geometries[k], places[k:k + 2])
+        legs.append(leg)
+    return {
+        'requestParameters': {'mode': mode},
+        'plan': {'date': int(start_time * 1000), 'itineraries': [{
+            'duration': sum(leg['duration'] for leg in legs),
+            'startTime': legs[0]['startTime'],
+            'endTime': legs[-1]['endTime'],
+            'walkDistance': sum(leg['distance'] for leg in legs if leg['mode'] == 'WALK'),
+            'transfers': max(sum(leg['transitLeg'] for leg in legs) - 1, 0),
+            'legs': legs,
+        }]},
+    }
+
+
+def generate_otp_plans(n_plans, seed=0, pool=None):
+    """
+    Generate OTP ``/plan`` responses.
+
+    Parameters:
+    n_plans (int): The number of responses.
+    seed (int): The random seed.
+    pool (list, optional): Encoded leg geometries to draw from (default: ``geometry_pool(seed)``).
+
+    Yields:
+    tuple: (mode, plan) with the requested mode and the response JSON as a dict.
+    """
+    pool = pool or geometry_pool(seed)
+    rng = np.random.default_rng(seed + 4)
+    for index in range(n_plans):
+        mode = ROUTE_MODES[rng.choice(3, p=ROUTE_MODE_SHARES)]
+        mu, sigma = ROUTE_DISTANCE_LOGNORMAL[mode]
+        distance_m = rng.lognormal(mu, sigma) * 1000
+        start_time = 1678600800 + rng.integers(0, 3 * 3600)
+        places = [f"Street {index}-{k}" for k in range(6)]
+        parts = itinerary_parts(rng, mode, distance_m)
+        geometries = [pool[rng.integers(len(pool))] for _ in parts]
+        yield mode, build_plan(rng, mode, parts, start_time, geometries, places)
+
+
+def write_route_summary(path, n_rows, process_route, seed=0, chunk_rows=100000):
+    """
+    Write the ``3_OTP_routing`` route summary for synthetic plans.
+
+    Parameters:
+    path (str): The output CSV.
+    n_rows (int): The number of routed trips.
+    process_route (callable): ``3_OTP_routing.process_route``, used to build the rows as the pipeline does.
+    seed (int): The random seed.
+    chunk_rows (int): The number of rows written at a time.
+    """
+    codes, lat, lon = postcodes(seed)
+    rng = np.random.default_rng(seed + 5)
+    rows = []
+    header = True
+    with open(path, 'w', newline='') as summary_file:
+        for index, (mode, plan) in enumerate(generate_otp_plans(n_rows, seed)):
+            route = process_route(plan, mode)
+            origin, destination = rng.integers(len(codes), size=2)
+            rows.append({
+                'origin_address': f"Street {index}, {codes[origin]} Netherlands",
+                'destination_address': f"Road {index}, {codes[destination]} Netherlands",
+                'origin_latitude': lat[origin], 'origin_longitude': lon[origin],
+                'destination_latitude': lat[destination], 'destination_longitude': lon[destination],
+                'departure_time': '2023-03-12 08:00:00',
+                'time_of_day': 'morning',
+                'mode': route['mode'],
+                'total_km': route['total_km'],
+                'total_duration_min': route['total_duration_min'],
+                'transit_details': route['transit_details'],
+                'all_legs': route['all_legs'],
+                'route_shape': route['route_shape'],
+            })
+            if len(rows) == chunk_rows:
+                pd.DataFrame(rows).to_csv(summary_file, index=False, header=header)
+                header = False
+                rows = []
+        if rows or header:
+            pd.DataFrame(rows).to_csv(summary_file, index=False, header=header)
+
+
+def write_co2_summary(path, n_rows, seed=0, chunk_rows=1000000):
+    """
+    Write a ``4_CO2_Calculator`` summary (without leg geometries) for the hypothesis tests.
+
+    Parameters:
+    path (str): The output CSV.
+    n_rows (int): The number of trips.
+    seed (int): The random seed.
+    chunk_rows (int): The number of rows generated and written at a time.
+    """
+    ttw = {'CAR': 138.67, 'BICYCLE': 0.0, 'TRANSIT': 15}
+    wtw = {'CAR': 193, 'BICYCLE': 3, 'TRANSIT': 20}
+    rng = np.random.default_rng(seed + 6)
+    written = 0
+    while written < n_rows:
+        n = min(chunk_rows, n_rows - written)
+        mode = np.array(ROUTE_MODES)[rng.choice(3, n, p=ROUTE_MODE_SHARES)]
+        total_km = np.empty(n)
+        n_legs = np.ones(n, dtype=int)
+        for name, (mu, sigma) in ROUTE_DISTANCE_LOGNORMAL.items():
+            selected = mode == name
+            total_km[selected] = rng.lognormal(mu, sigma, selected.sum())
+        transit = mode == 'TRANSIT'
+        n_legs[transit] = rng.choice([3, 5], transit.sum(), p=[0.7, 0.3])
+        speed = np.select([mode == 'CAR', mode == 'BICYCLE'], [55.0, 16.0], 35.0) * rng.uniform(0.7, 1.2, n)
+        chunk = pd.DataFrame({
+            'trip_id': np.arange(written, written + n) + 1,
+            'mode': mode,
+            'total_km': total_km,
+            'total_duration_min': total_km / speed * 60,
+            'total_co2_emissions_method_1_g': total_km * pd.Series(mode).map(ttw).to_numpy(),
+            'total_co2_emissions_method_2_g': total_km * pd.Series(mode).map(wtw).to_numpy(),
+            'commute_distance_group': np.select([total_km < 10, total_km <= 30], ['short', 'medium'], 'long'),
+            'legs': ["[" + ", ".join(["{'leg_id': 'x'}"] * k) + "]" for k in n_legs],
+        })
+        chunk.to_csv(path, mode='w' if written == 0 else 'a', index=False, header=written == 0)
+        written += n
+
+
+# RDW fuels of a synthetic vehicle: (fuels, hybrid class) and its share of the passenger cars
+RDW_FUEL_COMBINATIONS = [
+    (['Benzine'], None, 0.70), (['Benzine', 'Elektriciteit'], 'NOVC-HEV', 0.13),
+    (['Benzine', 'Elektriciteit'], 'OVC-HEV', 0.02), (['Diesel'], None, 0.095),
+    (['Diesel', 'Elektriciteit'], 'OVC-HEV', 0.002), (['Elektriciteit'], None, 0.04),
+    (['LPG', 'Benzine'], None, 0.011), (['CNG', 'Benzine'], None, 0.001), (['Waterstof', 'Elektriciteit'], None, 0.001),
+]
+RDW_VEHICLE_KINDS = ['Personenauto', 'Bedrijfsauto', 'Motorfiets', 'Bromfiets']
+RDW_VEHICLE_KIND_SHARES = [0.80, 0.10, 0.06, 0.04]
+RDW_BODY_TYPES = ['hatchback', 'stationwagen', 'MPV', 'sedan', 'Niet nader aangeduid']
+RDW_BODY_TYPE_SHARES = [0.40, 0.25, 0.15, 0.15, 0.05]
+
+
+def _licence_plates(start, n):
+    return np.char.add('S', np.char.zfill(np.arange(start, start + n).astype(str), 8))
+
+
+def write_rdw_registry(path, n_rows, seed=0, chunk_rows=1000000):
+    """Write a synthetic RDW 'Gekentekende voertuigen' export (one row per vehicle)."""
+    rng = np.random.default_rng(seed + 5)
+    written = 0
+    with open(path, 'w', newline='') as registry_file:
+        while written < n_rows:
+            n = min(chunk_rows, n_rows - written)
+            # Newer vehicles are more common; the export writes dates as YYYYMMDD
+            admission = pd.Timestamp('2024-06-30') - pd.to_timedelta(np.minimum(rng.exponential(4500, n), 12500).astype(int), unit='D')
+            chunk = pd.DataFrame({
+                'Kenteken': _licence_plates(written, n),
+                'Voertuigsoort': rng.choice(RDW_VEHICLE_KINDS, n, p=RDW_VEHICLE_KIND_SHARES),
+                'Merk': 'SYNTHETIC',
+                'Inrichting': rng.choice(RDW_BODY_TYPES, n, p=RDW_BODY_TYPE_SHARES),
+                'Datum eerste toelating': admission.strftime('%Y%m%d'),
+            })
+            chunk.to_csv(registry_file, index=False, header=written == 0)
+            written += n
+
+
+def write_rdw_fuel(path, n_rows, seed=0, chunk_rows=1000000):
+    """Write a synthetic RDW 'Gekentekende voertuigen brandstof' export for the vehicles of write_rdw_registry."""
+    rng = np.random.default_rng(seed + 6)
+    shares = np.array([share for _, _, share in RDW_FUEL_COMBINATIONS])
+    written = 0
+    with open(path, 'w', newline='') as fuel_file:
+        while written < n_rows:
+            n = min(chunk_rows, n_rows - written)
+            plates = _licence_plates(written, n)
+            combination = rng.choice(len(RDW_FUEL_COMBINATIONS), n, p=shares / shares.sum())
+            parts = []
+            for index, (fuels, hybrid_class, _) in enumerate(RDW_FUEL_COMBINATIONS):
+                selected = plates[combination == index]
+                for number, fuel in enumerate(fuels):
+                    parts.append(pd.DataFrame({'Kenteken': selected, 'Brandstof volgnummer': number + 1,
+                                               'Brandstof omschrijving': fuel,
+                                               'Klasse hybride elektrisch voertuig': hybrid_class}))
+            chunk = pd.concat(parts).sort_values(['Kenteken', 'Brandstof volgnummer'], kind='stable')
+            chunk.to_csv(fuel_file, index=False, header=written == 0)
+            written += n
+
+
+def ensure(path, generator, *args, **kwargs):
+    """Run a generator unless its output already exists (generated data is reused across runs)."""
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.partial"
+        generator(temporary_path, *args, **kwargs)
+        os.replace(temporary_path, path)
+    return path
@@ -1,22 +1,19 @@
 import os
 import pandas as pd
+from utils import instrumentation
+from utils.pc4_lookup import load_pc4_centroids
 
-# Ensure the script uses its own directory as the working directory
+# Resolve the data paths relative to the script directory
 script_dir = os.path.dirname(os.path.abspath(__file__))
-os.chdir(script_dir)
 
 # Define the paths to the input and output datasets
-data_dir = '../data/'
+data_dir = os.path.join(script_dir, '../data/')
 raw_file_path = os.path.join(data_dir, 'raw/georef-netherlands-postcode-pc4.csv')
 processed_data_dir = os.path.join(data_dir, 'processed/')
 output_dir = os.path.join(data_dir, 'outputs/csv/')
 
 georef_file_path = os.path.join(processed_data_dir, 'cleaned_georef-netherlands-postcode-pc4.csv')
 
-# Ensure the output directories exist
-if not os.path.exists(processed_data_dir):
-    os.makedirs(processed_data_dir)
-
 # Step 1: Clean and save the geo-reference data
 def clean_georef_data(raw_file_path, processed_file_path):
     df = pd.read_csv(raw_file_path, delimiter=';')
@@ -41,11 +38,19 @@ def generate_top_zipcodes(refined_commutes, output_dir):
     print("Top 20 origin and destination zip codes saved.")
 
 def main():
+    # Ensure the output directories exist
+    if not os.path.exists(processed_data_dir):
+        os.makedirs(processed_data_dir)
+
     # Step 1: Clean geo-reference data
     clean_georef_data(raw_file_path, georef_file_path)
 
+    # Preload the PC4 centroids into the dense lookup cache shared by the other scripts
+    load_pc4_centroids(georef_file_path)
+
     # Load refined commutes data (assuming you have this available)
     refined_commutes = pd.read_csv(os.path.join(processed_data_dir, 'refined_work_related_commutes.csv'))
+    instrumentation.add_rows(len(refined_commutes))
 
     # Step 2: Generate top zip codes
     generate_top_zipcodes(refined_commutes, processed_data_dir)
@@ -5,16 +5,14 @@ from shapely.geometry import shape, Point
 import random
 import requests
 import logging
+from utils import instrumentation
+from utils.pc4_lookup import load_pc4_shapes
 
-# Setup logging for debugging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Ensure the script uses its own directory as the working directory
+# Resolve the data paths relative to the script directory
 script_dir = os.path.dirname(os.path.abspath(__file__))
-os.chdir(script_dir)
 
 # Define the paths to the input and output datasets
-data_dir = '../data/'
+data_dir = os.path.join(script_dir, '../data/')
 processed_data_dir = os.path.join(data_dir, 'processed/')
 output_dir = os.path.join(data_dir, 'outputs/csv/')
 
@@ -25,18 +23,14 @@ top_destination_zipcodes_path = os.path.join(processed_data_dir, 'top_destinatio
 # Define how many addresses to generate per zipcode
 ADDRESSES_PER_ZIPCODE = 50
 
-# Ensure the output directories exist
-if not os.path.exists(output_dir):
-    os.makedirs(output_dir)
-
 # Step 3: Generate random addresses based on geo-shapes
 def generate_random_point_within_polygon(polygon):
     minx, miny, maxx, maxy = polygon.bounds
-    logging.debug(f"Polygon bounds: {polygon.bounds}")
+    logging.debug("Polygon bounds: %s", polygon.bounds)
     while True:
         pnt = Point(random.uniform(minx, maxx), random.uniform(miny, maxy))
         if polygon.contains(pnt):
-            logging.debug(f"Generated point within polygon: {pnt}")
+            logging.debug("Generated point within polygon: %s", pnt)
             return pnt
 
 # Function to get an address from coordinates using Nominatim with User-Agent and timeout
@@ -53,10 +47,11 @@ def get_address_from_coordinates(lat, lon):
         headers = {
             'User-Agent': 'YourAppName/1.0 (your.email@example.com)'  # Replace with your actual app name and contact email
         }
-        response = requests.get(url, params=params, headers=headers, timeout=10)
+        with instrumentation.timed('geocoder_request_seconds'):
+            response = requests.get(url, params=params, headers=headers, timeout=10)
         if response.status_code == 200:
             data = response.json()
-            logging.debug(f"Address found for coordinates ({lat}, {lon}): {data.get('display_name', None)}")
+            logging.debug("Address found for coordinates (%s, %s): %s", lat, lon, data.get('display_name', None))
             return data.get('display_name', None)
         else:
             logging.error(f"Error fetching address for coordinates ({lat}, {lon}): HTTP {response.status_code}")
@@ -68,21 +63,22 @@ def get_address_from_coordinates(lat, lon):
         logging.error(f"Error fetching address for coordinates ({lat}, {lon}): {e}")
         return None
 
-def generate_addresses_for_zipcodes(top_zipcodes, geoshapes_df, output_file):
+def generate_addresses_for_zipcodes(top_zipcodes, geo_shapes, output_file):
     addresses = []
     for _, row in top_zipcodes.iterrows():
         zip_code = row['ZipCode']
         logging.info(f"Processing ZipCode: {zip_code}")
-        geo_shape_row = geoshapes_df[geoshapes_df['PC4'] == zip_code]
+        geo_shape_string = geo_shapes.get(zip_code)
 
-        if not geo_shape_row.empty:
-            geo_shape = json.loads(geo_shape_row.iloc[0]['Geo Shape'])
+        if geo_shape_string is not None:
+            geo_shape = json.loads(geo_shape_string)
             polygon = shape(geo_shape)
 
             # Generate multiple addresses per zipcode based on ADDRESSES_PER_ZIPCODE
             for _ in range(ADDRESSES_PER_ZIPCODE):
                 random_point = generate_random_point_within_polygon(polygon)
                 address = get_address_from_coordinates(random_point.y, random_point.x)
+                instrumentation.add_rows(1)
                 if address:
                     addresses.append({
                         'ZipCode': zip_code,
@@ -90,7 +86,7 @@ def generate_addresses_for_zipcodes(top_zipcodes, geoshapes_df, output_file):
                         'Longitude': random_point.x,
                         'Address': address
                     })
-                    logging.debug(f"Generated address for ZipCode {zip_code}: {address}")
+                    logging.debug("Generated address for ZipCode %s: %s", zip_code, address)
                 else:
                     logging.warning(f"No address found for ZipCode {zip_code}.")
         else:
@@ -101,16 +97,22 @@ def generate_addresses_for_zipcodes(top_zipcodes, geoshapes_df, output_file):
     logging.info(f"Generated addresses saved to {output_file}")
 
 def main():
-    # Load geoshapes data and top zip codes
+    # Ensure the output directories exist
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Load geoshapes indexed by PC4 and top zip codes
     logging.info("Loading geo-reference data...")
-    geoshapes_df = pd.read_csv(georef_file_path)
+    geo_shapes = load_pc4_shapes(georef_file_path)
     
     # Generate random addresses for top origin and destination zipcodes
     logging.info("Generating random addresses for top origin zipcodes...")
-    generate_addresses_for_zipcodes(pd.read_csv(top_origin_zipcodes_path), geoshapes_df, 'top_origin_addresses.csv')
+    generate_addresses_for_zipcodes(pd.read_csv(top_origin_zipcodes_path), geo_shapes, 'top_origin_addresses.csv')
     
     logging.info("Generating random addresses for top destination zipcodes...")
-    generate_addresses_for_zipcodes(pd.read_csv(top_destination_zipcodes_path), geoshapes_df, 'top_destination_addresses.csv')
+    generate_addresses_for_zipcodes(pd.read_csv(top_destination_zipcodes_path), geo_shapes, 'top_destination_addresses.csv')
 
 if __name__ == "__main__":
+    # Setup logging for debugging
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
     main()
\ No newline at end of file
@@ -1,25 +1,57 @@
 import os
+import json
 import pandas as pd
 import requests
 import random
 import logging
 from datetime import datetime, timedelta
+from utils import instrumentation
+from utils.departure_schedule import DEFAULT_WINDOWS, DepartureSchedule
+from utils.geodesy import geodesic_distance_km
+from utils.od_sampling import ODSampler
+from utils.pc4_lookup import load_pc4_centroids
+from utils.route_cache import RouteCache
+from utils.route_store import RouteStore
+from utils.running_stats import RunningStatistics
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Ensure the script uses its own directory as the working directory
+# Resolve the data paths relative to the script directory
 script_dir = os.path.dirname(os.path.abspath(__file__))
-os.chdir(script_dir)
 
 # Define paths to your data
-data_dir = '../data/outputs/csv/'  # Update with your actual relative path
+data_dir = os.path.join(script_dir, '../data/outputs/csv/')
+origin_addresses_path = os.path.join(data_dir, 'top_origin_addresses.csv')
+destination_addresses_path = os.path.join(data_dir, 'top_destination_addresses.csv')
+output_summary_file = os.path.join(data_dir, 'route_summary_with_commute_times.csv')
+route_cache_report_file = os.path.join(data_dir, 'route_cache_report.json')
+processed_data_dir = os.path.join(script_dir, '../data/processed/')
+refined_commutes_path = os.path.join(processed_data_dir, 'refined_work_related_commutes.csv')
+georef_file_path = os.path.join(processed_data_dir, 'cleaned_georef-netherlands-postcode-pc4.csv')
+
+# Number of origin-destination pairs to route
+NUM_OD_PAIRS = 10000
+
+# How OD pairs are chosen: 'addresses' samples uniformly from the top-postcode addresses and routes every mode;
+# 'flows' draws PC4 pairs in proportion to the ODiN commute flows (stratified by mode and distance band)
+# and routes the observed mode
+OD_SAMPLING = 'addresses'
+OD_SAMPLING_SEED = 42
+
+# How departure times are chosen: 'random' draws one time per pair within the commuting windows of today;
+# 'grid' routes transit at fixed slots of SERVICE_DATE and the time-independent car and bicycle once per pair
+DEPARTURES = 'random'
+DEPARTURE_STEP_MINUTES = 30
+
+# Service day of the departure grid (a weekday within the OTP graph's timetables)
+SERVICE_DATE = os.environ.get('OTP_SERVICE_DATE', '2024-03-12')
+
+# Share of approximate route cache hits that are also routed exactly to measure the accuracy loss
+ROUTE_CACHE_VALIDATION_RATE = 0.05
 
-# Load the addresses
-origin_addresses = pd.read_csv(os.path.join(data_dir, 'top_origin_addresses.csv'))
-destination_addresses = pd.read_csv(os.path.join(data_dir, 'top_destination_addresses.csv'))
+# OTP plan endpoint (set OTP_URL to route against another server, e.g. the mock in benchmarks/otp_mock.py)
+OTP_URL = os.environ.get('OTP_URL', 'http://localhost:8080/otp/routers/default/plan')
 
-logging.debug(f"Loaded {len(origin_addresses)} origin addresses and {len(destination_addresses)} destination addresses.")
+# Seconds to wait for an OTP response before giving up on the route
+OTP_TIMEOUT = float(os.environ.get('OTP_TIMEOUT', 60))
 
 # Function to generate a random time within the commuting windows
 def get_random_commute_time():
@@ -41,7 +73,6 @@ def get_random_commute_time():
 
 # Function to generate a route using OTP for a specific mode
 def generate_route(origin, destination, departure_time, mode):
-    url = "http://localhost:8080/otp/routers/default/plan"
     params = {
         'fromPlace': f"{origin['Latitude']},{origin['Longitude']}",
         'toPlace': f"{destination['Latitude']},{destination['Longitude']}",
@@ -53,15 +84,29 @@ def generate_route(origin, destination, departure_time, mode):
         'wheelchair': 'false',
         'locale': 'en',
     }
-    logging.debug(f"Sending OTP request for {mode} from {origin['Address']} to {destination['Address']} at {departure_time}")
-    response = requests.get(url, params=params)
+    logging.debug("Sending OTP request for %s from %s to %s at %s", mode, origin['Address'], destination['Address'], departure_time)
+    try:
+        with instrumentation.timed('otp_request_seconds', mode=mode):
+            response = requests.get(OTP_URL, params=params, timeout=OTP_TIMEOUT)
+    except requests.RequestException as e:
+        logging.error(f"OTP request for {mode} from {origin['Address']} to {destination['Address']} failed: {e}")
+        return None
     if response.status_code == 200:
-        logging.debug(f"Route successfully retrieved for {mode} from {origin['Address']} to {destination['Address']}")
+        logging.debug("Route successfully retrieved for %s from %s to %s", mode, origin['Address'], destination['Address'])
         return response.json()
     else:
         logging.error(f"Error in request: {response.status_code}, {response.text}")
         return None
 
+# Function to route one mode of a pair, through the route cache when one is given
+def fetch_route(origin, destination, departure_time, mode, cache=None, time_key=None):
+    logging.info(f"Generating {mode} route from {origin['Address']} to {destination['Address']} at {departure_time}")
+    if cache is None:
+        return generate_route(origin, destination, departure_time, mode)
+    return cache.get_or_route(lambda: generate_route(origin, destination, departure_time, mode),
+                              origin['Latitude'], origin['Longitude'],
+                              destination['Latitude'], destination['Longitude'], mode, time_key)
+
 # Function to process and summarize the route details
 def process_route(route, mode):
     if route is None or 'plan' not in route or 'itineraries' not in route['plan'] or not route['plan']['itineraries']:
@@ -94,7 +139,7 @@ def process_route(route, mode):
             'to_place': leg['to']['name'],
             'leg_geometry': leg_geometry
         }
-        logging.debug(f"Processed leg: {leg_info}")
+        logging.debug("Processed leg: %s", leg_info)
         if leg['mode'] in ['BUS', 'RAIL', 'TRAM', 'SUBWAY', 'FERRY']:
             leg_info.update({
                 'agency_name': leg.get('agencyName'),
@@ -126,58 +171,107 @@ def get_valid_pairs(origins, destinations):
     logging.debug(f"Generated {len(valid_pairs)} valid origin-destination pairs.")
     return valid_pairs
 
-# Main function
-def main():
+# Function to sample pairs of the top-postcode addresses uniformly, with every mode to route
+def sample_address_pairs(num_od_pairs):
+    origin_addresses = pd.read_csv(origin_addresses_path)
+    destination_addresses = pd.read_csv(destination_addresses_path)
+    logging.debug(f"Loaded {len(origin_addresses)} origin addresses and {len(destination_addresses)} destination addresses.")
+
     valid_pairs = get_valid_pairs(origin_addresses, destination_addresses)
-    num_od_pairs = 10000
     num_samples = min(num_od_pairs, len(valid_pairs))
-    if num_samples == 0:
+    od_pairs = []
+    for origin, destination in random.sample(valid_pairs, num_samples):
+        dist = float(geodesic_distance_km(origin['Latitude'], origin['Longitude'], destination['Latitude'], destination['Longitude']))
+        modes = ['BICYCLE', 'CAR', 'TRANSIT']
+        if dist > 30:
+            logging.info(f"Skipping long-distance BICYCLE route from {origin['Address']} to {destination['Address']}")
+            modes.remove('BICYCLE')
+        od_pairs.append((origin, destination, modes, None))
+    return od_pairs
+
+# Function to draw PC4 pairs in proportion to the ODiN commute flows, with the observed mode to route
+def sample_flow_pairs(num_od_pairs, seed=OD_SAMPLING_SEED):
+    sampler = ODSampler.from_commutes(pd.read_csv(refined_commutes_path), load_pc4_centroids(georef_file_path))
+    logging.debug(f"Sampling from {len(sampler.flows)} PC4 flows.")
+    sample = sampler.sample(num_od_pairs, seed=seed, by=['mode', 'band'])
+    od_pairs = []
+    for flow in sample.itertuples(index=False):
+        origin = {'Address': f"PC4 {flow.origin}", 'Latitude': flow.origin_latitude, 'Longitude': flow.origin_longitude}
+        destination = {'Address': f"PC4 {flow.destination}", 'Latitude': flow.destination_latitude,
+                       'Longitude': flow.destination_longitude}
+        od_pairs.append((origin, destination, [flow.mode], flow.sample_weight))
+    return od_pairs
+
+# Main function
+def main(num_od_pairs=NUM_OD_PAIRS, od_sampling=OD_SAMPLING, seed=OD_SAMPLING_SEED, route_cache=False,
+         departures=DEPARTURES):
+    if od_sampling == 'flows':
+        od_pairs = sample_flow_pairs(num_od_pairs, seed)
+    elif od_sampling == 'addresses':
+        od_pairs = sample_address_pairs(num_od_pairs)
+    else:
+        raise ValueError(f"Unknown OD sampling '{od_sampling}'")
+    if not od_pairs:
         logging.error("No valid origin-destination pairs found.")
         return
 
-    selected_pairs = random.sample(valid_pairs, num_samples)
-    route_summaries = []
-    modes = ['BICYCLE', 'CAR', 'TRANSIT']
-
-    for origin, destination in selected_pairs:
-        time_of_day, departure_time = get_random_commute_time()
-        dist = ((origin['Latitude'] - destination['Latitude'])**2 + (origin['Longitude'] - destination['Longitude'])**2)**0.5 * 111  # Approximate km distance
-
-        for mode in modes:
-            if mode == 'BICYCLE' and dist > 30:
-                logging.info(f"Skipping long-distance BICYCLE route from {origin['Address']} to {destination['Address']}")
-                continue
-
-            logging.info(f"Generating {mode} route from {origin['Address']} to {destination['Address']} at {departure_time}")
-            route_info = generate_route(origin, destination, departure_time, mode)
-            route_summary = process_route(route_info, mode)
-
-            if route_summary:
-                logging.debug(f"Processed route summary for {mode} from {origin['Address']} to {destination['Address']}")
-                summary = {
-                    'origin_address': origin['Address'],
-                    'destination_address': destination['Address'],
-                    'origin_latitude': origin['Latitude'],
-                    'origin_longitude': origin['Longitude'],
-                    'destination_latitude': destination['Latitude'],
-                    'destination_longitude': destination['Longitude'],
-                    'departure_time': departure_time.strftime('%Y-%m-%d %H:%M:%S'),
-                    'time_of_day': time_of_day,
-                    'mode': route_summary['mode'],
-                    'total_km': route_summary['total_km'],
-                    'total_duration_min': route_summary['total_duration_min'],
-                    'transit_details': route_summary['transit_details'],
-                    'all_legs': route_summary['all_legs'],
-                    'route_shape': route_summary['route_shape']
-                }
-                route_summaries.append(summary)
+    # Pairs, routes and legs are kept in compact column buffers, each pair's metadata stored once
+    store = RouteStore()
+
+    # Nearby pairs (same grid cells per mode) reuse an earlier itinerary instead of querying OTP again
+    cache = RouteCache(validation_rate=ROUTE_CACHE_VALIDATION_RATE, seed=seed) if route_cache else None
+
+    if departures == 'grid':
+        schedule = DepartureSchedule(SERVICE_DATE, DEFAULT_WINDOWS, DEPARTURE_STEP_MINUTES)
+    elif departures == 'random':
+        schedule = None
+    else:
+        raise ValueError(f"Unknown departures '{departures}'")
+
+    # Live statistics of the routes produced so far, written periodically during the run
+    running_stats = RunningStatistics(snapshot_path=os.path.join(data_dir, 'running_stats_routing.json'))
+
+    for origin, destination, modes, sample_weight in od_pairs:
+        # sample_weight is the number of ODiN commutes a flow-weighted pair stands for
+        pair = store.add_pair(origin, destination, sample_weight)
+        if schedule is not None:
+            # Cached transit itineraries are only reused at the same slot
+            trips = schedule.route_pair(
+                lambda mode, departure_time: fetch_route(origin, destination, departure_time, mode, cache,
+                                                         departure_time.strftime('%H:%M')), modes)
+        else:
+            time_of_day, departure_time = get_random_commute_time()
+            trips = [(time_of_day, departure_time, mode,
+                      fetch_route(origin, destination, departure_time, mode, cache, time_of_day), 1.0) for mode in modes]
+
+        for time_of_day, departure_time, mode, route_info, weight_share in trips:
+            instrumentation.add_rows(1)
+            route_index = store.add_route(pair, route_info, mode, departure_time, time_of_day, weight_share)
+
+            if route_index is not None:
+                logging.debug("Stored route for %s from %s to %s", mode, origin['Address'], destination['Address'])
+                total_km, total_duration_min = store.totals(route_index)
+                running_stats.update('routing', 'total_km', mode, total_km)
+                running_stats.update('routing', 'total_duration_min', mode, total_duration_min)
+                running_stats.maybe_snapshot()
             else:
-                logging.warning(f"Route for {mode} from {origin['Address']} to {destination['Address']} could not be processed.")
+                logging.warning(f"No route found for {mode} from {origin['Address']} to {destination['Address']}.")
 
-    df_summary = pd.DataFrame(route_summaries)
-    output_summary_file = os.path.join(data_dir, 'route_summary_with_commute_times.csv')
-    df_summary.to_csv(output_summary_file, index=False)
+    running_stats.snapshot()
+    if schedule is not None:
+        logging.info(f"Departure grid: {schedule.counts['routes']} routes over {len(schedule.slots)} slots "
+                     f"from {schedule.counts['queries']} OTP queries")
+    if cache is not None:
+        cache_report = cache.report()
+        with open(route_cache_report_file, 'w') as report_file:
+            json.dump(cache_report, report_file, indent=4)
+        overall = cache_report['modes'].get('ALL', {})
+        logging.info(f"Route cache served {overall.get('cache_hits', 0)} of {overall.get('requests', 0)} routes; "
+                     f"report saved to '{route_cache_report_file}'")
+    store.write_summary_csv(output_summary_file)
     logging.info(f"Route summary with commute times saved to '{output_summary_file}'")
 
 if __name__ == "__main__":
+    # Configure logging
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
     main()
\ No newline at end of file
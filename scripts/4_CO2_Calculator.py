@@ -1,18 +1,25 @@
 import os
-import pandas as pd
 import ast  # To safely evaluate string representations of lists
 import logging  # To add debug logs
-import polyline  # To decode polyline for mapping
-from shapely.geometry import LineString
 import json  # To handle GeoJSON
-from geojson import Feature, FeatureCollection, LineString as GeoJSONLineString
+from utils import instrumentation
+from utils.running_stats import RunningStatistics
 
-# Ensure the script uses its own directory as the working directory
+# pandas, numpy (via utils.geometry_store), shapely and geojson are imported inside the functions that use them,
+# so the emission factors and per-trip calculations load without them
+
+# Resolve the data paths relative to the script directory
 script_dir = os.path.dirname(os.path.abspath(__file__))
-os.chdir(script_dir)
+data_dir = os.path.join(script_dir, '../data/outputs/csv/')
 
-# Setup logging for debugging
-logging.basicConfig(level=logging.DEBUG, filename='co2_calculator_debug.log', filemode='w', format='%(name)s - %(levelname)s - %(message)s')
+# Input and output files
+input_file = os.path.join(data_dir, 'route_summary_with_commute_times.csv')
+output_file_csv = os.path.join(data_dir, 'co2_emissions_summary.csv')
+output_file_geojson = os.path.join(data_dir, 'co2_emissions_summary.geojson')
+output_file_legs_csv = os.path.join(data_dir, 'co2_emissions_legs.csv')
+running_stats_file = os.path.join(data_dir, 'running_stats_co2.json')
+# Decoded leg coordinates (leg_geometries.coords) and their (trip_id, leg_index) index (leg_geometries.index.npy)
+geometry_store_path = os.path.join(data_dir, 'leg_geometries')
 
 # WPM TTW CO2 emission factors
 WPM_TTW_CO2_FACTORS = {
@@ -28,6 +35,40 @@ WTW_CO2_FACTORS = {
     'TRANSIT': 20
 }
 
+# Fleet-mix car factors built from the RDW registry (Average_Car_Emission_Factors_NL.py --registry)
+fleet_factors_file = os.path.join(script_dir, '../data/processed/car_emission_factors.csv')
+
+# Function to read the CAR factors of a row of the fleet factor table: (TTW, WTW) g/km, or None without it
+def read_fleet_car_factors(file_path=fleet_factors_file, registration_year='ALL', vehicle_class='ALL'):
+    import csv
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, newline='') as factors_file:
+        for row in csv.DictReader(factors_file):
+            if row['registration_year'] == str(registration_year) and row['vehicle_class'] == vehicle_class:
+                if not row['ttw_g_per_km'] or not row['wtw_g_per_km']:
+                    break
+                return float(row['ttw_g_per_km']), float(row['wtw_g_per_km'])
+    logging.warning(f"No car factors for registration year {registration_year} and class {vehicle_class} in '{file_path}'")
+    return None
+
+# Function to return the TTW and WTW factor tables, with the fleet-mix CAR factors when that table has been built
+def emission_factors(file_path=fleet_factors_file):
+    ttw, wtw = dict(WPM_TTW_CO2_FACTORS), dict(WTW_CO2_FACTORS)
+    car_factors = read_fleet_car_factors(file_path)
+    if car_factors is not None:
+        ttw['CAR'], wtw['CAR'] = car_factors
+    return ttw, wtw
+
+# Function to use the fleet-mix CAR factors in the calculations of this module (the whole registered fleet
+# stands for the cars of the routed commutes); called by the entry points, not on import
+def load_fleet_car_factors(file_path=fleet_factors_file):
+    car_factors = read_fleet_car_factors(file_path)
+    if car_factors is None:
+        return False
+    WPM_TTW_CO2_FACTORS['CAR'], WTW_CO2_FACTORS['CAR'] = car_factors
+    return True
+
 # Function to classify commute distance groups
 def classify_commute_distance(distance_km):
     if distance_km < 10:
@@ -48,38 +89,56 @@ def calculate_co2_emissions_method_2(mode, distance_km):
         mode = 'TRANSIT'
     return distance_km * WTW_CO2_FACTORS.get(mode.upper(), 0.0)
 
-# Function to decode polyline for GeoJSON with reversed coordinates (Lat, Lon -> Lon, Lat)
-def polyline_to_geojson(encoded_shape):
+# Function to turn decoded (lon, lat) leg coordinates into a GeoJSON LineString
+def coordinates_to_geojson(coordinates):
+    from geojson import LineString as GeoJSONLineString
+    if coordinates is not None and len(coordinates):
+        return GeoJSONLineString(coordinates.tolist())
+    return None
+
+# Function to turn decoded (lon, lat) leg coordinates into WKT
+def coordinates_to_wkt(coordinates):
+    from shapely.geometry import LineString
     try:
-        decoded_shape = polyline.decode(encoded_shape)
-        if decoded_shape:
-            # Reverse the order of coordinates from (lat, lon) to (lon, lat)
-            reversed_shape = [(lon, lat) for lat, lon in decoded_shape]
-            return GeoJSONLineString(reversed_shape)
+        if coordinates is not None and len(coordinates):
+            return LineString(coordinates).wkt
         return None
     except Exception as e:
-        logging.error(f"Error decoding polyline to GeoJSON: {e}")
+        logging.error(f"Error converting leg coordinates to WKT: {e}")
         return None
 
-# Function to decode polyline to WKT
-def polyline_to_wkt(encoded_shape):
+# Function to decode a polyline to (lon, lat) coordinates, None if it cannot be decoded
+def decode_leg_geometry(encoded_shape):
+    from utils.geometry_store import decode_polyline
     try:
-        decoded_shape = polyline.decode(encoded_shape)
-        if decoded_shape:
-            reversed_shape = [(lon, lat) for lat, lon in decoded_shape]
-            line = LineString(reversed_shape)
-            return line.wkt
-        return None
+        return decode_polyline(encoded_shape)
     except Exception as e:
-        logging.error(f"Error decoding polyline to WKT: {e}")
+        logging.error(f"Error decoding polyline: {e}")
         return None
 
+# Function to decode polyline for GeoJSON with reversed coordinates (Lat, Lon -> Lon, Lat)
+def polyline_to_geojson(encoded_shape):
+    return coordinates_to_geojson(decode_leg_geometry(encoded_shape))
+
+# Function to decode polyline to WKT
+def polyline_to_wkt(encoded_shape):
+    return coordinates_to_wkt(decode_leg_geometry(encoded_shape))
+
 # Process input and create both CSV and GeoJSON output
-def process_trip_legs_for_qgis(input_file, output_file_csv, output_file_geojson):
+def process_trip_legs_for_qgis(input_file, output_file_csv, output_file_geojson, running_stats_file=None,
+                               geometry_store_path=None, output_file_legs_csv=None):
+    import pandas as pd
+    from geojson import Feature, FeatureCollection
+    from utils.geometry_store import GeometryStoreWriter
+
+    # Live per-mode emission statistics, snapshotted periodically while trips are processed
+    running_stats = RunningStatistics(snapshot_path=running_stats_file)
+
     try:
         # Read the CSV file
         df = pd.read_csv(input_file)
         logging.info(f"Loaded {len(df)} rows from {input_file}")
+        instrumentation.add_rows(len(df))
     except Exception as e:
         logging.error(f"Failed to load input file: {e}")
         return
@@ -90,6 +149,12 @@ def process_trip_legs_for_qgis(input_file, output_file_csv, output_file_geojson)
     # List to hold GeoJSON features
     geojson_features = []
 
+    # Flat per-leg emissions (no geometry), keyed like the geometry store by trip_id and 0-based leg_index
+    leg_rows = []
+
+    # Every leg is decoded once; the coordinates also go to the memory-mapped geometry store
+    geometry_store = GeometryStoreWriter(geometry_store_path) if geometry_store_path else None
+
     # Iterate through each trip row in the dataframe
     for index, row in df.iterrows():
         try:
@@ -120,9 +185,12 @@ def process_trip_legs_for_qgis(input_file, output_file_csv, output_file_geojson)
                 total_co2_method_1 += co2_method_1
                 total_co2_method_2 += co2_method_2
 
-                # Decode leg geometry to GeoJSON and WKT
-                leg_geometry_geojson = polyline_to_geojson(leg.get('leg_geometry', ''))
-                leg_geometry_wkt = polyline_to_wkt(leg.get('leg_geometry', ''))
+                # Decode leg geometry once, to GeoJSON, WKT and the geometry store
+                coordinates = decode_leg_geometry(leg.get('leg_geometry', ''))
+                leg_geometry_geojson = coordinates_to_geojson(coordinates)
+                leg_geometry_wkt = coordinates_to_wkt(coordinates)
+                if geometry_store is not None and coordinates is not None:
+                    geometry_store.add(trip_id, leg_index, coordinates)
 
                 # Append leg details for CSV output
                 legs_details.append({
@@ -136,6 +204,8 @@ def process_trip_legs_for_qgis(input_file, output_file_csv, output_file_geojson)
                     'leg_geometry_wkt': leg_geometry_wkt
                 })
 
+                leg_rows.append((trip_id, leg_index, mode, distance_km, duration_min, co2_method_1, co2_method_2))
+
                 # Add the leg as a GeoJSON feature
                 if leg_geometry_geojson:
                     feature = Feature(geometry=leg_geometry_geojson, properties={
@@ -156,7 +226,7 @@ def process_trip_legs_for_qgis(input_file, output_file_csv, output_file_geojson)
                     geojson_features.append(feature)
 
             # Add the simplified row data for the entire trip (CSV)
-            simplified_data.append({
+            trip_row = {
                 'trip_id': trip_id,
                 'origin_address': origin_address,
                 'destination_address': destination_address,
@@ -167,15 +237,29 @@ def process_trip_legs_for_qgis(input_file, output_file_csv, output_file_geojson)
                 'total_km': row['total_km'],
                 'mode': row['mode'],
                 'total_duration_min': row['total_duration_min'],
+                'time_of_day': row.get('time_of_day'),
                 'total_co2_emissions_method_1_g': total_co2_method_1,
                 'total_co2_emissions_method_2_g': total_co2_method_2,
                 'commute_distance_group': classify_commute_distance(row['total_km']),
                 'legs': legs_details  # Include detailed legs
-            })
+            }
+            # Flow-weighted pairs carry the number of ODiN commutes they stand for, for weighted estimates
+            if 'sample_weight' in df.columns:
+                trip_row['sample_weight'] = row['sample_weight']
+            simplified_data.append(trip_row)
+            running_stats.update('co2', 'total_co2_emissions_method_1_g', row['mode'], total_co2_method_1)
+            running_stats.update('co2', 'total_co2_emissions_method_2_g', row['mode'], total_co2_method_2)
+            running_stats.maybe_snapshot()
 
         except Exception as e:
             logging.error(f"Error processing trip {index + 1}: {e}")
 
+    if running_stats_file:
+        running_stats.snapshot()
+    if geometry_store is not None:
+        geometry_store.close()
+        logging.info(f"Leg geometries saved to '{geometry_store_path}.coords'")
+
     # Create a DataFrame from the simplified data for CSV
     simplified_df = pd.DataFrame(simplified_data)
     
@@ -184,6 +268,12 @@ def process_trip_legs_for_qgis(input_file, output_file_csv, output_file_geojson)
     logging.info(f"Simplified data saved to {output_file_csv}")
     print(f"Simplified data saved to {output_file_csv}")
 
+    if output_file_legs_csv:
+        pd.DataFrame(leg_rows, columns=['trip_id', 'leg_index', 'mode', 'distance_km', 'duration_min',
+                                        'co2_emissions_method_1_g', 'co2_emissions_method_2_g']
+                     ).to_csv(output_file_legs_csv, index=False)
+        logging.info(f"Leg emissions saved to {output_file_legs_csv}")
+
     # Create a GeoJSON FeatureCollection and save it
     geojson_feature_collection = FeatureCollection(geojson_features)
     with open(output_file_geojson, 'w') as geojson_file:
@@ -191,11 +281,12 @@ def process_trip_legs_for_qgis(input_file, output_file_csv, output_file_geojson)
     logging.info(f"GeoJSON data saved to {output_file_geojson}")
     print(f"GeoJSON data saved to {output_file_geojson}")
 
-# Example usage
-input_file = '../data/outputs/csv/route_summary_with_commute_times.csv'
-output_file_csv = '../data/outputs/csv/co2_emissions_summary.csv'
-output_file_geojson = '../data/outputs/csv/co2_emissions_summary.geojson'
-
-process_trip_legs_for_qgis(input_file, output_file_csv, output_file_geojson)
+def main():
+    load_fleet_car_factors()
+    process_trip_legs_for_qgis(input_file, output_file_csv, output_file_geojson, running_stats_file,
+                               geometry_store_path, output_file_legs_csv)
 
-process_trip_legs_for_qgis(input_file, output_file_csv, output_file_geojson)
\ No newline at end of file
+if __name__ == "__main__":
+    # Setup logging for debugging
+    logging.basicConfig(level=logging.DEBUG, filename=os.path.join(script_dir, 'co2_calculator_debug.log'), filemode='w', format='%(name)s - %(levelname)s - %(message)s')
+    main()
@@ -1,39 +1,31 @@
 import os
 import pandas as pd
-from scipy import stats
-import numpy as np
+from utils import instrumentation
+from utils.group_stats import (GroupedStatistics, anova_test, count_legs, f_test, independent_t_test,
+                               paired_t_test, pearson_correlation)
+from utils.resampling import bootstrap_ci, permutation_p_value
+from utils.streaming_ols import fit_streaming_ols
 
 # Set the working directory
 script_dir = os.path.dirname(os.path.abspath(__file__))
 data_dir = os.path.join(script_dir, '../data/outputs/csv/')
 input_file_path = os.path.join(data_dir, 'co2_emissions_summary.csv')
 
-# Load the data
-df = pd.read_csv(input_file_path)
-
-# Helper functions for hypothesis testing
-def paired_t_test(group1, group2):
-    """Conducts a paired t-test for two related samples"""
-    t_stat, p_value = stats.ttest_rel(group1, group2)
-    return t_stat, p_value
-
-def independent_t_test(group1, group2):
-    """Conducts an independent t-test for two unrelated samples"""
-    t_stat, p_value = stats.ttest_ind(group1, group2, nan_policy='omit')
-    return t_stat, p_value
-
-def anova_test(*groups):
-    """Conducts a one-way ANOVA test"""
-    f_stat, p_value = stats.f_oneway(*groups)
-    return f_stat, p_value
-
-def f_test(group1, group2):
-    """Conducts an F-test for comparing variances between two groups"""
-    f_stat = np.var(group1, ddof=1) / np.var(group2, ddof=1)
-    dfn = len(group1) - 1
-    dfd = len(group2) - 1
-    p_value = 1 - stats.f.cdf(f_stat, dfn, dfd)
-    return f_stat, p_value
+# Resampling settings for the distribution-free versions of H1-H7
+N_RESAMPLES = 10000
+RESAMPLING_SEED = 42
+RESAMPLING_WORKERS = None  # None uses all available CPU cores
+
+# Rows per chunk when streaming the summary CSV for the H8 regression
+REGRESSION_CHUNK_SIZE = 100000
+
+# Emission columns of the two methodologies (WPM TTW and WTW)
+methods = ['total_co2_emissions_method_1_g', 'total_co2_emissions_method_2_g']
+per_minute_methods = ['co2_per_minute_method_1', 'co2_per_minute_method_2']
+
+# Use the 'commute_distance_group' column instead of defining new distance groups
+commute_groups = ['short', 'medium', 'long']
+modes = ['BICYCLE', 'CAR', 'TRANSIT']
 
 # Function to calculate descriptive statistics
 def calculate_emission_statistics(df):
@@ -46,110 +38,185 @@ def calculate_emission_statistics(df):
 
     return descriptive_stats, avg_emissions_by_mode
 
-# Call the function and store the results
-descriptive_stats, avg_emissions_by_mode = calculate_emission_statistics(df)
-
-# Output descriptive statistics and averages by mode
-print("\nDescriptive Statistics (Method 1 and Method 2):")
-print(descriptive_stats)
-
-print("\nAverage Emissions by Mode of Transport (Method 1 and Method 2):")
-print(avg_emissions_by_mode)
-
-# Derive "is_multimodal" based on the "legs" column (assuming more than 1 leg indicates multimodal)
-df['is_multimodal'] = df['legs'].apply(lambda x: len(eval(x)) > 1)
-
-# Hypothesis Testing
-
-# H1: Paired t-test for CO2 emissions (WPM TTW vs WTW) across commute distances
-print("H1: Paired t-test for CO2 emissions (WPM TTW vs WTW)")
-
-# Use the 'commute_distance_group' column instead of defining new distance groups
-commute_groups = ['short', 'medium', 'long']
-
-# Paired t-test for short, medium, and long commutes
-for group in commute_groups:
-    filtered_df = df[df['commute_distance_group'] == group]
-    if len(filtered_df) > 1:
-        t_stat, p_value = paired_t_test(filtered_df['total_co2_emissions_method_1_g'], filtered_df['total_co2_emissions_method_2_g'])
-        print(f"{group.capitalize()} commutes: T-stat = {t_stat:.4f}, P-value = {p_value:.4f}")
-    else:
-        print(f"{group.capitalize()} commutes: Not enough data for paired t-test.")
-
-# H2: Independent t-test for CO2 emissions (Multimodal vs Car-only)
-print("\nH2: Independent t-test for CO2 emissions (Multimodal vs Car-only)")
-car_only_trips = df[df['mode'] == 'CAR']
-multimodal_trips = df[df['is_multimodal'] == True]  # Using the derived is_multimodal column
-for method in ['total_co2_emissions_method_1_g', 'total_co2_emissions_method_2_g']:
-    t_stat, p_value = independent_t_test(multimodal_trips[method], car_only_trips[method])
-    print(f"CO2 emissions ({method}) - T-stat = {t_stat:.4f}, P-value = {p_value:.4f}")
-
-# H3: Independent t-test for CO2 emissions per minute (Multimodal vs Car-only)
-print("\nH3: CO2 emissions per minute (Multimodal vs Car-only)")
-multimodal_trips = df[df['is_multimodal'] == True]
-car_only_trips = df[df['mode'] == 'CAR']
-
-# Filter out zero or missing values for the t-test
-for method in ['co2_per_minute_method_1', 'co2_per_minute_method_2']:
-    multimodal_trips_valid = multimodal_trips[(multimodal_trips[method] > 0) & multimodal_trips[method].notna()]
-    car_only_trips_valid = car_only_trips[(car_only_trips[method] > 0) & car_only_trips[method].notna()]
-    if len(multimodal_trips_valid) > 1 and len(car_only_trips_valid) > 1:
-        t_stat, p_value = independent_t_test(multimodal_trips_valid[method], car_only_trips_valid[method])
-        print(f"CO2 per minute ({method}) - T-stat = {t_stat:.4f}, P-value = {p_value:.4f}")
-    else:
-        print(f"Not enough valid data for {method}")
-
-# H4: Independent t-test for CO2 emissions (Bicycles vs Other Modes)
-print("\nH4: Independent t-test for CO2 emissions (Bicycles vs Other Modes)")
-bicycle_trips = df[df['mode'] == 'BICYCLE']
-other_trips = df[df['mode'] != 'BICYCLE']  # All other modes excluding Bicycles
-for method in ['total_co2_emissions_method_1_g', 'total_co2_emissions_method_2_g']:
-    t_stat, p_value = independent_t_test(bicycle_trips[method], other_trips[method])
-    print(f"CO2 emissions ({method}) - T-stat = {t_stat:.4f}, P-value = {p_value:.4f}")
-
-# H5: Correlation between trip duration and CO2 emissions for car trips
-car_trips = df[df['mode'] == 'CAR']
-
-print("\nH5: Correlation between trip duration and CO2 emissions for car trips")
-for method in ['total_co2_emissions_method_1_g', 'total_co2_emissions_method_2_g']:
-    corr, p_value = stats.pearsonr(car_trips['total_duration_min'], car_trips[method])
-    print(f"CO2 emissions ({method}) - Correlation = {corr:.4f}, P-value = {p_value:.4f}")
-
-# H6: One-way ANOVA for short commutes (<10 km)
-short_commutes = df[df['commute_distance_group'] == 'short']
-modes = ['BICYCLE', 'CAR', 'TRANSIT']
-
-print("\nH6: One-way ANOVA for CO2 emissions (Cycling vs Car vs Transit for short commutes)")
-for method in ['total_co2_emissions_method_1_g', 'total_co2_emissions_method_2_g']:
-    groups = [short_commutes[short_commutes['mode'] == mode][method] for mode in modes]
-    f_stat, p_value = anova_test(*groups)
-    print(f"CO2 emissions ({method}) - F-stat = {f_stat:.4f}, P-value = {p_value:.4f}")
-
-# H7: F-test for CO2 emissions variance (Multimodal vs Unimodal for all distance groups based on total_km)
-for group in commute_groups:
-    filtered_df = df[df['commute_distance_group'] == group]
-    multimodal_commutes = filtered_df[filtered_df['is_multimodal'] == True]
-    unimodal_commutes = filtered_df[filtered_df['is_multimodal'] == False]
-
-    print(f"\nH7: F-test for variance in CO2 emissions (Multimodal vs Unimodal for {group} commutes)")
-    for method in ['total_co2_emissions_method_1_g', 'total_co2_emissions_method_2_g']:
-        if len(multimodal_commutes) > 1 and len(unimodal_commutes) > 1:
-            f_stat, p_value = f_test(multimodal_commutes[method], unimodal_commutes[method])
-            print(f"CO2 emissions ({method}) - F-stat = {f_stat:.4f}, P-value = {p_value:.4f}")
+def prepare_trips(df):
+    """Derive the per-trip columns used by the tests and partition the trips once"""
+    # Derive "is_multimodal" based on the "legs" column (assuming more than 1 leg indicates multimodal)
+    df['is_multimodal'] = count_legs(df['legs']) > 1
+
+    # Per-minute and per-kilometre emissions (vectorised, used by H3 and H8)
+    for i, method in enumerate(methods, start=1):
+        if f'co2_per_minute_method_{i}' not in df.columns:
+            df[f'co2_per_minute_method_{i}'] = df[method] / df['total_duration_min']
+        df[f'co2_per_km_method_{i}'] = df[method] / df['total_km']
+
+    # Partition the trips once and cache the sufficient statistics of every group
+    engine = GroupedStatistics(df)
+    for method in per_minute_methods:
+        engine.define_mask(f'{method}_positive', df[method] > 0)
+    return engine
+
+def run_parametric_tests(engine):
+    """H1-H7 computed from the cached group statistics"""
+    # H1: Paired t-test for CO2 emissions (WPM TTW vs WTW) across commute distances
+    print("H1: Paired t-test for CO2 emissions (WPM TTW vs WTW)")
+
+    # Paired t-test for short, medium, and long commutes
+    for group in commute_groups:
+        moments = engine.group('commute_distance_group', group, methods)
+        if moments.n > 1:
+            t_stat, p_value = paired_t_test(moments, *methods)
+            print(f"{group.capitalize()} commutes: T-stat = {t_stat:.4f}, P-value = {p_value:.4f}")
         else:
-            print(f"Not enough data for F-test in {method} for {group} commutes")
-
-# H8: Linear regression for CO2 emissions per kilometer
-df['co2_per_km_method_1'] = df['total_co2_emissions_method_1_g'] / df['total_km']
-df['co2_per_km_method_2'] = df['total_co2_emissions_method_2_g'] / df['total_km']
-
-print("\nH8: Linear regression for CO2 emissions per kilometer")
-for method in ['co2_per_km_method_1', 'co2_per_km_method_2']:
-    # Set up independent variables: total_km, mode, total_duration_min
-    df['mode_is_car'] = df['mode'].apply(lambda x: 1 if x == 'CAR' else 0)
-    df['mode_is_transit'] = df['mode'].apply(lambda x: 1 if x == 'TRANSIT' else 0)
-
-    X = df[['total_km', 'mode_is_car', 'mode_is_transit', 'total_duration_min']]
-    y = df[method]
-
-    # Perform linear regression (you can add your preferred regression method here)
+            print(f"{group.capitalize()} commutes: Not enough data for paired t-test.")
+
+    # H2: Independent t-test for CO2 emissions (Multimodal vs Car-only)
+    print("\nH2: Independent t-test for CO2 emissions (Multimodal vs Car-only)")
+    car_only_trips = engine.group('mode', 'CAR', methods)
+    multimodal_trips = engine.group('is_multimodal', True, methods)
+    for method in methods:
+        t_stat, p_value = independent_t_test(multimodal_trips, car_only_trips, method)
+        print(f"CO2 emissions ({method}) - T-stat = {t_stat:.4f}, P-value = {p_value:.4f}")
+
+    # H3: Independent t-test for CO2 emissions per minute (Multimodal vs Car-only)
+    print("\nH3: CO2 emissions per minute (Multimodal vs Car-only)")
+
+    # Filter out zero or missing values for the t-test
+    for method in per_minute_methods:
+        multimodal_trips_valid = engine.group('is_multimodal', True, [method], where=f'{method}_positive')
+        car_only_trips_valid = engine.group('mode', 'CAR', [method], where=f'{method}_positive')
+        if multimodal_trips_valid.n > 1 and car_only_trips_valid.n > 1:
+            t_stat, p_value = independent_t_test(multimodal_trips_valid, car_only_trips_valid, method)
+            print(f"CO2 per minute ({method}) - T-stat = {t_stat:.4f}, P-value = {p_value:.4f}")
+        else:
+            print(f"Not enough valid data for {method}")
+
+    # H4: Independent t-test for CO2 emissions (Bicycles vs Other Modes)
+    print("\nH4: Independent t-test for CO2 emissions (Bicycles vs Other Modes)")
+    bicycle_trips = engine.group('mode', 'BICYCLE', methods)
+    other_trips = engine.combine('mode', methods, exclude=lambda mode: mode == 'BICYCLE')  # All other modes excluding Bicycles
+    for method in methods:
+        t_stat, p_value = independent_t_test(bicycle_trips, other_trips, method)
+        print(f"CO2 emissions ({method}) - T-stat = {t_stat:.4f}, P-value = {p_value:.4f}")
+
+    # H5: Correlation between trip duration and CO2 emissions for car trips
+    print("\nH5: Correlation between trip duration and CO2 emissions for car trips")
+    car_trips = engine.group('mode', 'CAR', ['total_duration_min'] + methods)
+    for method in methods:
+        corr, p_value = pearson_correlation(car_trips, 'total_duration_min', method)
+        print(f"CO2 emissions ({method}) - Correlation = {corr:.4f}, P-value = {p_value:.4f}")
+
+    # H6: One-way ANOVA for short commutes (<10 km)
+    print("\nH6: One-way ANOVA for CO2 emissions (Cycling vs Car vs Transit for short commutes)")
+    for method in methods:
+        groups = [engine.group(('commute_distance_group', 'mode'), ('short', mode), methods) for mode in modes]
+        f_stat, p_value = anova_test(groups, method)
+        print(f"CO2 emissions ({method}) - F-stat = {f_stat:.4f}, P-value = {p_value:.4f}")
+
+    # H7: F-test for CO2 emissions variance (Multimodal vs Unimodal for all distance groups based on total_km)
+    for group in commute_groups:
+        multimodal_commutes = engine.group(('commute_distance_group', 'is_multimodal'), (group, True), methods)
+        unimodal_commutes = engine.group(('commute_distance_group', 'is_multimodal'), (group, False), methods)
+
+        print(f"\nH7: F-test for variance in CO2 emissions (Multimodal vs Unimodal for {group} commutes)")
+        for method in methods:
+            if multimodal_commutes.n > 1 and unimodal_commutes.n > 1:
+                f_stat, p_value = f_test(multimodal_commutes, unimodal_commutes, method)
+                print(f"CO2 emissions ({method}) - F-stat = {f_stat:.4f}, P-value = {p_value:.4f}")
+            else:
+                print(f"Not enough data for F-test in {method} for {group} commutes")
+
+def print_resampling_result(label, statistic, samples, n_resamples, seed, workers):
+    """Print the bootstrap CI and permutation p-value of one test statistic"""
+    if any(len(sample) < 2 for sample in samples):
+        print(f"{label} - Not enough data for resampling")
+        return
+    observed, low, high = bootstrap_ci(statistic, samples, n_resamples, seed=seed, workers=workers)
+    _, p_value = permutation_p_value(statistic, samples, n_resamples, seed=seed, workers=workers)
+    print(f"{label} - {statistic} = {observed:.4f}, 95% CI = [{low:.4f}, {high:.4f}], Permutation p = {p_value:.4f}")
+
+def run_resampling_tests(engine, n_resamples=N_RESAMPLES, seed=RESAMPLING_SEED, workers=RESAMPLING_WORKERS):
+    """Bootstrap confidence intervals and permutation p-values for H1-H7 (no normality assumption)"""
+    print(f"\nResampling tests for H1-H7 ({n_resamples} resamples)")
+
+    # Function to print one resampling result with the settings of this run
+    def report(label, statistic, samples):
+        print_resampling_result(label, statistic, samples, n_resamples, seed, workers)
+
+    for group in commute_groups:
+        paired = engine.values('commute_distance_group', group, methods)
+        report(f"H1 {group} commutes", 'paired_mean_difference', (paired[:, 0], paired[:, 1]))
+
+    for method in methods:
+        report(f"H2 ({method})", 'mean_difference',
+               (engine.values('is_multimodal', True, method), engine.values('mode', 'CAR', method)))
+
+    for method in per_minute_methods:
+        positive = f'{method}_positive'
+        report(f"H3 ({method})", 'mean_difference',
+               (engine.values('is_multimodal', True, method, where=positive),
+                engine.values('mode', 'CAR', method, where=positive)))
+
+    for method in methods:
+        report(f"H4 ({method})", 'mean_difference',
+               (engine.values('mode', 'BICYCLE', method),
+                engine.values('mode', None, method, exclude=lambda mode: mode == 'BICYCLE')))
+
+    for method in methods:
+        car_trips = engine.values('mode', 'CAR', ['total_duration_min', method])
+        report(f"H5 ({method})", 'pearson_r', (car_trips[:, 0], car_trips[:, 1]))
+
+    for method in methods:
+        groups = tuple(engine.values(('commute_distance_group', 'mode'), ('short', mode), method) for mode in modes)
+        report(f"H6 ({method})", 'anova_f', groups)
+
+    for group in commute_groups:
+        for method in methods:
+            report(f"H7 {group} commutes ({method})", 'variance_ratio',
+                   (engine.values(('commute_distance_group', 'is_multimodal'), (group, True), method),
+                    engine.values(('commute_distance_group', 'is_multimodal'), (group, False), method)))
+
+def read_regression_chunks(file_path=input_file_path, chunk_size=REGRESSION_CHUNK_SIZE):
+    """Stream the columns needed for H8 from the summary CSV, deriving CO2 per km per chunk"""
+    columns = ['mode', 'total_km', 'total_duration_min'] + methods
+    for chunk in pd.read_csv(file_path, usecols=columns, chunksize=chunk_size):
+        for i, method in enumerate(methods, start=1):
+            chunk[f'co2_per_km_method_{i}'] = chunk[method] / chunk['total_km']
+        yield chunk
+
+def run_regression(file_path=input_file_path):
+    """H8: Linear regression for CO2 emissions per kilometer"""
+    print("\nH8: Linear regression for CO2 emissions per kilometer")
+
+    # Independent variables: total_km, mode (BICYCLE as reference), total_duration_min
+    results = fit_streaming_ols(lambda: read_regression_chunks(file_path),
+                                targets=['co2_per_km_method_1', 'co2_per_km_method_2'],
+                                numeric=['total_km', 'total_duration_min'],
+                                categorical={'mode': 'BICYCLE'})
+
+    for method, result in results.items():
+        print(f"\nCO2 per km ({method}) - R-squared = {result.r_squared:.4f}, N = {result.n}")
+        print(result.summary())
+
+def main(n_resamples=N_RESAMPLES, seed=RESAMPLING_SEED):
+    # Load the data
+    df = pd.read_csv(input_file_path)
+    instrumentation.add_rows(len(df))
+
+    # Call the function and store the results
+    descriptive_stats, avg_emissions_by_mode = calculate_emission_statistics(df)
+
+    # Output descriptive statistics and averages by mode
+    print("\nDescriptive Statistics (Method 1 and Method 2):")
+    print(descriptive_stats)
+
+    print("\nAverage Emissions by Mode of Transport (Method 1 and Method 2):")
+    print(avg_emissions_by_mode)
+
+    # Hypothesis Testing
+    engine = prepare_trips(df)
+    run_parametric_tests(engine)
+    run_resampling_tests(engine, n_resamples=n_resamples, seed=seed)
+    run_regression()
+
+if __name__ == "__main__":
+    main()
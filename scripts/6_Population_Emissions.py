@@ -0,0 +1,181 @@
+import os
+import logging
+import importlib
+import numpy as np
+import pandas as pd
+from utils import instrumentation
+from utils.od_sampling import distance_band
+from utils.odin_modes import EMISSION_CLASS_BY_HVM, EMISSION_CLASSES
+from utils.pc4_distance import DETOUR_FACTORS, straight_line_km
+from utils.pc4_lookup import load_pc4_centroids
+from utils.pc4_matrix import open_pc4_matrix
+
+# Resolve the data paths relative to the script directory
+script_dir = os.path.dirname(os.path.abspath(__file__))
+data_dir = os.path.join(script_dir, '../data/')
+processed_data_dir = os.path.join(data_dir, 'processed/')
+output_dir = os.path.join(data_dir, 'outputs/csv/')
+
+# Input and output files
+refined_commutes_path = os.path.join(processed_data_dir, 'refined_work_related_commutes.csv')
+georef_file_path = os.path.join(processed_data_dir, 'cleaned_georef-netherlands-postcode-pc4.csv')
+pc4_matrix_path = os.path.join(processed_data_dir, 'pc4_matrix')
+output_trips_file = os.path.join(output_dir, 'population_emissions_trips.csv')
+output_summary_file = os.path.join(output_dir, 'population_emissions_summary.csv')
+
+
+# Column holding the ODiN trip weight (FactorV); every trip counts once without it
+WEIGHT_COLUMN = 'FactorV'
+
+# Rows read at a time from the refined commutes
+CHUNK_SIZE = 500000
+
+# Function to build the per-Hvm lookup arrays (class code, detour factor, TTW and WTW g/km)
+def build_mode_tables():
+    calculator = importlib.import_module('4_CO2_Calculator')
+    ttw, wtw = calculator.emission_factors()
+    ttw = {**ttw, 'WALK': 0.0, 'OTHER': np.nan}
+    wtw = {**wtw, 'WALK': 0.0, 'OTHER': np.nan}
+    max_code = max(EMISSION_CLASS_BY_HVM)
+    # Codes outside the mapping (including missing modes) fall in OTHER
+    class_codes = np.full(max_code + 2, EMISSION_CLASSES.index('OTHER'), dtype=np.int8)
+    for hvm, emission_class in EMISSION_CLASS_BY_HVM.items():
+        class_codes[hvm] = EMISSION_CLASSES.index(emission_class)
+    return {
+        'class_codes': class_codes,
+        'detour': np.array([DETOUR_FACTORS[c] for c in EMISSION_CLASSES]),
+        'ttw': np.array([ttw[c] for c in EMISSION_CLASSES], dtype=float),
+        'wtw': np.array([wtw[c] for c in EMISSION_CLASSES], dtype=float),
+    }
+
+# Function to estimate the distance and emissions of every commute in a chunk
+def estimate_chunk(chunk, centroids, tables, matrix=None):
+    """
+    Estimate the network distance and the TTW and WTW emissions of refined commutes.
+
+    Parameters:
+    chunk (pd.DataFrame): Refined commutes with OriginZipCode, DestinationZipCode, ModeOfTransport
+        and optionally the FactorV survey weight.
+    centroids (PC4Centroids): The PC4 centroid lookup.
+    tables (dict): The lookup arrays of build_mode_tables.
+    matrix (PC4Matrix, optional): Network distances per mode; other modes use the detour factors.
+
+    Returns:
+    pd.DataFrame: One row per commute with its emission class, weight, distances, distance group and emissions
+    (distance and emissions are NaN for commutes with an unknown postcode).
+    """
+    # Centroid distance per distinct postcode pair (a fixed distance within one postcode)
+    origins = pd.to_numeric(chunk['OriginZipCode'], errors='coerce').to_numpy(dtype=float)
+    destinations = pd.to_numeric(chunk['DestinationZipCode'], errors='coerce').to_numpy(dtype=float)
+    straight_km = straight_line_km(centroids, origins, destinations)
+
+    hvm = pd.to_numeric(chunk['ModeOfTransport'], errors='coerce').to_numpy(dtype=float)
+    last_code = len(tables['class_codes']) - 1
+    hvm_index = np.where(np.isfinite(hvm) & (hvm >= 0) & (hvm < last_code), hvm, last_code).astype(np.intp)
+    class_codes = tables['class_codes'][hvm_index]
+    distance_km = straight_km * tables['detour'][class_codes]
+    if matrix is not None:
+        distance_km = matrix.network_km(np.array(EMISSION_CLASSES)[class_codes], origins, destinations, distance_km)
+
+    if WEIGHT_COLUMN in chunk.columns:
+        weight = pd.to_numeric(chunk[WEIGHT_COLUMN].astype(str).str.replace(',', '.'),
+                               errors='coerce').to_numpy(dtype=float)
+    else:
+        weight = np.ones(len(chunk))
+
+    return pd.DataFrame({
+        'OriginZipCode': chunk['OriginZipCode'].to_numpy(),
+        'DestinationZipCode': chunk['DestinationZipCode'].to_numpy(),
+        'ModeOfTransport': chunk['ModeOfTransport'].to_numpy(),
+        'emission_class': pd.Categorical.from_codes(class_codes, EMISSION_CLASSES),
+        'weight': weight,
+        'straight_km': straight_km,
+        'distance_km': distance_km,
+        'distance_group': np.where(np.isfinite(distance_km), distance_band(distance_km), 'unknown'),
+        'ttw_co2_g': distance_km * tables['ttw'][class_codes],
+        'wtw_co2_g': distance_km * tables['wtw'][class_codes],
+    })
+
+# Function to add the weighted totals of a chunk, per emission class and distance group
+def chunk_totals(trips):
+    weight = np.nan_to_num(trips['weight'].to_numpy(), nan=0.0)
+    totals = pd.DataFrame({
+        'emission_class': trips['emission_class'].astype(str),
+        'distance_group': trips['distance_group'],
+        'trips': 1,
+        'weighted_trips': weight,
+        'located_weighted_trips': np.where(trips['distance_km'].notna(), weight, 0.0),
+        'weighted_km': weight * trips['distance_km'].to_numpy(),
+        'ttw_co2_g': weight * trips['ttw_co2_g'].to_numpy(),
+        'wtw_co2_g': weight * trips['wtw_co2_g'].to_numpy(),
+    })
+    return totals.groupby(['emission_class', 'distance_group'], as_index=False).sum(min_count=1)
+
+# Function to turn the accumulated totals into the population summary
+def summarise(totals):
+    """
+    Combine the per-chunk totals into the weighted population estimate.
+
+    Parameters:
+    totals (list): DataFrames of chunk_totals.
+
+    Returns:
+    pd.DataFrame: Per emission class and distance group (plus 'ALL' rows): commutes in the survey, weighted
+    commutes, weighted km, TTW and WTW tonnes and the share by which TTW underestimates WTW.
+    """
+    summary = pd.concat(totals, ignore_index=True).groupby(['emission_class', 'distance_group'],
+                                                           as_index=False).sum(min_count=1)
+    by_class = summary.assign(distance_group='ALL').groupby(['emission_class', 'distance_group'],
+                                                            as_index=False).sum(min_count=1)
+    overall = by_class.assign(emission_class='ALL').groupby(['emission_class', 'distance_group'],
+                                                            as_index=False).sum(min_count=1)
+    summary = pd.concat([summary, by_class, overall], ignore_index=True)
+
+    # Commutes with an unknown postcode count in the weighted trips, but not in the distance and emissions
+    summary['mean_km'] = summary['weighted_km'] / summary.pop('located_weighted_trips').where(lambda w: w > 0)
+    summary['ttw_co2_tonnes'] = summary.pop('ttw_co2_g') / 1e6
+    summary['wtw_co2_tonnes'] = summary.pop('wtw_co2_g') / 1e6
+    wtw = summary['wtw_co2_tonnes'].where(summary['wtw_co2_tonnes'] > 0)
+    summary['ttw_underestimation_pct'] = (1 - summary['ttw_co2_tonnes'] / wtw) * 100
+    order = {name: i for i, name in enumerate(EMISSION_CLASSES + ['ALL'])}
+    groups = {name: i for i, name in enumerate(['short', 'medium', 'long', 'unknown', 'ALL'])}
+    return summary.sort_values(['emission_class', 'distance_group'],
+                               key=lambda column: column.map(order if column.name == 'emission_class' else groups),
+                               ignore_index=True)
+
+def main(chunk_size=CHUNK_SIZE):
+    # Ensure the output directory exists
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    centroids = load_pc4_centroids(georef_file_path)
+    tables = build_mode_tables()
+    # Network distances of the routed modes come from the PC4 matrices when they have been built
+    matrix = open_pc4_matrix(pc4_matrix_path)
+    if matrix is not None:
+        logging.info(f"Using the PC4 network distance matrices for {', '.join(matrix.modes)}")
+    columns = pd.read_csv(refined_commutes_path, nrows=0).columns
+    if WEIGHT_COLUMN not in columns:
+        logging.warning(f"'{WEIGHT_COLUMN}' is not in the refined commutes; every commute is weighted equally.")
+    usecols = [column for column in ['OriginZipCode', 'DestinationZipCode', 'ModeOfTransport', WEIGHT_COLUMN]
+               if column in columns]
+
+    totals = []
+    for i, chunk in enumerate(pd.read_csv(refined_commutes_path, usecols=usecols, chunksize=chunk_size)):
+        trips = estimate_chunk(chunk, centroids, tables, matrix)
+        trips.to_csv(output_trips_file, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+        totals.append(chunk_totals(trips))
+        instrumentation.add_rows(len(chunk))
+
+    if not totals:
+        logging.error("No refined commutes to estimate.")
+        return
+    summary = summarise(totals)
+    summary.to_csv(output_summary_file, index=False)
+    print("\nWeighted population estimate of commuting emissions:")
+    print(summary.to_string(index=False, float_format=lambda value: f"{value:,.2f}"))
+    logging.info(f"Per-commute estimates saved to '{output_trips_file}', summary to '{output_summary_file}'")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
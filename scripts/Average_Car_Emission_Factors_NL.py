@@ -1,4 +1,17 @@
+import os
+import logging
+import argparse
 import pandas as pd
+from utils import instrumentation
+from utils.fleet_factors import FUEL_TTW_FACTORS, stream_fleet_counts, weighted_factors
+
+# Resolve the data paths relative to the script directory
+script_dir = os.path.dirname(os.path.abspath(__file__))
+processed_data_dir = os.path.join(script_dir, '../data/processed/')
+
+# Output files: the factor table loaded by 4_CO2_Calculator, and the vehicle counts behind it
+fleet_factors_file = os.path.join(processed_data_dir, 'car_emission_factors.csv')
+fleet_counts_file = os.path.join(processed_data_dir, 'car_fleet_counts.csv')
 
 # Source: Data from the 2023 vehicle registry, RDW Netherlands
 
@@ -9,36 +22,58 @@ vehicle_data_2023 = {
     'Number': [3752, 7401993, 8279, 867185, 328486, 6, 95269, 168667, 12176, 594]
 }
 
-# Create a DataFrame from the above values
-df_2023 = pd.DataFrame(vehicle_data_2023)
-
 # Total number of M1 vehicles in 2023 (from the provided data)
 total_vehicles = 8886407
 
-# Calculate percentage composition per fuel type
-df_2023['Percentage'] = df_2023['Number'] / total_vehicles * 100
-
-# Define the WPM TTW CO2 emission factors for each fuel type (gCO2 per km)
-# These values are based on WPM emission factors
-emission_factors = {
-    'Petrol and petrol hybrid': 147,
-    'Diesel and diesel hybrid': 127,
-    'PHEV petrol': 116,  # Plug-in Hybrid
-    'FEV': 0,  # Full Electric is 0 gCO2/km according to WPM
-    'LPG and LPG hybrid': 129,
-    'CNG and CNG hybrid': 110,
-    'Hydrogen and hydrogen hybrid': 0,  # Treated as zero emissions
-    'PHEV diesel': 96,
-    'LNG and LNG hybrid': 96,
-    'Alcohol and alcohol hybrid': 36  # Assuming E85-like values for alcohol
-}
+# Function to calculate the average TTW factor of the 2023 M1 fleet from the published counts
+def average_2023_factor():
+    df_2023 = pd.DataFrame(vehicle_data_2023)
+
+    # Calculate percentage composition per fuel type
+    df_2023['Percentage'] = df_2023['Number'] / total_vehicles * 100
+
+    # Assign the WPM TTW emission factors (gCO2 per km) to the fuel types
+    df_2023['CO2_factor'] = df_2023['Fuel type'].map(FUEL_TTW_FACTORS)
+
+    # Calculate the weighted average CO2 emissions
+    df_2023['Weighted_CO2'] = df_2023['Percentage'] * df_2023['CO2_factor'] / 100
+    return df_2023['Weighted_CO2'].sum()
+
+# Function to read fuel-specific factors (the --fuel-factors CSV of WPM_Reporting; only CAR rows are used)
+def read_car_fuel_factors(fuel_factors_path):
+    factors = pd.read_csv(fuel_factors_path)
+    if 'mode' in factors.columns:
+        factors = factors[factors['mode'].str.strip().str.upper() == 'CAR']
+    return factors[['fuel_type', 'ttw_g_per_km', 'wtw_g_per_km']]
+
+def main(registry_path=None, fuel_path=None, fuel_factors_path=None):
+    if registry_path is None:
+        # Print the result
+        print(f"Average TTW CO2 emission for M1 vehicles in 2023: {average_2023_factor():.2f} gCO2/km")
+        return
+
+    # Stream the RDW exports into counts per fuel type, registration year and vehicle class
+    counts = stream_fleet_counts(registry_path, fuel_path)
+    instrumentation.add_rows(int(counts['vehicles'].sum()))
+    factors = weighted_factors(counts, read_car_fuel_factors(fuel_factors_path) if fuel_factors_path else None)
 
-# Assign emission factors to the fuel types
-df_2023['CO2_factor'] = df_2023['Fuel type'].map(emission_factors)
+    if not os.path.exists(processed_data_dir):
+        os.makedirs(processed_data_dir)
+    counts.to_csv(fleet_counts_file, index=False)
+    factors.to_csv(fleet_factors_file, index=False)
 
-# Calculate the weighted average CO2 emissions
-df_2023['Weighted_CO2'] = df_2023['Percentage'] * df_2023['CO2_factor'] / 100
-average_co2_emission = df_2023['Weighted_CO2'].sum()
+    fleet = factors[(factors['registration_year'] == 'ALL') & (factors['vehicle_class'] == 'ALL')].iloc[0]
+    print(f"Fleet-mix car factors over {int(fleet['vehicles']):,} passenger cars: "
+          f"TTW {fleet['ttw_g_per_km']:.2f} gCO2/km, WTW {fleet['wtw_g_per_km']:.2f} gCO2/km")
+    logging.info(f"Car factors saved to '{fleet_factors_file}', vehicle counts to '{fleet_counts_file}'")
 
-# Print the result
-print(f"Average TTW CO2 emission for M1 vehicles in 2023: {average_co2_emission:.2f} gCO2/km")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fleet-mix car emission factors from the RDW vehicle registry.")
+    parser.add_argument('--registry', default=None,
+                        help="RDW 'Gekentekende voertuigen' export; without it the 2023 average is printed.")
+    parser.add_argument('--fuel', default=None, help="RDW 'Gekentekende voertuigen brandstof' export.")
+    parser.add_argument('--fuel-factors', default=None,
+                        help="CSV of fuel-specific factors: fuel_type, ttw_g_per_km, wtw_g_per_km.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main(args.registry, args.fuel, args.fuel_factors)
@@ -1,14 +1,38 @@
 import pandas as pd
 import os
+import argparse
+from utils import instrumentation
+from utils.odin_dataset import parse_years, read_odin
 
 # Define the paths to the ODIN data file and output directory
 data_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../data/'))
 file_path = os.path.join(data_dir, 'raw/ODiN2022_Databestand.csv')
 output_dir = os.path.join(data_dir, 'processed/')
 
-# Ensure the output directory exists
-if not os.path.exists(output_dir):
-    os.makedirs(output_dir)
+# Several survey years, partitioned by year and trip purpose (built by ODiN_Dataset.py)
+dataset_path = os.path.join(output_dir, 'odin')
+
+# Work-related trip purposes (MotiefV)
+work_related_purposes = ['1', '3']
+
+# Columns of the expense reimbursement data
+expense_reimbursement_columns = [
+    'WrkVervw',  # Mode of transport with most kilometers to work
+    'WrkVerg',   # Receives reimbursement from employer for travel to work
+    'VergVast',  # Fixed amount per period
+    'VergKm',    # Reimbursement per kilometer driven
+    'VergBrSt',  # Fuel cost reimbursement
+    'VergOV',    # Public transport subscription reimbursement
+    'VergAans',  # Purchase cost reimbursement of the vehicle
+    'VergVoer',  # Lease or company vehicle
+    'VergBudg',  # Mobility budget
+    'VergPark',  # Parking costs reimbursement
+    'VergStal',  # Bicycle or moped parking costs reimbursement
+    'VergAnd'    # Other reimbursements
+]
+
+# Person id, survey weights and survey year, kept with the expense data when present
+survey_columns = ['year', 'OPID', 'FactorP', 'FactorV']
 
 def load_data(file_path, chunk_size=50000):
     """
@@ -25,6 +49,7 @@ def load_data(file_path, chunk_size=50000):
     try:
         for chunk in pd.read_csv(file_path, chunksize=chunk_size, delimiter=';', encoding='latin1'):
             chunks.append(chunk)
+            instrumentation.add_rows(len(chunk))
         df = pd.concat(chunks)
         print("Data loaded successfully.")
         return df
@@ -32,6 +57,24 @@ def load_data(file_path, chunk_size=50000):
         print(f"An error occurred while reading the CSV file: {e}")
         return None
 
+def load_dataset_years(dataset_path, years):
+    """
+    Load the work-related trips of several survey years from the partitioned ODiN dataset.
+
+    Only the partitions of the given years and the work-related purposes are read.
+
+    Parameters:
+    dataset_path (str): The path to the dataset.
+    years (list): The survey years.
+
+    Returns:
+    pd.DataFrame: The trips, with their survey year in 'year'.
+    """
+    df = read_odin(dataset_path, years=years, purposes=[int(purpose) for purpose in work_related_purposes])
+    instrumentation.add_rows(len(df))
+    print(f"Loaded {len(df)} work-related trips of {', '.join(str(year) for year in years)}.")
+    return df
+
 def filter_work_related_commutes(df):
     """
     Filter the dataset to include only work-related commutes.
@@ -45,12 +88,12 @@ def filter_work_related_commutes(df):
     origin_col = 'VertPC'
     destination_col = 'AankPC'
     trip_purpose_col = 'MotiefV'
-    work_related_purposes = ['1', '3']  # Work-related purposes
 
     # Filter out rows with missing or invalid zip codes and non-work-related purposes
+    # (purposes are compared as text: the CSV has them as text, the dataset as numbers)
     df_filtered = df[(df[origin_col].notna()) & (df[destination_col].notna()) & 
                      (df[origin_col] != 0) & (df[destination_col] != 0) & 
-                     (df[trip_purpose_col].isin(work_related_purposes))]
+                     (df[trip_purpose_col].astype(str).str.strip().isin(work_related_purposes))]
     return df_filtered
 
 def refine_columns(df_filtered):
@@ -70,6 +113,11 @@ def refine_columns(df_filtered):
         'Hvm': 'ModeOfTransport'
     }
 
+    # Keep the survey weights (trip and person) and the survey year when the data has them
+    for weight_column in ['FactorV', 'FactorP', 'year']:
+        if weight_column in df_filtered.columns:
+            columns_to_keep[weight_column] = weight_column
+
     refined_commutes = df_filtered[list(columns_to_keep.keys())].rename(columns=columns_to_keep)
     return refined_commutes
 
@@ -205,22 +253,11 @@ def extract_expense_reimbursement_data(df):
     Returns:
     pd.DataFrame: The DataFrame with expense reimbursement data.
     """
-    expense_reimbursement_columns = [
-        'WrkVervw',  # Mode of transport with most kilometers to work
-        'WrkVerg',   # Receives reimbursement from employer for travel to work
-        'VergVast',  # Fixed amount per period
-        'VergKm',    # Reimbursement per kilometer driven
-        'VergBrSt',  # Fuel cost reimbursement
-        'VergOV',    # Public transport subscription reimbursement
-        'VergAans',  # Purchase cost reimbursement of the vehicle
-        'VergVoer',  # Lease or company vehicle
-        'VergBudg',  # Mobility budget
-        'VergPark',  # Parking costs reimbursement
-        'VergStal',  # Bicycle or moped parking costs reimbursement
-        'VergAnd'    # Other reimbursements
-    ]
-
-    expense_reimbursement_data = df[expense_reimbursement_columns].dropna()
+    # Keep the person id and the survey weights when the data has them, for the weighted shares
+    available_survey_columns = [column for column in survey_columns if column in df.columns]
+
+    expense_reimbursement_data = df[expense_reimbursement_columns + available_survey_columns].dropna(
+        subset=expense_reimbursement_columns)
 
     expense_reimbursement_file_path = os.path.join(output_dir, 'expense_reimbursement_data.csv')
     expense_reimbursement_data.to_csv(expense_reimbursement_file_path, index=False)
@@ -249,9 +286,13 @@ def analyze_dataset(df):
 
 # Add the call to `analyze_dataset` in the `main()` function
 
-def main():
-    # Load the dataset
-    df = load_data(file_path)
+def main(years=None):
+    # Ensure the output directory exists
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Load the dataset: the 2022 survey, or the work-related trips of several years from the partitioned dataset
+    df = load_data(file_path) if years is None else load_dataset_years(dataset_path, years)
     
     if df is not None:
         # Analyze the dataset
@@ -275,7 +316,9 @@ def main():
         total_trips = refined_commutes.shape[0]
         save_top_zipcodes(refined_commutes, total_trips)
         
-        # Extract and save expense reimbursement data
+        # Extract and save expense reimbursement data (of every respondent, not only those with a work trip)
+        if years is not None:
+            df = read_odin(dataset_path, columns=expense_reimbursement_columns + survey_columns, years=years)
         extract_expense_reimbursement_data(df)
         
         # Debug: Print summaries
@@ -287,4 +330,8 @@ def main():
         print(mode_of_transport_counts.head())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Filter the ODiN survey to work-related commutes.")
+    parser.add_argument('--years', type=parse_years, default=None,
+                        help="Survey years from the partitioned dataset, e.g. 2018-2023 (default: the 2022 CSV).")
+    args = parser.parse_args()
+    main(args.years)
\ No newline at end of file
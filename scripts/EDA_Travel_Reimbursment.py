@@ -1,44 +1,51 @@
 import os
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import squarify
+from utils.figure_jobs import FigureRunner
+from utils.weighted_crosstab import WeightedCrosstab
 
-# Ensure the script uses its own directory as the working directory
+# Resolve the data paths relative to the script directory
 script_dir = os.path.dirname(os.path.abspath(__file__))
-os.chdir(script_dir)
 
 # Define the paths to the datasets
-data_dir = '../data/processed/'
-output_dir = '../data/outputs/graphs/'
+data_dir = os.path.join(script_dir, '../data/processed/')
+output_dir = os.path.join(script_dir, '../data/outputs/graphs/')
+csv_output_dir = os.path.join(script_dir, '../data/outputs/csv/')
 
 # File paths
 expense_reimbursement_path = os.path.join(data_dir, 'expense_reimbursement_data.csv')
+# Weighted shares (with standard errors) of every reimbursement breakdown; the charts are drawn from it
+reimbursement_shares_path = os.path.join(csv_output_dir, 'reimbursement_shares.csv')
+
+# Every chart is a job of its input files; unchanged charts are skipped on the next run
+figures = FigureRunner(manifest_path=os.path.join(output_dir, '.figure_manifest_reimbursement.json'))
+
+# Mode of transport codes and their descriptions
+transport_modes = {
+    1: 'On foot',
+    2: 'Bicycle/Electric Bicycle/Speed Pedelec',
+    3: 'Moped/Scooter',
+    4: 'Passenger Car',
+    5: 'Van',
+    6: 'Motor',
+    7: 'Train',
+    8: 'Bus/Tram/Metro',
+    9: 'Other',
+    10: 'Unknown',
+    11: 'Work from Home',
+    12: 'No Paid Work',
+    13: 'Under 15 years old'
+}
 
-# Load the datasets
-expense_data = pd.read_csv(expense_reimbursement_path)
-
-# Function to map mode of transport codes to descriptions
-def map_transport_mode(code):
-    mode_mapping = {
-        1: 'On foot',
-        2: 'Bicycle/Electric Bicycle/Speed Pedelec',
-        3: 'Moped/Scooter',
-        4: 'Passenger Car',
-        5: 'Van',
-        6: 'Motor',
-        7: 'Train',
-        8: 'Bus/Tram/Metro',
-        9: 'Other',
-        10: 'Unknown',
-        11: 'Work from Home',
-        12: 'No Paid Work',
-        13: 'Under 15 years old'
-    }
-    return mode_mapping.get(code, 'Unknown')
-
-# Map transport mode codes to descriptions
-expense_data['WrkVervw'] = expense_data['WrkVervw'].apply(map_transport_mode)
+# Reimbursement answer codes (WrkVerg) and their descriptions
+reimbursement_answers = {
+    0: 'No Reimbursement',
+    1: 'Reimbursement',
+    2: 'Not Applicable'
+}
 
 # Reimbursement type labels
 reimbursement_labels = {
@@ -54,53 +61,157 @@ reimbursement_labels = {
     'VergAnd': 'Other'
 }
 
-# Plot 1: Improved Donut chart for percentage of respondents receiving any form of reimbursement
-reimbursement_counts = expense_data['WrkVerg'].value_counts(normalize=True) * 100
-reimbursement_counts.index = ['No Reimbursement', 'Reimbursement', 'Not Applicable']
-
-fig, ax = plt.subplots(figsize=(8, 8))
-wedges, texts, autotexts = ax.pie(reimbursement_counts, labels=reimbursement_counts.index, autopct='%1.1f%%', startangle=140, colors=sns.color_palette('pastel'), wedgeprops=dict(width=0.3, edgecolor='w'))
-
-for i, wedge in enumerate(wedges):
-    plt.setp(autotexts[i], size=10, weight="bold")
-    plt.setp(texts[i], size=12)
-
-# Save the donut chart
-donut_chart_path = os.path.join(output_dir, 'reimbursement_percentage_donut.png')
-plt.savefig(donut_chart_path)
-
-# Plot 2: Improved Treemap for distribution of different reimbursement types
+# Reimbursement type columns
 reimbursement_types = ['VergVast', 'VergKm', 'VergBrSt', 'VergOV', 'VergAans', 'VergVoer', 'VergBudg', 'VergPark', 'VergStal', 'VergAnd']
-reimbursement_counts = expense_data[reimbursement_types].apply(pd.Series.value_counts).loc[1].fillna(0)
-reimbursement_counts.index = [reimbursement_labels[key] for key in reimbursement_counts.index]
 
-fig, ax = plt.subplots(figsize=(12, 8))
-squarify.plot(sizes=reimbursement_counts.values, label=reimbursement_counts.index, alpha=0.8, color=sns.color_palette('viridis', len(reimbursement_counts)), ax=ax, pad=True)
-ax.axis('off')
-plt.tight_layout()
+# Transport modes left out of the heatmap
+filtered_modes = ['On foot', 'Other', 'No Paid Work', 'Under 15 years old', 'Unknown', 'Work from Home']
 
-# Save the treemap
-treemap_path = os.path.join(output_dir, 'reimbursement_treemap.png')
-plt.savefig(treemap_path)
+# Function to choose the survey weights of the expense data
+def survey_weights(expense_data):
+    """
+    Weight the respondents with the ODiN person weight, falling back to the trip weight.
+
+    The reimbursement questions are asked once per person and repeated on each of their trips, so with a
+    person id every person (of every survey year) is kept once and weighted with FactorP. Without one the rows are weighted
+    with FactorV, and without weights every row counts once.
+
+    Parameters:
+    expense_data (pd.DataFrame): The expense reimbursement data.
+
+    Returns:
+    tuple: (the rows to count, their weight column or None).
+    """
+    if 'FactorP' in expense_data.columns and 'OPID' in expense_data.columns:
+        persons = [column for column in ['year', 'OPID'] if column in expense_data.columns]
+        expense_data, weight_column = expense_data.drop_duplicates(persons), 'FactorP'
+    elif 'FactorV' in expense_data.columns:
+        weight_column = 'FactorV'
+    else:
+        return expense_data, None
+    # ODiN exports use a decimal comma
+    expense_data = expense_data.assign(**{weight_column: pd.to_numeric(
+        expense_data[weight_column].astype(str).str.replace(',', '.'), errors='coerce')})
+    return expense_data, weight_column
+
+# Function to compute every reimbursement breakdown from one weighted crosstab
+def reimbursement_shares(expense_data):
+    """
+    Weighted shares and standard errors of the reimbursement answers, overall and per mode of transport.
+
+    The reimbursement type columns are stacked into one 'type' column, so a single crosstab of
+    (WrkVervw, WrkVerg, type, value) holds every breakdown; within one type every respondent counts once.
+
+    Parameters:
+    expense_data (pd.DataFrame): The expense reimbursement data, with the raw WrkVervw codes.
+
+    Returns:
+    pd.DataFrame: One row per breakdown ('WrkVerg' or a reimbursement type), mode of transport ('ALL'
+    overall) and answer code: 'n', 'weighted', 'share' and 'se'.
+    """
+    respondents, weight_column = survey_weights(expense_data)
+    weights = np.ones(len(respondents)) if weight_column is None else respondents[weight_column].to_numpy()
+    stacked = pd.DataFrame({
+        'WrkVervw': np.tile(respondents['WrkVervw'].to_numpy(), len(reimbursement_types)),
+        'WrkVerg': np.tile(respondents['WrkVerg'].to_numpy(), len(reimbursement_types)),
+        'type': np.repeat(reimbursement_types, len(respondents)),
+        'value': respondents[reimbursement_types].to_numpy().T.ravel()
+    })
+    crosstab = WeightedCrosstab(stacked, ['WrkVervw', 'WrkVerg', 'type', 'value'],
+                                np.tile(weights, len(reimbursement_types)))
+
+    # WrkVerg from the rows of one type, so that every respondent counts once
+    answer_shares = [crosstab.shares('WrkVerg', by=['type']), crosstab.shares('WrkVerg', by=['type', 'WrkVervw'])]
+    answer_shares = [table[table['type'] == reimbursement_types[0]].assign(type='WrkVerg') for table in answer_shares]
+    breakdowns = pd.concat(answer_shares + [crosstab.shares('value', by=['type']),
+                                            crosstab.shares('value', by=['type', 'WrkVervw'])], ignore_index=True)
+    breakdowns['WrkVervw'] = breakdowns['WrkVervw'].map(transport_modes).fillna('Unknown').where(
+        breakdowns['WrkVervw'].notna(), 'ALL')
+    breakdowns = breakdowns.rename(columns={'type': 'breakdown'})
+    return breakdowns[['breakdown', 'WrkVervw', 'category', 'n', 'weighted', 'share', 'se']]
+
+# Function to load the shares of one breakdown
+def load_shares(breakdown, by_mode=False):
+    shares = pd.read_csv(reimbursement_shares_path)
+    shares = shares[shares['breakdown'].isin([breakdown] if isinstance(breakdown, str) else breakdown)]
+    return shares[(shares['WrkVervw'] != 'ALL') == by_mode]
 
-# Plot 3: Improved Heatmap for correlation between different types of reimbursements and modes of transport
-# Filter out specific transport modes
-filtered_modes = ['On foot', 'Other', 'No Paid Work', 'Under 15 years old', 'Unknown', 'Work from Home']
-heatmap_data = expense_data[~expense_data['WrkVervw'].isin(filtered_modes)][reimbursement_types + ['WrkVervw']]
-heatmap_data = heatmap_data.replace({0: 0, 1: 1, 2: 2}).groupby('WrkVervw').mean()
+# Plot 1: Improved Donut chart for percentage of respondents receiving any form of reimbursement
+@figures.register('reimbursement_donut', inputs=[reimbursement_shares_path],
+                  outputs=[os.path.join(output_dir, 'reimbursement_percentage_donut.png')])
+def plot_reimbursement_donut():
+    shares = load_shares('WrkVerg').sort_values('share', ascending=False)
+    reimbursement_counts = pd.Series(shares['share'].to_numpy() * 100,
+                                     index=[reimbursement_answers.get(code, 'Unknown') for code in shares['category']])
 
-# Update axis labels for better readability
-heatmap_data = heatmap_data.rename(columns=reimbursement_labels)
+    fig, ax = plt.subplots(figsize=(8, 8))
+    wedges, texts, autotexts = ax.pie(reimbursement_counts, labels=reimbursement_counts.index, autopct='%1.1f%%', startangle=140, colors=sns.color_palette('pastel'), wedgeprops=dict(width=0.3, edgecolor='w'))
 
-fig, ax = plt.subplots(figsize=(14, 10))
-sns.heatmap(heatmap_data.T, annot=True, cmap='coolwarm', cbar_kws={'label': 'Average Reimbursement Rate'}, ax=ax)
-ax.set_xlabel('Transport Modes')
-ax.set_ylabel('Reimbursement Types')
-ax.set_xticklabels(ax.get_xticklabels(), rotation=45, ha='right')
-plt.tight_layout()
+    for i, wedge in enumerate(wedges):
+        plt.setp(autotexts[i], size=10, weight="bold")
+        plt.setp(texts[i], size=12)
 
-# Save the heatmap
-heatmap_path = os.path.join(output_dir, 'correlation_heatmap.png')
-plt.savefig(heatmap_path)
+    # Save the donut chart
+    donut_chart_path = os.path.join(output_dir, 'reimbursement_percentage_donut.png')
+    plt.savefig(donut_chart_path)
 
-print("Graphs created and saved.")
\ No newline at end of file
+# Plot 2: Improved Treemap for distribution of different reimbursement types
+@figures.register('reimbursement_treemap', inputs=[reimbursement_shares_path],
+                  outputs=[os.path.join(output_dir, 'reimbursement_treemap.png')])
+def plot_reimbursement_treemap():
+    shares = load_shares(reimbursement_types)
+    # Weighted number of respondents receiving each type of reimbursement
+    reimbursement_counts = shares[shares['category'] == 1].set_index('breakdown')['weighted']
+    reimbursement_counts = reimbursement_counts.reindex(reimbursement_types, fill_value=0)
+    reimbursement_counts = reimbursement_counts[reimbursement_counts > 0]
+    reimbursement_counts.index = [reimbursement_labels[key] for key in reimbursement_counts.index]
+
+    fig, ax = plt.subplots(figsize=(12, 8))
+    squarify.plot(sizes=reimbursement_counts.values, label=reimbursement_counts.index, alpha=0.8, color=sns.color_palette('viridis', len(reimbursement_counts)), ax=ax, pad=True)
+    ax.axis('off')
+    plt.tight_layout()
+
+    # Save the treemap
+    treemap_path = os.path.join(output_dir, 'reimbursement_treemap.png')
+    plt.savefig(treemap_path)
+
+# Plot 3: Improved Heatmap for correlation between different types of reimbursements and modes of transport
+@figures.register('correlation_heatmap', inputs=[reimbursement_shares_path],
+                  outputs=[os.path.join(output_dir, 'correlation_heatmap.png')])
+def plot_correlation_heatmap():
+    shares = load_shares(reimbursement_types, by_mode=True)
+
+    # Filter out specific transport modes
+    shares = shares[~shares['WrkVervw'].isin(filtered_modes)]
+
+    # Weighted mean of the answer codes per mode and reimbursement type
+    heatmap_data = (shares['category'] * shares['share']).groupby([shares['WrkVervw'], shares['breakdown']]).sum()
+    heatmap_data = heatmap_data.unstack('breakdown').reindex(columns=reimbursement_types)
+
+    # Update axis labels for better readability
+    heatmap_data = heatmap_data.rename(columns=reimbursement_labels)
+
+    fig, ax = plt.subplots(figsize=(14, 10))
+    sns.heatmap(heatmap_data.T, annot=True, cmap='coolwarm', cbar_kws={'label': 'Average Reimbursement Rate'}, ax=ax)
+    ax.set_xlabel('Transport Modes')
+    ax.set_ylabel('Reimbursement Types')
+    ax.set_xticklabels(ax.get_xticklabels(), rotation=45, ha='right')
+    plt.tight_layout()
+
+    # Save the heatmap
+    heatmap_path = os.path.join(output_dir, 'correlation_heatmap.png')
+    plt.savefig(heatmap_path)
+
+def main():
+    # One pass over the respondents for every breakdown; the charts only re-render when the shares change
+    shares = reimbursement_shares(pd.read_csv(expense_reimbursement_path))
+    if not os.path.exists(csv_output_dir):
+        os.makedirs(csv_output_dir)
+    shares.to_csv(reimbursement_shares_path, index=False)
+    print(f"Reimbursement shares saved to {reimbursement_shares_path}")
+
+    figures.run()
+    print("Graphs created and saved.")
+
+if __name__ == "__main__":
+    main()
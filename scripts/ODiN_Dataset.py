@@ -0,0 +1,65 @@
+import os
+import glob
+import time
+import logging
+import argparse
+from utils import instrumentation
+from utils.odin_dataset import parse_years, write_odin_year, year_of_csv
+
+# Resolve the data paths relative to the script directory
+script_dir = os.path.dirname(os.path.abspath(__file__))
+raw_data_dir = os.path.join(script_dir, '../data/raw/')
+processed_data_dir = os.path.join(script_dir, '../data/processed/')
+
+# The yearly ODiN exports (ODiN2018_Databestand.csv ... ODiN2023_Databestand.csv)
+odin_exports_pattern = os.path.join(raw_data_dir, 'ODiN*_Databestand*.csv')
+
+# The partitioned dataset read by EDA_ODiN.py --years (see utils.odin_dataset for the layout)
+dataset_path = os.path.join(processed_data_dir, 'odin')
+
+# Function to find the yearly ODiN exports
+def find_odin_exports(csv_paths=None):
+    """
+    Map survey years to their ODiN exports.
+
+    Parameters:
+    csv_paths (list, optional): The exports to convert (default: every export in data/raw).
+
+    Returns:
+    dict: Survey year -> export path.
+    """
+    exports = {}
+    for csv_path in sorted(csv_paths or glob.glob(odin_exports_pattern)):
+        year = year_of_csv(csv_path)
+        if year is None:
+            logging.warning(f"Skipping '{csv_path}': no survey year in its name")
+        else:
+            exports[year] = csv_path
+    return exports
+
+def main(years=None, csv_paths=None):
+    exports = find_odin_exports(csv_paths)
+    if years is not None:
+        missing = sorted(set(years) - set(exports))
+        if missing:
+            logging.warning(f"No ODiN export of {', '.join(str(year) for year in missing)}")
+        exports = {year: csv_path for year, csv_path in exports.items() if year in years}
+    if not exports:
+        print(f"No ODiN exports to convert (looked for '{odin_exports_pattern}').")
+        return
+
+    for year, csv_path in exports.items():
+        started = time.perf_counter()
+        rows = write_odin_year(csv_path, dataset_path, year)
+        instrumentation.add_rows(rows)
+        print(f"ODiN {year}: {rows:,} rows converted in {time.perf_counter() - started:.1f}s")
+    logging.info(f"ODiN dataset saved to '{dataset_path}'")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the yearly ODiN exports into the partitioned Parquet dataset.")
+    parser.add_argument('--years', type=parse_years, default=None, help="Survey years to convert, e.g. 2018-2023 (default: all).")
+    parser.add_argument('--csv', nargs='+', default=None,
+                        help="ODiN exports to convert (default: data/raw/ODiN<year>_Databestand.csv).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main(args.years, args.csv)
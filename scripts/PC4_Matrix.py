@@ -0,0 +1,116 @@
+import os
+import logging
+import argparse
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from utils import instrumentation
+from utils.od_sampling import aggregate_flows
+from utils.pc4_lookup import load_pc4_centroids
+from utils.pc4_matrix import PC4MatrixWriter
+
+# Resolve the data paths relative to the script directory
+script_dir = os.path.dirname(os.path.abspath(__file__))
+processed_data_dir = os.path.join(script_dir, '../data/processed/')
+refined_commutes_path = os.path.join(processed_data_dir, 'refined_work_related_commutes.csv')
+georef_file_path = os.path.join(processed_data_dir, 'cleaned_georef-netherlands-postcode-pc4.csv')
+
+# Store path of the matrices (see utils.pc4_matrix for the files)
+matrix_path = os.path.join(processed_data_dir, 'pc4_matrix')
+
+# Routed modes, each with its own matrices
+MATRIX_MODES = ['CAR', 'BICYCLE', 'TRANSIT']
+
+# Per mode, the busiest observed ODiN flows are routed, plus uniformly drawn pairs so that every
+# distance band has routed entries to calibrate the estimated ones on
+ROUTED_FLOWS = 5000
+CALIBRATION_PAIRS = 1000
+SEED = 42
+
+# Concurrent OTP requests
+WORKERS = 8
+
+# Departure time of every query: a weekday morning of the routing stage's service date
+DEPARTURE_TIME = '08:00'
+
+# Function to choose the postcode pairs to route for a mode
+def select_pairs(flows, postcodes, mode, routed_flows, calibration_pairs, rng):
+    """
+    Choose the pairs to route: the busiest flows of the mode and uniformly drawn postcode pairs.
+
+    Parameters:
+    flows (pd.DataFrame): The flows of aggregate_flows.
+    postcodes (np.ndarray): The postcodes with a matrix row.
+    mode (str): The routing mode.
+    routed_flows (int): The number of busiest flows.
+    calibration_pairs (int): The number of uniformly drawn pairs.
+    rng (np.random.Generator): The random generator.
+
+    Returns:
+    np.ndarray: (n, 2) array of distinct (origin, destination) postcodes in different areas.
+    """
+    busiest = flows[flows['mode'] == mode].nlargest(routed_flows, 'weight')[['origin', 'destination']].to_numpy()
+    drawn = rng.choice(postcodes, size=(calibration_pairs, 2))
+    pairs = np.unique(np.concatenate([busiest.reshape(-1, 2), drawn]).astype(np.int64), axis=0)
+    # Commutes within one postcode keep the intrazonal estimate; their centroids coincide
+    return pairs[pairs[:, 0] != pairs[:, 1]]
+
+# Function to route the pairs of a mode concurrently between the PC4 centroids
+def route_pairs(pairs, mode, centroids, departure_time, workers):
+    """
+    Route postcode pairs between their centroids.
+
+    Returns:
+    tuple: (distance_km, duration_min) arrays aligned with pairs (NaN where no route was found).
+    """
+    routing = importlib.import_module('3_OTP_routing')
+    lat, lon = centroids.lat, centroids.lon
+
+    def route(pair):
+        origin, destination = int(pair[0]), int(pair[1])
+        route_info = routing.process_route(routing.generate_route(
+            {'Address': f"PC4 {origin}", 'Latitude': lat[origin], 'Longitude': lon[origin]},
+            {'Address': f"PC4 {destination}", 'Latitude': lat[destination], 'Longitude': lon[destination]},
+            departure_time, mode), mode)
+        instrumentation.add_rows(1)
+        if route_info is None:
+            return np.nan, np.nan
+        return route_info['total_km'], route_info['total_duration_min']
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = np.array(list(executor.map(route, pairs)), dtype=float).reshape(-1, 2)
+    return results[:, 0], results[:, 1]
+
+def main(modes=MATRIX_MODES, routed_flows=ROUTED_FLOWS, calibration_pairs=CALIBRATION_PAIRS, seed=SEED,
+         workers=WORKERS):
+    routing = importlib.import_module('3_OTP_routing')
+    departure_time = datetime.strptime(f"{routing.SERVICE_DATE} {DEPARTURE_TIME}", '%Y-%m-%d %H:%M')
+    centroids = load_pc4_centroids(georef_file_path)
+    flows = aggregate_flows(pd.read_csv(refined_commutes_path), centroids)
+    rng = np.random.default_rng(seed)
+
+    with PC4MatrixWriter(matrix_path, centroids, modes) as writer:
+        logging.info(f"Building {len(modes)} mode matrices of {len(writer.postcodes)} x {len(writer.postcodes)} postcodes")
+        for mode in modes:
+            pairs = select_pairs(flows, writer.postcodes, mode, routed_flows, calibration_pairs, rng)
+            distance_km, duration_min = route_pairs(pairs, mode, centroids, departure_time, workers)
+            routed = np.isfinite(distance_km)
+            if not routed.any():
+                # Without routed entries there is nothing to calibrate on (is the OTP server up?)
+                raise RuntimeError(f"No {mode} route found for any of {len(pairs)} pairs; the matrices are not replaced.")
+            writer.set_routed(mode, pairs[routed, 0], pairs[routed, 1], distance_km[routed], duration_min[routed])
+            calibration = writer.fill(mode)
+            logging.info(f"{mode}: routed {routed.sum()} of {len(pairs)} pairs; calibration {calibration}")
+    logging.info(f"PC4 matrices saved to '{matrix_path}.*'")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the PC4 x PC4 network distance and duration matrices.")
+    parser.add_argument('--routed-flows', type=int, default=ROUTED_FLOWS, help="Busiest ODiN flows routed per mode.")
+    parser.add_argument('--calibration-pairs', type=int, default=CALIBRATION_PAIRS,
+                        help="Uniformly drawn pairs routed per mode for the calibration.")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="Concurrent OTP requests.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main(routed_flows=args.routed_flows, calibration_pairs=args.calibration_pairs, workers=args.workers)
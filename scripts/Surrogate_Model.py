@@ -0,0 +1,65 @@
+import os
+import time
+import logging
+import numpy as np
+import pandas as pd
+from utils import instrumentation
+from utils.surrogate import TRAINING_COLUMNS, SurrogateModel, evaluate, held_out
+
+# Resolve the data paths relative to the script directory
+script_dir = os.path.dirname(os.path.abspath(__file__))
+data_dir = os.path.join(script_dir, '../data/outputs/csv/')
+
+# Input and output files
+input_file = os.path.join(data_dir, 'co2_emissions_summary.csv')
+model_file = os.path.join(data_dir, 'surrogate_emission_model.json')
+error_report_file = os.path.join(data_dir, 'surrogate_heldout_errors.csv')
+
+# Share of the routed trips held out to measure the error, and the seed of the split
+TEST_FRACTION = 0.2
+SPLIT_SEED = 42
+
+# Rows read at a time from the CO2 summary
+CHUNK_SIZE = 100000
+
+# Function to read the columns of the CO2 summary the surrogate needs, chunk by chunk
+def read_routed_trips(chunk_size=CHUNK_SIZE):
+    columns = pd.read_csv(input_file, nrows=0).columns
+    for chunk in pd.read_csv(input_file, usecols=[column for column in TRAINING_COLUMNS if column in columns],
+                             chunksize=chunk_size):
+        instrumentation.add_rows(len(chunk))
+        yield chunk
+
+# Function to measure how many trips per second the surrogate scores
+def prediction_throughput(model, n_trips=1000000, seed=0):
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(50.75, 53.45, (2, n_trips))
+    lon = rng.uniform(3.4, 7.2, (2, n_trips))
+    modes = rng.choice(sorted(model.coefficients), n_trips)
+    times = rng.choice(['morning', 'evening'], n_trips)
+    started = time.perf_counter()
+    model.predict(modes, lat[0], lon[0], lat[1], lon[1], times)
+    return n_trips / (time.perf_counter() - started)
+
+def main(test_fraction=TEST_FRACTION, seed=SPLIT_SEED):
+    # Fit on the routed trips outside the held-out share
+    model = SurrogateModel.fit(read_routed_trips, test_fraction=test_fraction, seed=seed)
+    if not model.coefficients:
+        logging.error("Too few routed trips to fit the surrogate model.")
+        return
+    model.save(model_file)
+    logging.info(f"Surrogate model saved to '{model_file}'")
+
+    # Score the held-out trips
+    test_trips = pd.concat([chunk[held_out(chunk['trip_id'], test_fraction, seed)] for chunk in read_routed_trips()],
+                           ignore_index=True)
+    report = evaluate(model, test_trips)
+    report.to_csv(error_report_file, index=False)
+    print("\nSurrogate model error on held-out routed trips:")
+    print(report.to_string(index=False))
+    print(f"\nPrediction throughput: {prediction_throughput(model):,.0f} trips per second")
+    logging.info(f"Held-out error report saved to '{error_report_file}'")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
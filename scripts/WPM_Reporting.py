@@ -0,0 +1,195 @@
+import os
+import time
+import logging
+import argparse
+import importlib
+import numpy as np
+import pandas as pd
+from utils import instrumentation
+from utils.odin_modes import EMISSION_CLASSES
+from utils.pc4_distance import DETOUR_FACTORS, straight_line_km
+from utils.pc4_lookup import load_pc4_centroids
+from utils.pc4_matrix import open_pc4_matrix
+
+# Resolve the data paths relative to the script directory
+script_dir = os.path.dirname(os.path.abspath(__file__))
+processed_data_dir = os.path.join(script_dir, '../data/processed/')
+output_dir = os.path.join(script_dir, '../data/outputs/csv/')
+georef_file_path = os.path.join(processed_data_dir, 'cleaned_georef-netherlands-postcode-pc4.csv')
+pc4_matrix_path = os.path.join(processed_data_dir, 'pc4_matrix')
+
+# Roster columns; fuel_type may be left out or blank (e.g. for cyclists)
+ROSTER_COLUMNS = ['employee_id', 'home_pc4', 'work_pc4', 'mode', 'commuting_days']
+
+# Roster mode -> emission class (other modes get no factor and are reported as unassigned)
+MODE_CLASSES = {
+    'CAR': 'CAR', 'BICYCLE': 'BICYCLE', 'BIKE': 'BICYCLE', 'E-BIKE': 'BICYCLE', 'EBIKE': 'BICYCLE',
+    'TRANSIT': 'TRANSIT', 'BUS': 'TRANSIT', 'TRAM': 'TRANSIT', 'RAIL': 'TRANSIT', 'TRAIN': 'TRANSIT',
+    'SUBWAY': 'TRANSIT', 'METRO': 'TRANSIT', 'FERRY': 'TRANSIT', 'WALK': 'WALK',
+}
+
+# A commuting day is a return trip
+TRIPS_PER_DAY = 2
+
+# Function to read an employee roster
+def read_roster(roster_path):
+    roster = pd.read_csv(roster_path, dtype={'home_pc4': str, 'work_pc4': str, 'fuel_type': str})
+    missing = [column for column in ROSTER_COLUMNS if column not in roster.columns]
+    if missing:
+        raise ValueError(f"The roster lacks the columns {missing}")
+    if 'fuel_type' not in roster.columns:
+        roster['fuel_type'] = ''
+    return roster
+
+# Function to read fuel-specific factors (columns mode, fuel_type, ttw_g_per_km, wtw_g_per_km)
+def read_fuel_factors(fuel_factors_path):
+    factors = pd.read_csv(fuel_factors_path, dtype={'fuel_type': str})
+    factors['mode'] = factors['mode'].str.strip().str.upper().map(MODE_CLASSES).fillna('OTHER')
+    factors['fuel_type'] = factors['fuel_type'].fillna('').str.strip().str.lower()
+    return factors
+
+# Function to build the factor tables indexed by [emission class, fuel type]
+def build_factor_tables(fuel_factors=None):
+    """
+    Build the TTW and WTW factor tables of the report.
+
+    Parameters:
+    fuel_factors (pd.DataFrame, optional): Fuel-specific factors from read_fuel_factors. Without an entry,
+        a mode uses the 4_CO2_Calculator factor of its class.
+
+    Returns:
+    dict: 'fuels' (fuel type per column, '' first), 'ttw' and 'wtw' (g/km arrays of shape classes x fuels)
+    and 'fuel_specific' (whether the factor came from fuel_factors).
+    """
+    calculator = importlib.import_module('4_CO2_Calculator')
+    ttw_defaults, wtw_defaults = calculator.emission_factors()
+    ttw_defaults = {**ttw_defaults, 'WALK': 0.0}
+    wtw_defaults = {**wtw_defaults, 'WALK': 0.0}
+    fuels = [''] + (sorted(set(fuel_factors['fuel_type']) - {''}) if fuel_factors is not None else [])
+    shape = (len(EMISSION_CLASSES), len(fuels))
+    ttw = np.tile(np.array([[ttw_defaults.get(c, np.nan)] for c in EMISSION_CLASSES]), (1, len(fuels)))
+    wtw = np.tile(np.array([[wtw_defaults.get(c, np.nan)] for c in EMISSION_CLASSES]), (1, len(fuels)))
+    fuel_specific = np.zeros(shape, dtype=bool)
+    if fuel_factors is not None:
+        for row in fuel_factors.itertuples(index=False):
+            position = (EMISSION_CLASSES.index(row.mode), fuels.index(row.fuel_type))
+            ttw[position], wtw[position] = row.ttw_g_per_km, row.wtw_g_per_km
+            fuel_specific[position] = True
+    return {'fuels': fuels, 'ttw': ttw, 'wtw': wtw, 'fuel_specific': fuel_specific}
+
+# Function to apply a function once per distinct value of a column
+def _per_value(column, function, missing):
+    codes, uniques = pd.factorize(column)
+    values = np.array([function(value) for value in uniques] + [missing])
+    return values[codes]
+
+# Function to read the PC4 number of a postcode ('1011', '1011AB' or 1011; NaN if it is none)
+def _pc4_number(postcode):
+    digits = str(postcode).strip()[:4]
+    return float(digits) if len(digits) == 4 and digits.isdigit() else np.nan
+
+# Function to calculate the annual commuting distance and emissions of every employee in one pass
+def employee_report(roster, centroids, tables, matrix=None):
+    """
+    Calculate the annual commuting distance and TTW / WTW emissions of every employee.
+
+    Parameters:
+    roster (pd.DataFrame): The roster (ROSTER_COLUMNS and fuel_type).
+    centroids (PC4Centroids): The PC4 centroid lookup.
+    tables (dict): The factor tables of build_factor_tables.
+    matrix (PC4Matrix, optional): Network distances per mode; other modes use the detour factors.
+
+    Returns:
+    pd.DataFrame: The roster with emission_class, one_way_km, annual_km, ttw_co2_kg, wtw_co2_kg and
+    factor_source (NaN distance and emissions for unknown postcodes or modes without a factor).
+    """
+    # Rosters repeat few distinct values, so every column is normalised once per distinct value;
+    # PC6 postcodes ('1011AB') are reduced to their PC4
+    home = _per_value(roster['home_pc4'], _pc4_number, np.nan)
+    work = _per_value(roster['work_pc4'], _pc4_number, np.nan)
+    other = EMISSION_CLASSES.index('OTHER')
+    class_codes = _per_value(roster['mode'], lambda mode: EMISSION_CLASSES.index(
+        MODE_CLASSES.get(str(mode).strip().upper(), 'OTHER')), other).astype(np.intp)
+    fuel_names = _per_value(roster['fuel_type'], lambda fuel: str(fuel).strip().lower(), '').astype(object)
+    fuel_positions = {fuel: position for position, fuel in enumerate(tables['fuels'])}
+    fuel_codes = _per_value(roster['fuel_type'], lambda fuel: fuel_positions.get(str(fuel).strip().lower(), 0), 0).astype(np.intp)
+
+    detour = np.array([DETOUR_FACTORS[c] for c in EMISSION_CLASSES])[class_codes]
+    one_way_km = straight_line_km(centroids, home, work) * detour
+    if matrix is not None:
+        one_way_km = matrix.network_km(np.array(EMISSION_CLASSES)[class_codes], home, work, one_way_km)
+    annual_km = one_way_km * TRIPS_PER_DAY * pd.to_numeric(roster['commuting_days'], errors='coerce').to_numpy(dtype=float)
+
+    report = roster.copy()
+    report['emission_class'] = pd.Categorical.from_codes(class_codes, EMISSION_CLASSES)
+    report['fuel_type'] = fuel_names
+    report['one_way_km'] = one_way_km
+    report['annual_km'] = annual_km
+    report['ttw_co2_kg'] = annual_km * tables['ttw'][class_codes, fuel_codes] / 1000
+    report['wtw_co2_kg'] = annual_km * tables['wtw'][class_codes, fuel_codes] / 1000
+    report['factor_source'] = np.where(tables['fuel_specific'][class_codes, fuel_codes], 'fuel', 'mode')
+    return report
+
+# Function to total the employee report per emission class and fuel type
+def summary_report(report):
+    """
+    Total the employee report as reported under WPM: per emission class and fuel type, plus a total.
+
+    Returns:
+    pd.DataFrame: Employees, commuting days, annual km, TTW and WTW tonnes and the share by which TTW
+    underestimates WTW; 'unlocated' counts the employees whose distance could not be estimated. Emissions
+    are NaN for groups whose mode has no factor.
+    """
+    frame = report.assign(emission_class=report['emission_class'].astype(str),
+                          unlocated=report['annual_km'].isna().astype(int))
+    columns = {'employees': ('employee_id', 'size'), 'unlocated': ('unlocated', 'sum'),
+               'commuting_days': ('commuting_days', 'sum'), 'annual_km': ('annual_km', 'sum'),
+               'ttw_co2_kg': ('ttw_co2_kg', 'sum'), 'wtw_co2_kg': ('wtw_co2_kg', 'sum'),
+               'with_factor': ('ttw_co2_kg', 'count'), 'located': ('annual_km', 'count')}
+    summary = frame.groupby(['emission_class', 'fuel_type'], as_index=False).agg(**columns)
+    total = frame.assign(emission_class='TOTAL', fuel_type='').groupby(['emission_class', 'fuel_type'],
+                                                                        as_index=False).agg(**columns)
+    summary = pd.concat([summary, total], ignore_index=True)
+    # Groups without a located employee have no distance, rather than zero (a sum with min_count=1)
+    summary['annual_km'] = summary['annual_km'].where(summary.pop('located') > 0)
+    # Groups of modes without a factor have no emissions, rather than zero
+    with_factor = summary.pop('with_factor') > 0
+    summary['ttw_co2_tonnes'] = (summary.pop('ttw_co2_kg') / 1000).where(with_factor)
+    summary['wtw_co2_tonnes'] = (summary.pop('wtw_co2_kg') / 1000).where(with_factor)
+    wtw = summary['wtw_co2_tonnes'].where(summary['wtw_co2_tonnes'] > 0)
+    summary['ttw_underestimation_pct'] = (1 - summary['ttw_co2_tonnes'] / wtw) * 100
+    return summary
+
+def main(roster_path, fuel_factors_path=None, report_dir=output_dir, georef_path=georef_file_path):
+    roster = read_roster(roster_path)
+    centroids = load_pc4_centroids(georef_path)
+    tables = build_factor_tables(read_fuel_factors(fuel_factors_path) if fuel_factors_path else None)
+    matrix = open_pc4_matrix(pc4_matrix_path)
+
+    started = time.perf_counter()
+    report = employee_report(roster, centroids, tables, matrix)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    instrumentation.add_rows(len(report))
+    summary = summary_report(report)
+
+    if not os.path.exists(report_dir):
+        os.makedirs(report_dir)
+    employee_report_file = os.path.join(report_dir, 'wpm_employee_report.csv')
+    summary_report_file = os.path.join(report_dir, 'wpm_summary_report.csv')
+    report.to_csv(employee_report_file, index=False)
+    summary.to_csv(summary_report_file, index=False)
+
+    print("\nAnnual commuting emissions (WPM):")
+    print(summary.to_string(index=False, float_format=lambda value: f"{value:,.2f}"))
+    print(f"\n{len(report):,} employees in {elapsed_ms:,.1f} ms ({len(report) / max(elapsed_ms, 1e-9):,.0f} employees per ms)")
+    logging.info(f"Employee report saved to '{employee_report_file}', summary to '{summary_report_file}'")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Annual TTW and WTW commuting emissions of an employee roster.")
+    parser.add_argument('roster', help="Roster CSV: employee_id, home_pc4, work_pc4, mode, commuting_days[, fuel_type].")
+    parser.add_argument('--fuel-factors', default=None,
+                        help="CSV of fuel-specific factors: mode, fuel_type, ttw_g_per_km, wtw_g_per_km.")
+    parser.add_argument('--output-dir', default=output_dir, help="Directory of the reports.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main(args.roster, args.fuel_factors, args.output_dir)
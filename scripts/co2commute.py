@@ -0,0 +1,224 @@
+import os
+import sys
+import argparse
+import importlib
+import logging
+
+# Only the standard library is imported here. Every subcommand imports what it needs when it runs,
+# so quick commands such as 'emissions' and 'factors' start without pandas, matplotlib or scipy
+
+# The script directory holds the stage scripts and the utils package
+script_dir = os.path.dirname(os.path.abspath(__file__))
+if script_dir not in sys.path:
+    sys.path.insert(0, script_dir)
+
+# Subcommand -> (stage script, pipeline stage name, description)
+STAGE_COMMANDS = {
+    'odin-dataset': ('ODiN_Dataset', 'odin_dataset', "Convert the yearly ODiN exports into the partitioned Parquet dataset"),
+    'odin': ('EDA_ODiN', 'eda_odin', "Filter the ODiN survey to work-related commutes"),
+    'zipcodes': ('1_Zipcode_Processing', 'zipcodes', "Clean the PC4 georeference data and rank postcodes"),
+    'addresses': ('2_Address_Processing', 'addresses', "Sample addresses within the top postcodes"),
+    'routing': ('3_OTP_routing', 'routing', "Route origin-destination pairs with OpenTripPlanner"),
+    'co2': ('4_CO2_Calculator', 'co2', "Calculate TTW and WTW emissions of the routed trips"),
+    'hypothesis-testing': ('5_Hypothesis_Testing', 'hypothesis_testing', "Run the hypothesis tests H1-H8"),
+    'surrogate': ('Surrogate_Model', 'surrogate', "Fit the surrogate emission model and report its held-out error"),
+    'population-emissions': ('6_Population_Emissions', 'population_emissions',
+                             "Estimate the weighted emissions of all ODiN commutes without routing"),
+    'pc4-matrix': ('PC4_Matrix', 'pc4_matrix', "Build the PC4 x PC4 network distance and duration matrices per mode"),
+    'visualisation': ('Visualisation', 'visualisation', "Render the commuting charts"),
+    'reimbursement-eda': ('EDA_Travel_Reimbursment', 'reimbursement_eda', "Render the travel reimbursement charts"),
+}
+
+# Function to import a stage script by name (the numbered scripts are not valid identifiers)
+def load_stage(module_name):
+    return importlib.import_module(module_name)
+
+# Function to run one stage script with the parameters given on the command line
+def run_stage(args):
+    from utils import instrumentation
+    module_name, stage_name, _ = STAGE_COMMANDS[args.command]
+    params = {}
+    if getattr(args, 'years', None) is not None:
+        from utils.odin_dataset import parse_years
+        params['years'] = parse_years(args.years)
+    if getattr(args, 'od_pairs', None) is not None:
+        params['num_od_pairs'] = args.od_pairs
+    if getattr(args, 'od_sampling', None) is not None:
+        params['od_sampling'] = args.od_sampling
+    if getattr(args, 'route_cache', None):
+        params['route_cache'] = True
+    if getattr(args, 'departures', None) is not None:
+        params['departures'] = args.departures
+    if getattr(args, 'routed_flows', None) is not None:
+        params['routed_flows'] = args.routed_flows
+    if getattr(args, 'calibration_pairs', None) is not None:
+        params['calibration_pairs'] = args.calibration_pairs
+    if getattr(args, 'resamples', None) is not None:
+        params['n_resamples'] = args.resamples
+    if getattr(args, 'seed', None) is not None:
+        params['seed'] = args.seed
+    if args.metrics_dir:
+        instrumentation.configure(args.metrics_dir, args.profile)
+    module = load_stage(module_name)
+    with instrumentation.stage(stage_name):
+        module.main(**params)
+
+# Function to calculate the emissions of a single trip
+def trip_emissions(args):
+    calculator = load_stage('4_CO2_Calculator')
+    calculator.load_fleet_car_factors()
+    legs = args.leg or []
+    if args.mode is not None and args.distance_km is None:
+        print("Give the distance of the trip in kilometres.", file=sys.stderr)
+        return 2
+    if args.mode is not None:
+        legs.insert(0, (args.mode, args.distance_km))
+    if not legs:
+        print("Give a mode and distance, or one or more --leg MODE KM.", file=sys.stderr)
+        return 2
+
+    total_method_1 = 0.0
+    total_method_2 = 0.0
+    total_km = 0.0
+    print(f"{'Mode':<10} {'Distance (km)':>14} {'TTW (g CO2)':>13} {'WTW (g CO2)':>13}")
+    for mode, distance_km in legs:
+        distance_km = float(distance_km)
+        method_1 = calculator.calculate_co2_emissions_method_1(mode, distance_km)
+        method_2 = calculator.calculate_co2_emissions_method_2(mode, distance_km)
+        print(f"{mode.upper():<10} {distance_km:>14.2f} {method_1:>13.1f} {method_2:>13.1f}")
+        total_method_1 += method_1
+        total_method_2 += method_2
+        total_km += distance_km
+    print(f"{'Total':<10} {total_km:>14.2f} {total_method_1:>13.1f} {total_method_2:>13.1f}")
+    print(f"Commute distance group: {calculator.classify_commute_distance(total_km)}")
+    if total_method_2 > 0:
+        print(f"TTW underestimates WTW by {(1 - total_method_1 / total_method_2) * 100:.1f}%")
+
+# Function to print the emission factor tables
+def print_factors(args):
+    calculator = load_stage('4_CO2_Calculator')
+    calculator.load_fleet_car_factors()
+    print(f"{'Mode':<10} {'WPM TTW (g/km)':>15} {'WTW (g/km)':>11}")
+    for mode in sorted(set(calculator.WPM_TTW_CO2_FACTORS) | set(calculator.WTW_CO2_FACTORS)):
+        print(f"{mode:<10} {calculator.WPM_TTW_CO2_FACTORS.get(mode, 0.0):>15.2f} "
+              f"{calculator.WTW_CO2_FACTORS.get(mode, 0.0):>11.2f}")
+
+# Function to total the emissions of the routed commutes passing through, starting in or ending in an area
+def area_emissions(args):
+    import json
+    from utils.spatial_query import SpatialQuery
+    calculator = load_stage('4_CO2_Calculator')
+    georef_path = os.path.join(script_dir, '../data/processed/cleaned_georef-netherlands-postcode-pc4.csv')
+    query = SpatialQuery.from_outputs(args.outputs or calculator.data_dir, georef_path if args.pc4 else None)
+
+    geometry = None
+    if args.geojson:
+        import shapely
+        from shapely.geometry import shape
+        with open(args.geojson) as geojson_file:
+            geojson = json.load(geojson_file)
+        features = geojson.get('features', [geojson])
+        geometry = shapely.union_all([shape(feature.get('geometry', feature)) for feature in features])
+    area = query.area(geometry=geometry, bbox=args.bbox, pc4=args.pc4)
+
+    queries = {'through': query.passing_through, 'start': query.starting_in, 'end': query.ending_in}
+    result = queries[args.relation](area)
+    print(result.to_string(index=False, float_format=lambda value: f"{value:,.1f}"))
+    if args.output:
+        result.to_csv(args.output, index=False)
+
+# Function to report the annual commuting emissions of an employee roster
+def wpm_report(args):
+    reporting = load_stage('WPM_Reporting')
+    reporting.main(args.roster, args.fuel_factors, args.output_dir or reporting.output_dir)
+
+# Function to build the fleet-mix car factors from RDW registry exports
+def fleet_factors(args):
+    load_stage('Average_Car_Emission_Factors_NL').main(args.registry, args.fuel, args.fuel_factors)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='co2commute', description="CO2 emissions of commuting in the Netherlands.")
+    parser.add_argument('--log-level', default='INFO', help="Logging level (default: INFO).")
+    parser.add_argument('--log-file', default=None, help="Write the log to this file instead of the console.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    emissions_parser = subparsers.add_parser('emissions', help="TTW and WTW emissions of a single trip.")
+    emissions_parser.add_argument('mode', nargs='?', help="Transport mode, e.g. CAR, BICYCLE, TRANSIT, BUS, RAIL.")
+    emissions_parser.add_argument('distance_km', nargs='?', type=float, help="Distance in kilometres.")
+    emissions_parser.add_argument('--leg', nargs=2, action='append', metavar=('MODE', 'KM'),
+                                  help="Add a leg of a multimodal trip (repeatable).")
+    emissions_parser.set_defaults(handler=trip_emissions)
+
+    factors_parser = subparsers.add_parser('factors', help="Print the emission factor tables.")
+    factors_parser.set_defaults(handler=print_factors)
+
+    area_parser = subparsers.add_parser('area', help="Emissions of the routed commutes passing through, starting in or ending in an area.")
+    area_choice = area_parser.add_mutually_exclusive_group(required=True)
+    area_choice.add_argument('--bbox', nargs=4, type=float, metavar=('MIN_LON', 'MIN_LAT', 'MAX_LON', 'MAX_LAT'),
+                             help="A bounding box in degrees.")
+    area_choice.add_argument('--pc4', nargs='+', type=int, help="PC4 postcodes making up the area.")
+    area_choice.add_argument('--geojson', help="A GeoJSON file with the area (geometry, feature or feature collection).")
+    area_parser.add_argument('--relation', choices=['through', 'start', 'end'], default='through',
+                             help="Legs clipped to the area (default), or whole trips starting or ending in it.")
+    area_parser.add_argument('--outputs', default=None, help="Directory of the CO2 outputs (default: data/outputs/csv).")
+    area_parser.add_argument('--output', default=None, help="Also write the table to this CSV file.")
+    area_parser.set_defaults(handler=area_emissions)
+
+    fleet_parser = subparsers.add_parser('fleet-factors', help="Fleet-mix car factors from RDW registry exports.")
+    fleet_parser.add_argument('--registry', default=None,
+                              help="RDW 'Gekentekende voertuigen' export; without it the 2023 average is printed.")
+    fleet_parser.add_argument('--fuel', default=None, help="RDW 'Gekentekende voertuigen brandstof' export.")
+    fleet_parser.add_argument('--fuel-factors', default=None,
+                              help="CSV of fuel-specific factors: fuel_type, ttw_g_per_km, wtw_g_per_km.")
+    fleet_parser.set_defaults(handler=fleet_factors)
+
+    wpm_parser = subparsers.add_parser('wpm', help="Annual TTW and WTW commuting emissions of an employee roster.")
+    wpm_parser.add_argument('roster', help="Roster CSV: employee_id, home_pc4, work_pc4, mode, commuting_days[, fuel_type].")
+    wpm_parser.add_argument('--fuel-factors', default=None,
+                            help="CSV of fuel-specific factors: mode, fuel_type, ttw_g_per_km, wtw_g_per_km.")
+    wpm_parser.add_argument('--output-dir', default=None, help="Directory of the reports (default: data/outputs/csv).")
+    wpm_parser.set_defaults(handler=wpm_report)
+
+    # The orchestrator module only needs the standard library, so its options are shared directly
+    import run_pipeline
+    pipeline_parser = subparsers.add_parser('run', help="Run the stages whose inputs, parameters or code changed.")
+    run_pipeline.add_arguments(pipeline_parser)
+    pipeline_parser.set_defaults(handler=run_pipeline.run)
+
+    for command, (module_name, _, description) in STAGE_COMMANDS.items():
+        stage_parser = subparsers.add_parser(command, help=f"{description} ({module_name}.py).")
+        if command in ('odin', 'odin-dataset'):
+            stage_parser.add_argument('--years', default=None,
+                                      help="Survey years, e.g. 2018-2023 or 2019,2022 (odin: read from the partitioned dataset).")
+        if command == 'routing':
+            stage_parser.add_argument('--od-pairs', type=int, default=None, help="Number of origin-destination pairs to route.")
+            stage_parser.add_argument('--od-sampling', choices=['addresses', 'flows'], default=None,
+                                      help="Route top-postcode address pairs, or PC4 pairs drawn in proportion to the ODiN flows.")
+            stage_parser.add_argument('--route-cache', action='store_true',
+                                      help="Reuse itineraries of nearby OD pairs instead of routing every pair.")
+            stage_parser.add_argument('--departures', choices=['random', 'grid'], default=None,
+                                      help="Route each pair at one random time, or at every slot of a fixed departure grid.")
+        if command == 'pc4-matrix':
+            stage_parser.add_argument('--routed-flows', type=int, default=None, help="Busiest ODiN flows routed per mode.")
+            stage_parser.add_argument('--calibration-pairs', type=int, default=None,
+                                      help="Uniformly drawn pairs routed per mode for the calibration.")
+        if command == 'hypothesis-testing':
+            stage_parser.add_argument('--resamples', type=int, default=None, help="Resamples for the bootstrap and permutation tests.")
+            stage_parser.add_argument('--seed', type=int, default=None, help="Seed of the resampling tests.")
+        stage_parser.add_argument('--metrics-dir', default=None,
+                                  help="Write timing, memory and latency reports (JSON and Prometheus) to this directory.")
+        stage_parser.add_argument('--profile', action='store_const', const=['all'], default=None,
+                                  help="Also sample the stack of the stage; needs --metrics-dir.")
+        stage_parser.set_defaults(handler=run_stage)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    # Logging is configured once, here, instead of by every script at import time
+    logging.basicConfig(level=args.log_level.upper(), filename=args.log_file,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import os
+import sys
+import argparse
+import logging
+from utils import instrumentation
+from utils.pipeline import Pipeline
+
+# Resolve the data paths relative to the script directory
+script_dir = os.path.dirname(os.path.abspath(__file__))
+data_dir = os.path.join(script_dir, '../data/')
+raw_data_dir = os.path.join(data_dir, 'raw/')
+processed_data_dir = os.path.join(data_dir, 'processed/')
+csv_output_dir = os.path.join(data_dir, 'outputs/csv/')
+graphs_output_dir = os.path.join(data_dir, 'outputs/graphs/')
+
+# Files exchanged between the stages
+odin_path = os.path.join(raw_data_dir, 'ODiN2022_Databestand.csv')
+raw_georef_path = os.path.join(raw_data_dir, 'georef-netherlands-postcode-pc4.csv')
+refined_commutes_path = os.path.join(processed_data_dir, 'refined_work_related_commutes.csv')
+mode_of_transport_path = os.path.join(processed_data_dir, 'mode_of_transport_commuting_percentages.csv')
+expense_reimbursement_path = os.path.join(processed_data_dir, 'expense_reimbursement_data.csv')
+georef_path = os.path.join(processed_data_dir, 'cleaned_georef-netherlands-postcode-pc4.csv')
+top_origin_zipcodes_path = os.path.join(processed_data_dir, 'top_origin_zipcodes.csv')
+top_destination_zipcodes_path = os.path.join(processed_data_dir, 'top_destination_zipcodes.csv')
+top_origin_addresses_path = os.path.join(csv_output_dir, 'top_origin_addresses.csv')
+top_destination_addresses_path = os.path.join(csv_output_dir, 'top_destination_addresses.csv')
+route_summary_path = os.path.join(csv_output_dir, 'route_summary_with_commute_times.csv')
+co2_summary_path = os.path.join(csv_output_dir, 'co2_emissions_summary.csv')
+surrogate_model_path = os.path.join(csv_output_dir, 'surrogate_emission_model.json')
+population_emissions_path = os.path.join(csv_output_dir, 'population_emissions_summary.csv')
+pc4_matrix_path = os.path.join(processed_data_dir, 'pc4_matrix')
+# Fleet-mix car factors (Average_Car_Emission_Factors_NL.py --registry, run by hand since it needs the RDW
+# registry); the CO2 stages use them instead of the default CAR factors when they exist
+car_factors_path = os.path.join(processed_data_dir, 'car_emission_factors.csv')
+
+# Function to declare the stages; the graph between them follows from their files
+def build_pipeline(routing_params=None, testing_params=None, pc4_matrix=False):
+    pipeline = Pipeline(state_path=os.path.join(data_dir, 'outputs/.pipeline_state.json'))
+
+    # EDA_ODiN also writes a top-10 postcode list; 1_Zipcode_Processing replaces it with the top-20
+    # list used downstream, so the top postcode files are declared as outputs of that stage only
+    pipeline.add('eda_odin', 'EDA_ODiN', inputs=[odin_path],
+                 outputs=[refined_commutes_path, mode_of_transport_path, expense_reimbursement_path])
+    pipeline.add('zipcodes', '1_Zipcode_Processing', inputs=[raw_georef_path, refined_commutes_path],
+                 outputs=[georef_path, top_origin_zipcodes_path, top_destination_zipcodes_path])
+    pipeline.add('addresses', '2_Address_Processing',
+                 inputs=[georef_path, top_origin_zipcodes_path, top_destination_zipcodes_path],
+                 outputs=[top_origin_addresses_path, top_destination_addresses_path])
+    # Flow-weighted OD sampling draws from the commutes and the PC4 centroids instead of the addresses
+    if (routing_params or {}).get('od_sampling') == 'flows':
+        routing_inputs = [refined_commutes_path, georef_path]
+    else:
+        routing_inputs = [top_origin_addresses_path, top_destination_addresses_path]
+    pipeline.add('routing', '3_OTP_routing', inputs=routing_inputs, outputs=[route_summary_path], params=routing_params)
+    pipeline.add('co2', '4_CO2_Calculator', inputs=[route_summary_path],
+                 outputs=[co2_summary_path, os.path.join(csv_output_dir, 'co2_emissions_summary.geojson'),
+                          os.path.join(csv_output_dir, 'co2_emissions_legs.csv'),
+                          os.path.join(csv_output_dir, 'leg_geometries.coords'),
+                          os.path.join(csv_output_dir, 'leg_geometries.index.npy')],
+                 optional_inputs=[car_factors_path])
+    pipeline.add('hypothesis_testing', '5_Hypothesis_Testing', inputs=[co2_summary_path], outputs=[],
+                 params=testing_params)
+    pipeline.add('surrogate', 'Surrogate_Model', inputs=[co2_summary_path],
+                 outputs=[surrogate_model_path, os.path.join(csv_output_dir, 'surrogate_heldout_errors.csv')])
+    # Network distances between all PC4 centroids per mode, from routed flows and calibrated estimates.
+    # Opt-in: it needs a live OTP server and writes several hundred MB of matrices
+    if pc4_matrix:
+        pipeline.add('pc4_matrix', 'PC4_Matrix', inputs=[refined_commutes_path, georef_path],
+                     outputs=[pc4_matrix_path + '.json', pc4_matrix_path + '.index.npy']
+                     + [f"{pc4_matrix_path}.{mode}.{quantity}.npy" for mode in ['CAR', 'BICYCLE', 'TRANSIT']
+                        for quantity in ['distance_km', 'duration_min', 'source']])
+    # Estimates every surveyed commute from its PC4 centroids, without routing (using the PC4 matrices
+    # and the fleet car factors when they exist, so they are optional inputs)
+    pipeline.add('population_emissions', '6_Population_Emissions', inputs=[refined_commutes_path, georef_path],
+                 outputs=[population_emissions_path, os.path.join(csv_output_dir, 'population_emissions_trips.csv')],
+                 optional_inputs=[pc4_matrix_path + '.json', car_factors_path])
+
+    # Independent branches, run concurrently with the routing chain
+    pipeline.add('visualisation', 'Visualisation', inputs=[mode_of_transport_path, refined_commutes_path, georef_path],
+                 outputs=[os.path.join(graphs_output_dir, name) for name in [
+                     'share_of_transport_modes_for_commuting.png', 'avg_travel_duration_with_legend.png',
+                     'departure_times.png', 'arrival_times.png', 'avg_distance.png',
+                     'avg_travel_distance_speed_bubble.png']])
+    pipeline.add('reimbursement_eda', 'EDA_Travel_Reimbursment', inputs=[expense_reimbursement_path],
+                 outputs=[os.path.join(csv_output_dir, 'reimbursement_shares.csv')] +
+                         [os.path.join(graphs_output_dir, name) for name in [
+                             'reimbursement_percentage_donut.png', 'reimbursement_treemap.png', 'correlation_heatmap.png']])
+    return pipeline
+
+# Function to add the orchestrator options to an argument parser (shared with co2commute.py)
+def add_arguments(parser):
+    parser.add_argument('stages', nargs='*', help="Target stages (default: all); their dependencies are included.")
+    parser.add_argument('--force', action='store_true', help="Run the target stages even when they are up to date.")
+    parser.add_argument('--only', action='store_true', help="Run the target stages without their dependencies.")
+    parser.add_argument('--workers', type=int, default=None, help="Concurrent stage processes (default: all CPUs).")
+    parser.add_argument('--status', action='store_true', help="Only report which stages are up to date.")
+    parser.add_argument('--od-pairs', type=int, default=None, help="Number of origin-destination pairs to route.")
+    parser.add_argument('--od-sampling', choices=['addresses', 'flows'], default=None,
+                        help="Route top-postcode address pairs, or PC4 pairs drawn in proportion to the ODiN flows.")
+    parser.add_argument('--route-cache', action='store_true', default=None,
+                        help="Reuse itineraries of nearby OD pairs instead of routing every pair.")
+    parser.add_argument('--departures', choices=['random', 'grid'], default=None,
+                        help="Route each pair at one random time, or at every slot of a fixed departure grid.")
+    parser.add_argument('--pc4-matrix', action='store_true',
+                        help="Also build the PC4 x PC4 distance matrices (needs an OTP server).")
+    parser.add_argument('--resamples', type=int, default=None, help="Resamples for the bootstrap and permutation tests.")
+    parser.add_argument('--seed', type=int, default=None, help="Seed of the resampling tests.")
+    parser.add_argument('--metrics-dir', default=None,
+                        help="Write per-stage timing, memory and latency reports (JSON and Prometheus) to this directory.")
+    parser.add_argument('--profile', nargs='+', default=None, metavar='STAGE',
+                        help="Sample the stacks of these stages ('all' for every stage); needs --metrics-dir.")
+
+# Function to run (or report) the stages selected on the command line
+def run(args):
+    # Only parameters given on the command line are passed (and fingerprinted); the rest use the script defaults
+    routing_params = {key: value for key, value in [('num_od_pairs', args.od_pairs), ('od_sampling', args.od_sampling),
+                                                    ('route_cache', args.route_cache), ('departures', args.departures)]
+                      if value is not None}
+    testing_params = {key: value for key, value in [('n_resamples', args.resamples), ('seed', args.seed)]
+                      if value is not None}
+    pipeline = build_pipeline(routing_params, testing_params, args.pc4_matrix)
+    if args.metrics_dir:
+        instrumentation.configure(args.metrics_dir, args.profile)
+
+    if args.status:
+        status = pipeline.status(args.stages or None)
+    else:
+        status = pipeline.run(args.stages or None, force=args.force, workers=args.workers,
+                              with_dependencies=not args.only)
+    for name, stage_status in status.items():
+        print(f"{name:<20} {stage_status}")
+    if any(stage_status in ('failed', 'blocked') for stage_status in status.values()):
+        return 1
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the analysis stages whose inputs, parameters or code changed.")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    return run(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
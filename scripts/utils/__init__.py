@@ -0,0 +1 @@
+"""Helper modules shared by the analysis scripts in ``scripts/``."""
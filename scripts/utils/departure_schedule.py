@@ -0,0 +1,73 @@
+"""Deterministic departure-time grid for routing OD pairs.
+
+Every pair is routed on the same fixed slots of one service day (by default
+every 30 minutes of the morning and evening commuting windows), so runs are
+reproducible and every pair is seen at every time of day. OTP's car and
+bicycle itineraries do not depend on the departure time, so those modes are
+queried once per pair and kept as a single route; only the time-sensitive
+modes (transit) are routed slot by slot. A grid of k slots therefore costs
+about k transit queries plus one per other mode, instead of k queries per
+mode. Each of the k transit routes of a pair carries 1/k of the pair's
+weight, so weighted totals count every pair once per mode.
+"""
+from datetime import datetime, timedelta
+
+from utils.route_cache import TIME_SENSITIVE_MODES
+
+# Commuting windows (first and last departure, inclusive) and the spacing of the slots
+DEFAULT_WINDOWS = {'morning': ('06:30', '09:00'), 'evening': ('16:00', '18:30')}
+DEFAULT_STEP_MINUTES = 30
+
+
+class DepartureSchedule:
+    """
+    Fixed departure slots of a service day and the routing of pairs over them.
+
+    Parameters:
+    service_date (str): The service day, 'YYYY-MM-DD' (a weekday covered by the OTP graph's timetables).
+    windows (dict, optional): Time of day -> (first, last) departure as 'HH:MM'.
+    step_minutes (int): Minutes between consecutive slots of a window.
+    time_sensitive_modes (tuple): Modes routed at every slot; the others are routed once and reused.
+    """
+
+    def __init__(self, service_date, windows=None, step_minutes=DEFAULT_STEP_MINUTES,
+                 time_sensitive_modes=TIME_SENSITIVE_MODES):
+        if step_minutes <= 0:
+            raise ValueError("The slot step must be a positive number of minutes.")
+        day = datetime.strptime(service_date, '%Y-%m-%d')
+        self.slots = []
+        for time_of_day, (first, last) in (windows or DEFAULT_WINDOWS).items():
+            start = datetime.combine(day.date(), datetime.strptime(first, '%H:%M').time())
+            end = datetime.combine(day.date(), datetime.strptime(last, '%H:%M').time())
+            departure_time = start
+            while departure_time <= end:
+                self.slots.append((time_of_day, departure_time))
+                departure_time += timedelta(minutes=step_minutes)
+        if not self.slots:
+            raise ValueError("The departure windows contain no slots.")
+        self.time_sensitive_modes = tuple(mode.upper() for mode in time_sensitive_modes)
+        self.counts = {'queries': 0, 'routes': 0}
+
+    def route_pair(self, fetch, modes):
+        """
+        Route one OD pair at every slot.
+
+        Parameters:
+        fetch (callable): fetch(mode, departure_time) returns the OTP response (or None).
+        modes (list): The modes to route.
+
+        Returns:
+        list: (time_of_day, departure_time, mode, route, weight_share) for every slot of the time-sensitive
+        modes (each with 1/k of the pair's weight) and once, at the first slot, for the other modes.
+        """
+        trips = []
+        for mode in modes:
+            if mode.upper() in self.time_sensitive_modes:
+                slots = self.slots
+            else:
+                slots = self.slots[:1]
+            trips.extend((time_of_day, departure_time, mode, fetch(mode, departure_time), 1 / len(slots))
+                         for time_of_day, departure_time in slots)
+            self.counts['queries'] += len(slots)
+            self.counts['routes'] += len(slots)
+        return trips
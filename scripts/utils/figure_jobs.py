@@ -0,0 +1,204 @@
+"""Parallel, cached rendering of the thesis figures.
+
+Each chart is registered as a function of declared input files and output
+files. A chart is re-rendered only when the content hash of its inputs or the
+version of its code (its source plus the module-level helpers and constants it
+references, directly or through those helpers) differs from the last
+successful render, or when an output is missing. Stale charts are rendered in worker processes on the Agg backend.
+"""
+import hashlib
+import inspect
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+class FigureJob:
+    """
+    A chart-rendering function with its declared inputs and outputs.
+
+    Parameters:
+    name (str): The unique name of the chart.
+    function (callable): Renders the chart and writes ``outputs``; takes no arguments.
+    inputs (list): The data files the chart is computed from.
+    outputs (list): The image files the chart writes.
+    version (str): Manual version tag, to force a re-render after changes outside the function.
+    """
+
+    def __init__(self, name, function, inputs, outputs, version=''):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.version = version
+
+    def code_version(self):
+        """Hash of the job's source and of the module-level helpers and constants it references, transitively."""
+        digest = hashlib.sha256(self.version.encode())
+        module_globals = self.function.__globals__
+        seen = set()
+        functions = [self.function]
+        while functions:
+            function = functions.pop()
+            digest.update(inspect.getsource(function).encode())
+            for name in sorted(_referenced_names(function.__code__) - seen):
+                seen.add(name)
+                value = module_globals.get(name)
+                if inspect.isfunction(value) and value.__module__ == self.function.__module__:
+                    functions.append(value)
+                elif isinstance(value, (str, int, float, tuple, list, dict)):
+                    digest.update(repr(value).encode())
+        return digest.hexdigest()
+
+
+def _referenced_names(code):
+    """The global names used by a code object and the functions and comprehensions nested in it."""
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if inspect.iscode(constant):
+            names |= _referenced_names(constant)
+    return names
+
+
+def file_hash(file_path, block_size=1 << 20):
+    """Return the SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _use_agg_backend():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _render(function):
+    """Worker entry point: render one chart and release its figures."""
+    import matplotlib.pyplot as plt
+    started = time.perf_counter()
+    try:
+        function()
+    finally:
+        plt.close('all')
+    return time.perf_counter() - started
+
+
+class FigureRunner:
+    """
+    Registry of figure jobs with a manifest of what was rendered from which inputs.
+
+    Parameters:
+    manifest_path (str): The JSON file recording the fingerprint of every rendered chart.
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self.jobs = {}
+
+    def register(self, name, inputs, outputs, version=''):
+        """
+        Decorator registering a chart-rendering function.
+
+        Parameters:
+        name (str): The unique name of the chart.
+        inputs (list): The data files the chart reads.
+        outputs (list): The image files the chart writes.
+        version (str): Manual version tag.
+        """
+        def decorator(function):
+            self.jobs[name] = FigureJob(name, function, inputs, outputs, version)
+            return function
+        return decorator
+
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as manifest_file:
+                return json.load(manifest_file)
+        return {}
+
+    def _save_manifest(self, manifest):
+        temporary_path = f"{self.manifest_path}.tmp"
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+        os.replace(temporary_path, self.manifest_path)
+
+    def fingerprints(self, names):
+        """Return the fingerprint (input hashes + code version) of every named job."""
+        input_hashes = {}
+        fingerprints = {}
+        for name in names:
+            job = self.jobs[name]
+            for input_path in job.inputs:
+                if input_path not in input_hashes:
+                    input_hashes[input_path] = file_hash(input_path)
+            digest = hashlib.sha256(job.code_version().encode())
+            for input_path in job.inputs:
+                digest.update(input_hashes[input_path].encode())
+            fingerprints[name] = digest.hexdigest()
+        return fingerprints
+
+    def run(self, names=None, force=False, workers=None):
+        """
+        Render every chart whose inputs, code or outputs changed since the last run.
+
+        Parameters:
+        names (list, optional): The charts to consider (default: all registered).
+        force (bool): Re-render even when the fingerprint is unchanged.
+        workers (int, optional): The number of worker processes (default: all CPUs).
+
+        Returns:
+        dict: Chart name -> 'rendered', 'skipped' or 'failed'.
+        """
+        names = list(names or self.jobs)
+        manifest = self._load_manifest()
+        fingerprints = self.fingerprints(names)
+        status = {}
+        stale = []
+        for name in names:
+            job = self.jobs[name]
+            up_to_date = (manifest.get(name, {}).get('fingerprint') == fingerprints[name]
+                          and all(os.path.exists(output) for output in job.outputs))
+            if up_to_date and not force:
+                status[name] = 'skipped'
+                logging.info("Chart %s is up to date, skipping.", name)
+            else:
+                stale.append(name)
+
+        for output_dir in {os.path.dirname(output) for name in stale for output in self.jobs[name].outputs}:
+            os.makedirs(output_dir or '.', exist_ok=True)
+
+        workers = min(workers or os.cpu_count() or 1, max(len(stale), 1))
+        if workers == 1:
+            _use_agg_backend()
+            outcomes = []
+            for name in stale:
+                try:
+                    outcomes.append((name, _render(self.jobs[name].function), None))
+                except Exception as e:
+                    outcomes.append((name, None, e))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_use_agg_backend) as executor:
+                futures = {name: executor.submit(_render, self.jobs[name].function) for name in stale}
+                outcomes = []
+                for name, future in futures.items():
+                    try:
+                        outcomes.append((name, future.result(), None))
+                    except Exception as e:
+                        outcomes.append((name, None, e))
+
+        for name, seconds, error in outcomes:
+            if error is not None:
+                status[name] = 'failed'
+                manifest.pop(name, None)
+                logging.error("Chart %s failed: %s", name, error)
+            else:
+                status[name] = 'rendered'
+                manifest[name] = {'fingerprint': fingerprints[name], 'outputs': self.jobs[name].outputs,
+                                  'rendered_at': time.strftime('%Y-%m-%d %H:%M:%S'), 'seconds': round(seconds, 3)}
+                print(f"Chart {name} rendered in {seconds:.2f}s")
+        self._save_manifest(manifest)
+        return status
@@ -0,0 +1,253 @@
+"""Fleet-mix car emission factors from RDW vehicle registry exports.
+
+The RDW open data publishes the registered vehicles ("Gekentekende
+voertuigen": licence plate, vehicle kind, first admission date, body type)
+and their fuels ("Gekentekende voertuigen brandstof": one row per licence
+plate and fuel, with the hybrid class) as separate exports of millions of
+rows. Both are streamed in chunks. To join them in bounded memory, the rows
+are first spread over partition files by a hash of the licence plate, so
+every partition holds all rows of its vehicles and is joined on its own. A
+registry export that already has the fuel columns is counted directly.
+
+Passenger cars are counted per fuel type (the categories of the RDW fleet
+statistics used in Average_Car_Emission_Factors_NL.py), registration year
+and vehicle class (the body type), and the counts weight the per-fuel
+factors into TTW and WTW car factors per registration year and class.
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# WPM TTW factor per fuel type (gCO2 per km)
+FUEL_TTW_FACTORS = {
+    'Petrol and petrol hybrid': 147,
+    'Diesel and diesel hybrid': 127,
+    'PHEV petrol': 116,  # Plug-in Hybrid
+    'FEV': 0,  # Full Electric is 0 gCO2/km according to WPM
+    'LPG and LPG hybrid': 129,
+    'CNG and CNG hybrid': 110,
+    'Hydrogen and hydrogen hybrid': 0,  # Treated as zero emissions
+    'PHEV diesel': 96,
+    'LNG and LNG hybrid': 96,
+    'Alcohol and alcohol hybrid': 36  # Assuming E85-like values for alcohol
+}
+
+# Without fuel-specific WTW factors, WTW is TTW scaled by the calculator's default CAR factors (193 / 138.67)
+WTW_TTW_CAR_RATIO = 193 / 138.67
+
+# Columns used from the exports, after normalisation ('Datum eerste toelating' -> 'datum_eerste_toelating')
+REGISTRY_COLUMNS = ['kenteken', 'voertuigsoort', 'datum_eerste_toelating', 'inrichting']
+FUEL_COLUMNS = ['kenteken', 'brandstof_omschrijving', 'klasse_hybride_elektrisch_voertuig']
+
+# Vehicle kind of passenger cars
+PASSENGER_CAR = 'Personenauto'
+
+# RDW fuel -> fuel type, in order of precedence for vehicles with several fuels (a bi-fuel LPG car
+# is also registered on petrol, a hybrid also on electricity)
+FUEL_PRECEDENCE = [
+    ('Waterstof', 'Hydrogen and hydrogen hybrid'),
+    ('LNG', 'LNG and LNG hybrid'),
+    ('CNG', 'CNG and CNG hybrid'),
+    ('LPG', 'LPG and LPG hybrid'),
+    ('Alcohol', 'Alcohol and alcohol hybrid'),
+    ('Diesel', 'Diesel and diesel hybrid'),
+    ('Benzine', 'Petrol and petrol hybrid'),
+    ('Elektriciteit', 'FEV'),
+]
+PLUG_IN_TYPES = {'Diesel and diesel hybrid': 'PHEV diesel', 'Petrol and petrol hybrid': 'PHEV petrol'}
+
+# Hybrid class of plug-in (off-vehicle charging) hybrids
+PLUG_IN_CLASS = 'OVC-HEV'
+
+# Rows read at a time, and partition files of the join
+CHUNK_SIZE = 500000
+PARTITIONS = 64
+
+# Columns of the factor table
+FACTOR_COLUMNS = ['registration_year', 'vehicle_class', 'vehicles', 'ttw_g_per_km', 'wtw_g_per_km']
+
+
+def _normalise(column):
+    return column.strip().lower().replace(' ', '_')
+
+
+def read_chunks(path, columns, chunk_size=CHUNK_SIZE):
+    """
+    Stream the given columns of an RDW export, whatever the case and spacing of its header.
+
+    Yields:
+    pd.DataFrame: Chunks of text columns named as in ``columns``.
+    """
+    for chunk in pd.read_csv(path, usecols=lambda column: _normalise(column) in columns, dtype=str,
+                             chunksize=chunk_size):
+        yield chunk.rename(columns=_normalise)
+
+
+def _per_value(column, function):
+    # Exports repeat few distinct dates and fuels, so each is parsed once
+    codes, uniques = pd.factorize(column)
+    values = np.array([function(value) for value in uniques] + [function(None)], dtype=object)
+    return values[codes]
+
+
+def _registration_year(date):
+    # 'Datum eerste toelating' is 20190514 in the CSV export and 14/05/2019 in some downloads
+    digits = str(date or '').strip()
+    year = digits[-4:] if '/' in digits else digits[:4]
+    return int(year) if year.isdigit() else -1
+
+
+def fuel_types(fuel_rows):
+    """
+    Classify vehicles by their fuel rows.
+
+    Parameters:
+    fuel_rows (pd.DataFrame): 'kenteken', 'brandstof_omschrijving' and optionally
+        'klasse_hybride_elektrisch_voertuig', one row per vehicle and fuel.
+
+    Returns:
+    pd.Series: The fuel type per licence plate ('Other' for unknown fuels).
+    """
+    ranks = {fuel: rank for rank, (fuel, _) in enumerate(FUEL_PRECEDENCE)}
+    names = np.array([name for _, name in FUEL_PRECEDENCE] + ['Other'], dtype=object)
+    rows = pd.DataFrame({
+        'kenteken': fuel_rows['kenteken'],
+        'rank': _per_value(fuel_rows['brandstof_omschrijving'],
+                           lambda fuel: ranks.get(str(fuel).strip(), len(FUEL_PRECEDENCE))).astype(np.int64),
+        'plug_in': (_per_value(fuel_rows['klasse_hybride_elektrisch_voertuig'],
+                               lambda hybrid_class: str(hybrid_class).strip() == PLUG_IN_CLASS).astype(bool)
+                    if 'klasse_hybride_elektrisch_voertuig' in fuel_rows.columns else False),
+    })
+    vehicles = rows.groupby('kenteken', sort=False).agg(rank=('rank', 'min'), plug_in=('plug_in', 'any'))
+    fuel_type = pd.Series(names[vehicles['rank'].to_numpy()], index=vehicles.index)
+    plug_in = vehicles['plug_in'] & fuel_type.isin(list(PLUG_IN_TYPES))
+    return fuel_type.mask(plug_in, fuel_type.map(PLUG_IN_TYPES))
+
+
+def count_vehicles(registry_rows, fuel_type):
+    """
+    Count the passenger cars of registry rows per fuel type, registration year and vehicle class.
+
+    Parameters:
+    registry_rows (pd.DataFrame): The REGISTRY_COLUMNS.
+    fuel_type (pd.Series): The fuel type per licence plate (see ``fuel_types``).
+
+    Returns:
+    pd.Series: Vehicles indexed by (fuel_type, registration_year, vehicle_class).
+    """
+    # An export with the fuel columns joined in may list a vehicle once per fuel
+    passenger_car = _per_value(registry_rows['voertuigsoort'], lambda kind: str(kind).strip() == PASSENGER_CAR)
+    cars = registry_rows[passenger_car.astype(bool)].drop_duplicates('kenteken')
+    frame = pd.DataFrame({
+        'fuel_type': cars['kenteken'].map(fuel_type).fillna('Unknown').to_numpy(),
+        'registration_year': _per_value(cars['datum_eerste_toelating'], _registration_year).astype(np.int64),
+        'vehicle_class': _per_value(cars['inrichting'], lambda body: str(body).strip() if body else 'unknown'),
+    })
+    return frame.groupby(['fuel_type', 'registration_year', 'vehicle_class']).size()
+
+
+def _add(totals, counts):
+    return counts if totals is None else totals.add(counts, fill_value=0)
+
+
+def _partition(path, columns, work_dir, name, partitions, chunk_size):
+    # Append the rows of every chunk to the partition file of their licence plate's hash
+    written = set()
+    for chunk in read_chunks(path, columns, chunk_size):
+        chunk = chunk[chunk['kenteken'].notna()]
+        partition = pd.util.hash_pandas_object(chunk['kenteken'], index=False).to_numpy() % partitions
+        for number, rows in chunk.groupby(partition):
+            partition_path = os.path.join(work_dir, f"{name}_{number}.csv")
+            rows.to_csv(partition_path, mode='a', header=number not in written, index=False)
+            written.add(number)
+    return [os.path.join(work_dir, f"{name}_{number}.csv") for number in range(partitions)]
+
+
+def stream_fleet_counts(registry_path, fuel_path=None, chunk_size=CHUNK_SIZE, partitions=PARTITIONS, work_dir=None):
+    """
+    Count the passenger cars of an RDW registry export per fuel type, registration year and vehicle class.
+
+    Parameters:
+    registry_path (str): The registry export ('Gekentekende voertuigen').
+    fuel_path (str, optional): The fuel export ('Gekentekende voertuigen brandstof'); without it the
+        registry export must have the fuel columns itself, with the rows of a vehicle next to each other.
+    chunk_size (int): Rows read at a time.
+    partitions (int): Partition files of the join; each holds about 1/partitions of both exports.
+    work_dir (str, optional): Directory of the partition files (a temporary directory by default).
+
+    Returns:
+    pd.DataFrame: 'fuel_type', 'registration_year', 'vehicle_class' and 'vehicles' (year -1 if unknown).
+    """
+    totals = None
+    if fuel_path is None:
+        # The rows of the last vehicle of a chunk wait for the next one, which may hold more of its fuels
+        pending = None
+        for chunk in read_chunks(registry_path, REGISTRY_COLUMNS + FUEL_COLUMNS[1:], chunk_size):
+            chunk = chunk if pending is None else pd.concat([pending, chunk], ignore_index=True)
+            last_vehicle = chunk['kenteken'] == chunk['kenteken'].iloc[-1]
+            pending, chunk = chunk[last_vehicle], chunk[~last_vehicle]
+            totals = _add(totals, count_vehicles(chunk, fuel_types(chunk)))
+        if pending is not None:
+            totals = _add(totals, count_vehicles(pending, fuel_types(pending)))
+    else:
+        temporary_dir = tempfile.mkdtemp(prefix='rdw-', dir=work_dir)
+        try:
+            registry_files = _partition(registry_path, REGISTRY_COLUMNS, temporary_dir, 'registry', partitions, chunk_size)
+            fuel_files = _partition(fuel_path, FUEL_COLUMNS, temporary_dir, 'fuel', partitions, chunk_size)
+            for registry_file, fuel_file in zip(registry_files, fuel_files):
+                if not os.path.exists(registry_file):
+                    continue
+                registry_rows = pd.read_csv(registry_file, dtype=str)
+                fuel_rows = pd.read_csv(fuel_file, dtype=str) if os.path.exists(fuel_file) else \
+                    pd.DataFrame(columns=FUEL_COLUMNS)
+                totals = _add(totals, count_vehicles(registry_rows, fuel_types(fuel_rows)))
+        finally:
+            shutil.rmtree(temporary_dir, ignore_errors=True)
+
+    if totals is None:
+        return pd.DataFrame(columns=['fuel_type', 'registration_year', 'vehicle_class', 'vehicles'])
+    return totals.astype(np.int64).rename('vehicles').reset_index()
+
+
+def default_fuel_factors():
+    """Return FUEL_TTW_FACTORS with WTW scaled by WTW_TTW_CAR_RATIO, as 'fuel_type', 'ttw_g_per_km', 'wtw_g_per_km'."""
+    factors = pd.DataFrame({'fuel_type': list(FUEL_TTW_FACTORS), 'ttw_g_per_km': list(FUEL_TTW_FACTORS.values())})
+    factors['wtw_g_per_km'] = factors['ttw_g_per_km'] * WTW_TTW_CAR_RATIO
+    return factors
+
+
+def weighted_factors(counts, fuel_factors=None):
+    """
+    Weight per-fuel factors by the vehicle counts, per registration year and vehicle class.
+
+    Parameters:
+    counts (pd.DataFrame): The counts of ``stream_fleet_counts``.
+    fuel_factors (pd.DataFrame, optional): 'fuel_type', 'ttw_g_per_km' and 'wtw_g_per_km'
+        (``default_fuel_factors`` by default).
+
+    Returns:
+    pd.DataFrame: The FACTOR_COLUMNS per registration year and class, plus 'ALL' rows over the years,
+    the classes and both (the fleet mix). Vehicles of fuel types without a factor are counted in
+    'vehicles' but not in the weights.
+    """
+    factors = (default_fuel_factors() if fuel_factors is None else fuel_factors).set_index('fuel_type')
+    frame = counts.assign(registration_year=counts['registration_year'].astype(str))
+    ttw = frame['fuel_type'].map(factors['ttw_g_per_km'])
+    wtw = frame['fuel_type'].map(factors['wtw_g_per_km'])
+    frame = frame.assign(weighted=frame['vehicles'].where(ttw.notna() & wtw.notna(), 0),
+                         ttw=frame['vehicles'] * ttw.fillna(0), wtw=frame['vehicles'] * wtw.fillna(0))
+
+    groups = []
+    for year, vehicle_class in [(None, None), ('ALL', None), (None, 'ALL'), ('ALL', 'ALL')]:
+        grouped = frame.assign(**{column: value for column, value in
+                                  [('registration_year', year), ('vehicle_class', vehicle_class)] if value})
+        groups.append(grouped.groupby(['registration_year', 'vehicle_class'], as_index=False)[
+            ['vehicles', 'weighted', 'ttw', 'wtw']].sum())
+    table = pd.concat(groups, ignore_index=True)
+    weighted = table.pop('weighted').where(lambda vehicles: vehicles > 0)
+    table['ttw_g_per_km'] = table.pop('ttw') / weighted
+    table['wtw_g_per_km'] = table.pop('wtw') / weighted
+    return table[FACTOR_COLUMNS]
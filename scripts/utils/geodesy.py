@@ -0,0 +1,106 @@
+"""Vectorised ellipsoidal distances on WGS84.
+
+``geodesic_distance_km`` solves Vincenty's inverse problem for whole NumPy
+arrays at once; it agrees with ``geopy.distance.geodesic`` (Karney) to well
+below a millimetre for any pair of points in the Netherlands. Nearly
+antipodal pairs, for which Vincenty's iteration does not converge, fall back
+to the Andoyer-Lambert approximation; its error is a few metres at Dutch
+scales but grows close to the antipode.
+"""
+import numpy as np
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+
+def andoyer_lambert_distance_km(lat1, lon1, lat2, lon2):
+    """
+    Andoyer-Lambert approximation of the ellipsoidal distance (a few metres off at national scales).
+
+    Parameters:
+    lat1, lon1, lat2, lon2 (array-like): Coordinates in decimal degrees.
+
+    Returns:
+    np.ndarray: Distances in kilometres.
+    """
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    f_ = (phi1 + phi2) / 2
+    g = (phi1 - phi2) / 2
+    l = (np.radians(lon1) - np.radians(lon2)) / 2
+    s = np.sin(g) ** 2 * np.cos(l) ** 2 + np.cos(f_) ** 2 * np.sin(l) ** 2
+    c = np.cos(g) ** 2 * np.cos(l) ** 2 + np.sin(f_) ** 2 * np.sin(l) ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        omega = np.arctan(np.sqrt(s / c))
+        r = np.sqrt(s * c) / omega
+        h1 = (3 * r - 1) / (2 * c)
+        h2 = (3 * r + 1) / (2 * s)
+        distance = 2 * omega * WGS84_A * (1 + WGS84_F * h1 * np.sin(f_) ** 2 * np.cos(g) ** 2
+                                          - WGS84_F * h2 * np.cos(f_) ** 2 * np.sin(g) ** 2)
+    return np.where(s == 0, 0.0, distance) / 1000
+
+
+def geodesic_distance_km(lat1, lon1, lat2, lon2, tolerance=1e-12, max_iterations=200):
+    """
+    Vectorised Vincenty inverse formula on the WGS84 ellipsoid.
+
+    Parameters:
+    lat1, lon1 (array-like): Origin coordinates in decimal degrees.
+    lat2, lon2 (array-like): Destination coordinates in decimal degrees.
+    tolerance (float): Convergence threshold on the auxiliary longitude (radians).
+    max_iterations (int): The maximum number of iterations.
+
+    Returns:
+    np.ndarray: Distances in kilometres (NaN where any coordinate is missing).
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (lat1, lon1, lat2, lon2)))
+    f = WGS84_F
+    big_l = np.radians(lon2 - lon1)
+    u1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    lam = big_l.copy()
+    # Missing coordinates are "converged" from the start and stay NaN
+    converged = np.isnan(lam) | np.isnan(u1) | np.isnan(u2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(max_iterations):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.sqrt((cos_u2 * sin_lam) ** 2 + (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam) ** 2)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # Equatorial lines have cos2_alpha == 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+            c = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            lam_next = big_l + (1 - c) * f * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            newly_converged = np.abs(lam_next - lam) < tolerance
+            lam = np.where(converged, lam, lam_next)
+            converged |= newly_converged
+            if converged.all():
+                break
+
+        # Recompute the terms with the final lambda
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.sqrt((cos_u2 * sin_lam) ** 2 + (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam) ** 2)
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+        cos2_alpha = 1 - sin_alpha ** 2
+        cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+
+        u_sq = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        distance_km = WGS84_B * big_a * (sigma - delta_sigma) / 1000
+
+    if not converged.all():
+        distance_km = np.where(converged, distance_km, andoyer_lambert_distance_km(lat1, lon1, lat2, lon2))
+    return distance_km
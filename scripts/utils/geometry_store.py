@@ -0,0 +1,169 @@
+"""Memory-mapped store of decoded leg geometries.
+
+All leg coordinates of a run are kept as (lon, lat) float64 pairs in one
+flat binary file (``<path>.coords``); an index (``<path>.index.npy``) maps
+every (trip_id, leg_index) to its offset and number of points in that array,
+plus the leg's bounding box. Opening the store maps the coordinate file, so
+any leg is a zero-copy view of the mapped array: the calculator, the map
+exporters and spatial queries read coordinates without decoding polylines
+or WKT text again.
+
+``decode_polyline`` decodes Google encoded polylines with NumPy instead of
+character by character, giving the same values as ``polyline.decode``.
+"""
+import os
+
+import numpy as np
+
+# One index row per leg; the bounding box is (min lon, min lat, max lon, max lat)
+INDEX_DTYPE = np.dtype([('trip_id', '<i8'), ('leg_index', '<i4'), ('offset', '<i8'), ('length', '<i4'),
+                        ('min_lon', '<f8'), ('min_lat', '<f8'), ('max_lon', '<f8'), ('max_lat', '<f8')])
+
+# Legs per trip are keyed as trip_id * LEG_KEY_SPAN + leg_index
+LEG_KEY_SPAN = 1 << 16
+
+
+def _files(path):
+    return path + '.coords', path + '.index.npy'
+
+
+def decode_polyline(encoded, precision=5):
+    """
+    Decode a Google encoded polyline.
+
+    Parameters:
+    encoded (str): The encoded polyline ('' for no geometry).
+    precision (int): The number of decimals encoded (5 for OTP).
+
+    Returns:
+    np.ndarray: (n, 2) array of (lon, lat) coordinates.
+    """
+    if not encoded:
+        return np.empty((0, 2))
+    chunks = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    ends = np.flatnonzero(chunks < 0x20)
+    if len(ends) == 0 or ends[-1] != len(chunks) - 1 or len(ends) % 2:
+        raise ValueError("Truncated encoded polyline")
+    # Every value is a little-endian run of 5-bit chunks, the last one without the 0x20 continuation bit
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    value_of_chunk = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = 5 * (np.arange(len(chunks)) - starts[value_of_chunk])
+    values = np.add.reduceat((chunks & 0x1f) << shifts, starts)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+    lat_lon = np.cumsum(deltas.reshape(-1, 2), axis=0) / float(10 ** precision)
+    return np.ascontiguousarray(lat_lon[:, ::-1])
+
+
+class GeometryStoreWriter:
+    """
+    Appends leg coordinates to a new geometry store; the files replace the old store when it is closed.
+
+    Parameters:
+    path (str): The store path (without the '.coords' / '.index.npy' suffixes).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._coords_file = open(_files(path)[0] + '.tmp', 'wb')
+        self._rows = []
+        self._offset = 0
+
+    def add(self, trip_id, leg_index, coordinates):
+        """
+        Append the coordinates of one leg.
+
+        Parameters:
+        trip_id (int): The trip ID.
+        leg_index (int): The leg's position in the trip (0-based).
+        coordinates (array-like): (n, 2) array of (lon, lat) coordinates.
+        """
+        coordinates = np.ascontiguousarray(coordinates, dtype='<f8').reshape(-1, 2)
+        coordinates.tofile(self._coords_file)
+        if len(coordinates):
+            bounds = (*coordinates.min(axis=0), *coordinates.max(axis=0))
+        else:
+            bounds = (np.nan,) * 4
+        self._rows.append((trip_id, leg_index, self._offset, len(coordinates), *bounds))
+        self._offset += len(coordinates)
+
+    def close(self):
+        coords_path, index_path = _files(self.path)
+        self._coords_file.close()
+        index = np.array(self._rows, dtype=INDEX_DTYPE)
+        index.sort(order=['trip_id', 'leg_index'])
+        np.save(index_path + '.tmp.npy', index)
+        os.replace(coords_path + '.tmp', coords_path)
+        os.replace(index_path + '.tmp.npy', index_path)
+
+    def abort(self):
+        """Discard the partly written store, leaving an existing one in place."""
+        coords_path, _ = _files(self.path)
+        self._coords_file.close()
+        if os.path.exists(coords_path + '.tmp'):
+            os.remove(coords_path + '.tmp')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # A run that failed part-way must not replace the previous store
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class GeometryStore:
+    """
+    Read-only view of a geometry store.
+
+    Parameters:
+    path (str): The store path (without the '.coords' / '.index.npy' suffixes).
+    """
+
+    def __init__(self, path):
+        coords_path, index_path = _files(path)
+        self.index = np.load(index_path)
+        if os.path.getsize(coords_path):
+            self.coordinates = np.memmap(coords_path, dtype='<f8', mode='r').reshape(-1, 2)
+        else:
+            self.coordinates = np.empty((0, 2))
+        self._keys = self.index['trip_id'] * LEG_KEY_SPAN + self.index['leg_index']
+
+    def __len__(self):
+        return len(self.index)
+
+    def _position(self, trip_id, leg_index):
+        key = trip_id * LEG_KEY_SPAN + leg_index
+        position = np.searchsorted(self._keys, key)
+        if position == len(self._keys) or self._keys[position] != key:
+            raise KeyError((trip_id, leg_index))
+        return position
+
+    def leg(self, trip_id, leg_index):
+        """Return the (n, 2) (lon, lat) coordinates of a leg, as a view of the mapped file."""
+        row = self.index[self._position(trip_id, leg_index)]
+        return self.coordinates[row['offset']:row['offset'] + row['length']]
+
+    def trip(self, trip_id):
+        """Return the coordinate views of every leg of a trip, in leg order."""
+        first = np.searchsorted(self._keys, trip_id * LEG_KEY_SPAN)
+        last = np.searchsorted(self._keys, (trip_id + 1) * LEG_KEY_SPAN)
+        return [self.coordinates[row['offset']:row['offset'] + row['length']] for row in self.index[first:last]]
+
+    def legs(self):
+        """Yield (trip_id, leg_index, coordinates) for every leg, in index order."""
+        for row in self.index:
+            yield int(row['trip_id']), int(row['leg_index']), self.coordinates[row['offset']:row['offset'] + row['length']]
+
+    def intersecting_bounds(self, min_lon, min_lat, max_lon, max_lat):
+        """
+        Find the legs whose bounding box overlaps a box.
+
+        Returns:
+        np.ndarray: The matching index rows.
+        """
+        index = self.index
+        mask = ((index['min_lon'] <= max_lon) & (index['max_lon'] >= min_lon)
+                & (index['min_lat'] <= max_lat) & (index['max_lat'] >= min_lat))
+        return index[mask]
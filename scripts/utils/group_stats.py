@@ -0,0 +1,303 @@
+"""Grouped sufficient statistics and the hypothesis tests computed from them.
+
+The data is partitioned once per grouping key; every group's count, means and
+co-moment matrix are then cached, so each test in ``5_Hypothesis_Testing``
+only touches a handful of numbers instead of re-filtering the DataFrame.
+"""
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+
+class Moments:
+    """
+    Sufficient statistics (count, means, co-moments) for a set of columns.
+
+    Parameters:
+    columns (tuple): The column names the statistics refer to.
+    n (float): The number of observations.
+    mean (np.ndarray): The mean of each column.
+    comoment (np.ndarray): The matrix of summed centred cross-products.
+    """
+
+    def __init__(self, columns, n, mean, comoment):
+        self.columns = tuple(columns)
+        self.n = float(n)
+        self.mean = np.asarray(mean, dtype=float)
+        self.comoment = np.asarray(comoment, dtype=float)
+
+    @classmethod
+    def empty(cls, columns):
+        k = len(columns)
+        return cls(columns, 0, np.zeros(k), np.zeros((k, k)))
+
+    def _index(self, column):
+        return self.columns.index(column)
+
+    def mean_of(self, column):
+        return self.mean[self._index(column)]
+
+    def variance(self, column, ddof=1):
+        i = self._index(column)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.comoment[i, i] / (self.n - ddof)
+
+    def covariance(self, column_a, column_b, ddof=1):
+        i, j = self._index(column_a), self._index(column_b)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.comoment[i, j] / (self.n - ddof)
+
+    def merge(self, other):
+        """
+        Combine two disjoint samples exactly (Chan et al. pairwise update).
+
+        Parameters:
+        other (Moments): The statistics of the other sample.
+
+        Returns:
+        Moments: The statistics of the union of both samples.
+        """
+        if self.columns != other.columns:
+            raise ValueError("Cannot merge moments over different columns.")
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            return other
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        mean = self.mean + delta * other.n / n
+        comoment = self.comoment + other.comoment + np.outer(delta, delta) * self.n * other.n / n
+        return Moments(self.columns, n, mean, comoment)
+
+
+def grouped_moments(values, codes, n_groups):
+    """
+    Compute count, means and co-moments for every group in one vectorised pass.
+
+    Parameters:
+    values (np.ndarray): A (rows, columns) array without missing values.
+    codes (np.ndarray): The group code (0..n_groups-1) of each row; rows with code -1 are skipped.
+    n_groups (int): The number of groups.
+
+    Returns:
+    tuple: Arrays of counts (G,), means (G, k) and co-moments (G, k, k).
+    """
+    k = values.shape[1]
+    grouped = codes >= 0
+    values, codes = values[grouped], codes[grouped]
+    counts = np.bincount(codes, minlength=n_groups).astype(float)
+    sums = np.column_stack([np.bincount(codes, weights=values[:, j], minlength=n_groups) for j in range(k)])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / counts[:, None]
+    centred = values - means[codes]
+    comoments = np.empty((n_groups, k, k))
+    for a in range(k):
+        for b in range(a, k):
+            cross = np.bincount(codes, weights=centred[:, a] * centred[:, b], minlength=n_groups)
+            comoments[:, a, b] = cross
+            comoments[:, b, a] = cross
+    return counts, means, comoments
+
+
+class GroupedStatistics:
+    """
+    Cache of group partitions and per-group sufficient statistics of a DataFrame.
+
+    Partitions are computed once per grouping key with ``groupby`` indices and
+    moments once per (grouping key, columns, mask) combination.
+
+    Parameters:
+    df (pd.DataFrame): The trip-level dataset.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self._masks = {}
+        self._partitions = {}
+        self._moments = {}
+
+    def define_mask(self, name, mask):
+        """
+        Register a named row filter (e.g. strictly positive values) usable in ``moments``.
+
+        Parameters:
+        name (str): The name of the mask.
+        mask (pd.Series or np.ndarray): Boolean row selector aligned with the DataFrame.
+        """
+        self._masks[name] = np.asarray(mask, dtype=bool)
+        self._moments = {key: value for key, value in self._moments.items() if key[2] != name}
+
+    def partition(self, by):
+        """
+        Return the group code of every row and the group labels for a grouping key.
+
+        Parameters:
+        by (str or tuple): The column(s) to group by.
+
+        Returns:
+        tuple: (codes, labels) where rows outside every group have code -1.
+        """
+        key = by if isinstance(by, tuple) else (by,)
+        if key not in self._partitions:
+            grouped = self.df.groupby(list(key), sort=True)
+            # Rows with a missing key are in no group (ngroup gives them NaN)
+            codes = grouped.ngroup().fillna(-1).to_numpy(dtype=np.intp)
+            labels = grouped.size().index.tolist()
+            self._partitions[key] = (codes, labels, grouped.indices)
+        return self._partitions[key][:2]
+
+    def values(self, by, label, columns, where=None, exclude=None):
+        """
+        Return the raw values of one column for a group, e.g. as input for resampling.
+
+        Parameters:
+        by (str or tuple): The grouping column(s).
+        label: The group label, or None to select every group not matched by ``exclude``.
+        columns (str or list): The numeric column, or several columns kept row-aligned.
+        where (str, optional): The name of a registered mask.
+        exclude (callable, optional): Predicate on the label selecting groups to skip.
+
+        Returns:
+        np.ndarray: The values of the selected rows without missing values, 1-D for a
+        single column and (rows, columns) otherwise.
+        """
+        self.partition(by)
+        indices = self._partitions[by if isinstance(by, tuple) else (by,)][2]
+        selected = [rows for group, rows in indices.items()
+                    if (label is None or group == label) and not (exclude is not None and exclude(group))]
+        rows = np.sort(np.concatenate(selected)) if selected else np.array([], dtype=np.intp)
+        if where is not None:
+            rows = rows[self._masks[where][rows]]
+        if isinstance(columns, str):
+            column_values = self.df[columns].to_numpy(dtype=float)[rows]
+            return column_values[~np.isnan(column_values)]
+        column_values = self.df[list(columns)].to_numpy(dtype=float)[rows]
+        return column_values[~np.isnan(column_values).any(axis=1)]
+
+    def moments(self, by, columns, where=None):
+        """
+        Return the cached statistics of ``columns`` for every group of ``by``.
+
+        Parameters:
+        by (str, tuple or None): The grouping column(s); None for the whole dataset.
+        columns (list): The numeric columns to summarise jointly.
+        where (str, optional): The name of a mask registered with ``define_mask``.
+
+        Returns:
+        dict: Group label -> Moments (the key is None when ``by`` is None).
+        """
+        columns = tuple(columns)
+        cache_key = (by, columns, where)
+        if cache_key not in self._moments:
+            values = self.df[list(columns)].to_numpy(dtype=float)
+            if by is None:
+                codes, labels = np.zeros(len(self.df), dtype=np.intp), [None]
+            else:
+                codes, labels = self.partition(by)
+            keep = (codes >= 0) & ~np.isnan(values).any(axis=1)
+            if where is not None:
+                keep &= self._masks[where]
+            counts, means, comoments = grouped_moments(values[keep], codes[keep], len(labels))
+            self._moments[cache_key] = {
+                label: Moments(columns, counts[g], means[g], comoments[g]) for g, label in enumerate(labels)
+            }
+        return self._moments[cache_key]
+
+    def group(self, by, label, columns, where=None):
+        """Return the statistics of a single group (empty if the group does not occur)."""
+        return self.moments(by, columns, where).get(label, Moments.empty(columns))
+
+    def combine(self, by, columns, where=None, include=None, exclude=None):
+        """
+        Merge the statistics of several groups, e.g. "all modes except BICYCLE".
+
+        Parameters:
+        by (str or tuple): The grouping column(s).
+        columns (list): The numeric columns.
+        where (str, optional): The name of a registered mask.
+        include (callable, optional): Predicate on the label selecting groups to merge.
+        exclude (callable, optional): Predicate on the label selecting groups to skip.
+
+        Returns:
+        Moments: The merged statistics.
+        """
+        merged = Moments.empty(columns)
+        for label, moments in self.moments(by, columns, where).items():
+            if include is not None and not include(label):
+                continue
+            if exclude is not None and exclude(label):
+                continue
+            merged = merged.merge(moments)
+        return merged
+
+
+# Hypothesis tests evaluated from cached moments (same statistics as scipy.stats)
+def paired_t_test(moments, column_a, column_b):
+    """Paired t-test of column_a vs column_b, equivalent to ``stats.ttest_rel``."""
+    n = moments.n
+    mean_diff = moments.mean_of(column_a) - moments.mean_of(column_b)
+    var_diff = moments.variance(column_a) + moments.variance(column_b) - 2 * moments.covariance(column_a, column_b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_stat = mean_diff / np.sqrt(var_diff / n)
+    p_value = 2 * stats.t.sf(np.abs(t_stat), n - 1)
+    return t_stat, p_value
+
+
+def independent_t_test(moments_1, moments_2, column):
+    """Pooled-variance two-sample t-test, equivalent to ``stats.ttest_ind``."""
+    n1, n2 = moments_1.n, moments_2.n
+    dof = n1 + n2 - 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pooled = ((n1 - 1) * moments_1.variance(column) + (n2 - 1) * moments_2.variance(column)) / dof
+        t_stat = (moments_1.mean_of(column) - moments_2.mean_of(column)) / np.sqrt(pooled * (1 / n1 + 1 / n2))
+    p_value = 2 * stats.t.sf(np.abs(t_stat), dof)
+    return t_stat, p_value
+
+
+def anova_test(moments_list, column):
+    """One-way ANOVA over groups, equivalent to ``stats.f_oneway``."""
+    counts = np.array([m.n for m in moments_list])
+    means = np.array([m.mean_of(column) for m in moments_list])
+    within = sum(m.comoment[m._index(column), m._index(column)] for m in moments_list)
+    total_n = counts.sum()
+    grand_mean = np.dot(counts, means) / total_n
+    between = np.dot(counts, (means - grand_mean) ** 2)
+    dfn, dfd = len(moments_list) - 1, total_n - len(moments_list)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f_stat = (between / dfn) / (within / dfd)
+    p_value = stats.f.sf(f_stat, dfn, dfd)
+    return f_stat, p_value
+
+
+def f_test(moments_1, moments_2, column):
+    """One-sided F-test for the variance ratio of two groups."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f_stat = moments_1.variance(column) / moments_2.variance(column)
+    p_value = stats.f.sf(f_stat, moments_1.n - 1, moments_2.n - 1)
+    return f_stat, p_value
+
+
+def pearson_correlation(moments, column_a, column_b):
+    """Pearson correlation with a two-sided p-value, equivalent to ``stats.pearsonr``."""
+    i, j = moments._index(column_a), moments._index(column_b)
+    c = moments.comoment
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = c[i, j] / np.sqrt(c[i, i] * c[j, j])
+        r = float(np.clip(r, -1.0, 1.0))
+        dof = moments.n - 2
+        t_stat = r * np.sqrt(dof / (1 - r ** 2))
+    p_value = 2 * stats.t.sf(np.abs(t_stat), dof)
+    return r, p_value
+
+
+def count_legs(legs):
+    """
+    Count the legs of each trip from the stringified ``legs`` column without evaluating it.
+
+    Parameters:
+    legs (pd.Series): The ``legs`` column written by ``4_CO2_Calculator``.
+
+    Returns:
+    pd.Series: The number of legs per trip.
+    """
+    return legs.astype(str).str.count("'leg_id':")
@@ -0,0 +1,375 @@
+"""Stage timing, memory and request-latency metrics.
+
+Instrumentation is off unless a metrics directory is configured, either with
+``configure(metrics_dir=...)`` or the ``CO2COMMUTE_METRICS_DIR`` environment
+variable (which pipeline worker processes inherit). While it is off,
+``stage``, ``timed`` and ``add_rows`` return shared no-op objects after a
+single flag check, so they can stay in hot loops.
+
+When it is on, every ``stage`` block records its wall and CPU time, the peak
+RSS of the process, the rows it reported and the latency histograms observed
+with ``timed`` (OTP and geocoder requests), and writes them on exit to
+``<metrics_dir>/<stage>.json`` and to ``<metrics_dir>/<stage>.prom`` in the
+Prometheus textfile-collector format.
+
+Stages named in ``CO2COMMUTE_PROFILE`` (comma-separated, or 'all') are also
+sampled by ``SamplingProfiler``: the stack of the stage thread is recorded
+every few milliseconds and written as folded stacks to
+``<metrics_dir>/<stage>.folded`` (the input format of flamegraph.pl and
+speedscope), with the functions seen most often listed in the JSON report.
+"""
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+METRICS_DIR_ENV = 'CO2COMMUTE_METRICS_DIR'
+PROFILE_ENV = 'CO2COMMUTE_PROFILE'
+
+# Upper bounds of the latency histogram buckets (seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Interval between profiler samples (seconds) and the number of functions listed in the report
+PROFILE_INTERVAL = 0.005
+PROFILE_TOP_FUNCTIONS = 25
+
+# Prefix of the exported Prometheus metrics
+METRIC_PREFIX = 'co2commute'
+
+_settings = {'metrics_dir': os.environ.get(METRICS_DIR_ENV) or None,
+             'profile': set(filter(None, os.environ.get(PROFILE_ENV, '').split(',')))}
+_current = None
+
+
+def configure(metrics_dir=None, profile=None):
+    """
+    Enable (or disable) the instrumentation for this process and its workers.
+
+    Parameters:
+    metrics_dir (str, optional): The directory the reports are written to; None disables the metrics.
+    profile (list, optional): The stage names to profile, or ['all'].
+    """
+    _settings['metrics_dir'] = metrics_dir
+    _settings['profile'] = set(profile or [])
+    # Worker processes started later read the same settings from the environment
+    if metrics_dir:
+        os.environ[METRICS_DIR_ENV] = metrics_dir
+        os.environ[PROFILE_ENV] = ','.join(sorted(_settings['profile']))
+    else:
+        os.environ.pop(METRICS_DIR_ENV, None)
+        os.environ.pop(PROFILE_ENV, None)
+
+
+def enabled():
+    return _settings['metrics_dir'] is not None
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, as exported to Prometheus."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Approximate quantile: the upper bound of the bucket holding it."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        cumulative = []
+        seen = 0
+        for count in self.counts:
+            seen += count
+            cumulative.append(seen)
+        return {'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], cumulative)),
+                'sum': self.sum, 'count': self.count,
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99)}
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler sampling the stack of one thread from a background thread.
+
+    Parameters:
+    thread_id (int): The thread to sample (default: the calling thread).
+    interval (float): The time between samples in seconds.
+    """
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+                self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def top_functions(self, n=PROFILE_TOP_FUNCTIONS):
+        """Functions by the share of samples in which they were running (self) or on the stack (total)."""
+        own = {}
+        total = {}
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+            for function in set(frames):
+                total[function] = total.get(function, 0) + count
+        ranked = sorted(total, key=lambda function: (own.get(function, 0), total[function]), reverse=True)[:n]
+        return [{'function': function, 'self': own.get(function, 0) / self.samples,
+                 'total': total[function] / self.samples} for function in ranked] if self.samples else []
+
+    def write_folded(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+
+class StageMetrics:
+    """
+    Metrics of one stage run; use through ``stage()``.
+
+    Parameters:
+    name (str): The stage name.
+    metrics_dir (str): The directory the reports are written to.
+    profile (bool): Whether to run the sampling profiler.
+    """
+
+    def __init__(self, name, metrics_dir, profile=False):
+        self.name = name
+        self.metrics_dir = metrics_dir
+        self.rows = 0
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.profiler = SamplingProfiler() if profile else None
+        self.report = None
+
+    def add_rows(self, n):
+        self.rows += n
+
+    def observe(self, name, seconds, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def __enter__(self):
+        global _current
+        self.parent = _current
+        _current = self
+        if self.profiler is not None:
+            self.profiler.start()
+        self.started_at = time.time()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _current
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.process_time() - self.cpu_start
+        if self.profiler is not None:
+            self.profiler.stop()
+        _current = self.parent
+
+        self.report = {
+            'stage': self.name,
+            'status': 'failed' if exc_type else 'ok',
+            'started_at': self.started_at,
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'peak_rss_bytes': _peak_rss_bytes(),
+            'rows': self.rows,
+            'rows_per_second': self.rows / wall if wall > 0 else None,
+            'histograms': [dict(name=name, labels=dict(labels), **histogram.to_dict())
+                           for (name, labels), histogram in sorted(self.histograms.items())],
+        }
+        if self.profiler is not None:
+            self.report['profile'] = {'samples': self.profiler.samples, 'interval': self.profiler.interval,
+                                      'top_functions': self.profiler.top_functions()}
+        self.write()
+        return False
+
+    def write(self):
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        base = os.path.join(self.metrics_dir, self.name)
+        _write_atomic(f"{base}.json", json.dumps(self.report, indent=4))
+        _write_atomic(f"{base}.prom", prometheus_text(self.report))
+        if self.profiler is not None:
+            self.profiler.write_folded(f"{base}.folded")
+
+
+class _NullStage:
+    """Stand-in returned while the instrumentation is off."""
+
+    rows = 0
+    report = None
+
+    def add_rows(self, n):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class _Timer:
+    def __init__(self, stage_metrics, name, labels):
+        self.stage_metrics = stage_metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stage_metrics.observe(self.name, time.perf_counter() - self.started, self.labels)
+        return False
+
+
+_NULL = _NullStage()
+
+
+def stage(name):
+    """
+    Measure a block as a pipeline stage.
+
+    Parameters:
+    name (str): The stage name, used for the report files and the 'stage' label.
+
+    Returns:
+    A context manager; a shared no-op object when the instrumentation is off.
+    """
+    if _settings['metrics_dir'] is None:
+        return _NULL
+    profile = 'all' in _settings['profile'] or name in _settings['profile']
+    return StageMetrics(name, _settings['metrics_dir'], profile)
+
+
+def timed(name, **labels):
+    """
+    Time a block into the latency histogram ``name`` of the current stage.
+
+    Parameters:
+    name (str): The metric name, e.g. 'otp_request_seconds'.
+    **labels: Labels of the observation, e.g. mode='CAR'.
+
+    Returns:
+    A context manager; a shared no-op object when no stage is being measured.
+    """
+    if _current is None:
+        return _NULL
+    return _Timer(_current, name, labels)
+
+
+def add_rows(n):
+    """Add processed rows to the current stage (no-op when no stage is being measured)."""
+    if _current is not None:
+        _current.rows += n
+
+
+def _label_text(labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def prometheus_text(report):
+    """
+    Format a stage report in the Prometheus text exposition format.
+
+    Parameters:
+    report (dict): The report of ``StageMetrics``.
+
+    Returns:
+    str: The metrics, one family per gauge and per histogram.
+    """
+    stage_label = _label_text({'stage': report['stage']})
+    lines = []
+    gauges = [
+        ('stage_wall_seconds', "Wall-clock time of the last stage run.", report['wall_seconds']),
+        ('stage_cpu_seconds', "CPU time of the last stage run.", report['cpu_seconds']),
+        ('stage_peak_rss_bytes', "Peak resident set size of the process running the stage.", report['peak_rss_bytes']),
+        ('stage_rows', "Rows processed by the last stage run.", report['rows']),
+        ('stage_rows_per_second', "Rows processed per second of wall-clock time.", report['rows_per_second']),
+        ('stage_success', "1 if the last stage run succeeded, 0 if it failed.", int(report['status'] == 'ok')),
+        ('stage_last_run_timestamp_seconds', "Start time of the last stage run.", report['started_at']),
+    ]
+    for name, help_text, value in gauges:
+        if value is None:
+            continue
+        lines += [f"# HELP {METRIC_PREFIX}_{name} {help_text}",
+                  f"# TYPE {METRIC_PREFIX}_{name} gauge",
+                  f"{METRIC_PREFIX}_{name}{{{stage_label}}} {value}"]
+
+    families = {}
+    for histogram in report['histograms']:
+        families.setdefault(histogram['name'], []).append(histogram)
+    for name, histograms in families.items():
+        metric = f"{METRIC_PREFIX}_{name}"
+        lines += [f"# HELP {metric} Latency histogram ({name}).", f"# TYPE {metric} histogram"]
+        for histogram in histograms:
+            labels = _label_text(dict({'stage': report['stage']}, **histogram['labels']))
+            for bound, count in histogram['buckets'].items():
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f"{metric}_sum{{{labels}}} {histogram['sum']}")
+            lines.append(f"{metric}_count{{{labels}}} {histogram['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+def _write_atomic(path, text):
+    # The textfile collector may read the file at any time, so it is replaced in one step
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w') as f:
+        f.write(text)
+    os.replace(temporary_path, path)
@@ -0,0 +1,199 @@
+"""Flow-weighted sampling of origin-destination pairs from the ODiN commutes.
+
+Every observed (origin PC4, destination PC4, routing mode) flow is weighted by
+its number of commutes, or by a survey weight column when one is given, and
+pairs are drawn in proportion to that weight with Vose's alias method: the
+table is built in O(number of flows) and every draw is O(1), so 100k+ pairs
+are drawn in a few vectorised NumPy operations.
+
+Samples can be stratified by routing mode and distance band (the short /
+medium / long groups of ``4_CO2_Calculator``). Every sampled pair carries a
+``sample_weight``, the number of commutes it stands for in its stratum, so
+estimates stay nationally representative when strata are over- or
+under-sampled.
+"""
+import numpy as np
+import pandas as pd
+
+from utils.geodesy import geodesic_distance_km
+from utils.odin_modes import ROUTING_MODE_BY_HVM
+
+# Upper bounds of the short and medium commute distance groups (km), as in classify_commute_distance
+SHORT_MAX_KM = 10
+MEDIUM_MAX_KM = 30
+
+
+class AliasTable:
+    """
+    Vose's alias table for sampling indices in proportion to weights.
+
+    Parameters:
+    weights (array-like): Non-negative weights, at least one of them positive.
+    """
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=float)
+        if weights.ndim != 1 or len(weights) == 0 or np.any(weights < 0) or not weights.sum() > 0:
+            raise ValueError("The weights must be a non-empty array of non-negative numbers with a positive sum.")
+        n = len(weights)
+        scaled = weights * (n / weights.sum())
+        self.probability = np.ones(n)
+        self.alias = np.arange(n)
+
+        small = list(np.flatnonzero(scaled < 1))
+        large = list(np.flatnonzero(scaled >= 1))
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+        # Whatever is left is 1 up to rounding errors and keeps probability 1
+
+    def sample(self, rng, size):
+        """
+        Draw indices with replacement.
+
+        Parameters:
+        rng (np.random.Generator): The random generator.
+        size (int): The number of draws.
+
+        Returns:
+        np.ndarray: The drawn indices.
+        """
+        column = rng.integers(len(self.probability), size=size)
+        return np.where(rng.random(size) < self.probability[column], column, self.alias[column])
+
+
+def distance_band(distance_km):
+    """Classify distances into the 'short', 'medium' and 'long' commute groups."""
+    distance_km = np.asarray(distance_km, dtype=float)
+    return np.where(distance_km < SHORT_MAX_KM, 'short', np.where(distance_km <= MEDIUM_MAX_KM, 'medium', 'long'))
+
+
+def aggregate_flows(refined_commutes, centroids, weight_column=None):
+    """
+    Aggregate the commutes into weighted PC4 x PC4 flows per routing mode.
+
+    Parameters:
+    refined_commutes (pd.DataFrame): The commutes with OriginZipCode, DestinationZipCode and ModeOfTransport.
+    centroids (PC4Centroids): The PC4 centroid lookup.
+    weight_column (str, optional): A survey weight column; each commute counts once without it.
+
+    Returns:
+    pd.DataFrame: One row per flow with origin, destination, mode, weight, coordinates, distance_km and band.
+    """
+    df = pd.DataFrame({
+        'origin': pd.to_numeric(refined_commutes['OriginZipCode'], errors='coerce'),
+        'destination': pd.to_numeric(refined_commutes['DestinationZipCode'], errors='coerce'),
+        'mode': pd.to_numeric(refined_commutes['ModeOfTransport'], errors='coerce').map(ROUTING_MODE_BY_HVM),
+        'weight': (pd.to_numeric(refined_commutes[weight_column], errors='coerce')
+                   if weight_column else 1.0),
+    })
+    # Unknown postcodes (0 or blank), modes that are not routed and missing weights are left out
+    df = df[(df['origin'] > 0) & (df['destination'] > 0) & df['mode'].notna() & (df['weight'] > 0)]
+    flows = df.groupby(['origin', 'destination', 'mode'], as_index=False, sort=True)['weight'].sum()
+    flows[['origin', 'destination']] = flows[['origin', 'destination']].astype(int)
+
+    centroids.attach(flows, 'origin', 'origin_latitude', 'origin_longitude')
+    centroids.attach(flows, 'destination', 'destination_latitude', 'destination_longitude')
+    flows = flows.dropna(subset=['origin_latitude', 'destination_latitude']).reset_index(drop=True)
+    flows['distance_km'] = geodesic_distance_km(flows['origin_latitude'].to_numpy(), flows['origin_longitude'].to_numpy(),
+                                                flows['destination_latitude'].to_numpy(), flows['destination_longitude'].to_numpy())
+    flows['band'] = distance_band(flows['distance_km'])
+    return flows
+
+
+def allocate(stratum_weights, n, allocation='proportional'):
+    """
+    Split a sample size over strata.
+
+    Parameters:
+    stratum_weights (pd.Series): The total weight of every stratum.
+    n (int): The total sample size.
+    allocation (str or dict): 'proportional' to the stratum weights, 'equal', or a dict stratum -> size.
+
+    Returns:
+    pd.Series: The sample size of every stratum (largest-remainder rounding).
+    """
+    if isinstance(allocation, dict):
+        return pd.Series({stratum: int(allocation.get(stratum, 0)) for stratum in stratum_weights.index})
+    if allocation == 'proportional':
+        shares = stratum_weights / stratum_weights.sum()
+    elif allocation == 'equal':
+        shares = pd.Series(1 / len(stratum_weights), index=stratum_weights.index)
+    else:
+        raise ValueError(f"Unknown allocation '{allocation}'")
+    exact = shares * n
+    sizes = np.floor(exact).astype(int)
+    remainder = n - sizes.sum()
+    sizes[(exact - sizes).sort_values(ascending=False, kind='stable').index[:remainder]] += 1
+    return sizes
+
+
+class ODSampler:
+    """
+    Draws OD pairs in proportion to the observed commute flows.
+
+    Parameters:
+    flows (pd.DataFrame): The flows of ``aggregate_flows``.
+    """
+
+    def __init__(self, flows):
+        self.flows = flows
+        self._tables = {}
+
+    @classmethod
+    def from_commutes(cls, refined_commutes, centroids, weight_column=None):
+        """Build the sampler from the refined commutes (see ``aggregate_flows``)."""
+        return cls(aggregate_flows(refined_commutes, centroids, weight_column))
+
+    def _table(self, key, index):
+        if key not in self._tables:
+            self._tables[key] = (index, AliasTable(self.flows['weight'].to_numpy()[index]))
+        return self._tables[key]
+
+    def sample(self, n, seed=None, by=None, allocation='proportional'):
+        """
+        Draw OD pairs with replacement.
+
+        Parameters:
+        n (int): The number of pairs.
+        seed (int, optional): The random seed.
+        by (list, optional): Flow columns to stratify by, e.g. ['mode', 'band'].
+        allocation (str or dict): How n is split over the strata, see ``allocate``.
+
+        Returns:
+        pd.DataFrame: The sampled flows with a 'sample_weight' column, in draw order.
+        """
+        rng = np.random.default_rng(seed)
+        total_weight = self.flows['weight'].sum()
+        if not by:
+            index, table = self._table((), np.arange(len(self.flows)))
+            drawn = index[table.sample(rng, n)]
+            sample = self.flows.iloc[drawn].reset_index(drop=True)
+            sample['sample_weight'] = total_weight / n if n else np.nan
+            return sample
+
+        by = list(by)
+        strata = self.flows.groupby(by, sort=True).indices
+        stratum_weights = self.flows.groupby(by, sort=True)['weight'].sum()
+        sizes = allocate(stratum_weights, n, allocation)
+        parts = []
+        for stratum, size in sizes.items():
+            if size <= 0:
+                continue
+            key = stratum if isinstance(stratum, tuple) else (stratum,)
+            index, table = self._table(tuple(zip(by, key)), strata[stratum])
+            part = self.flows.iloc[index[table.sample(rng, size)]].copy()
+            part['sample_weight'] = stratum_weights[stratum] / size
+            parts.append(part)
+        if not parts:
+            return self.flows.iloc[:0].assign(sample_weight=pd.Series(dtype=float))
+        # Shuffle the strata together, so that any prefix of the sample is itself representative
+        sample = pd.concat(parts, ignore_index=True)
+        return sample.iloc[rng.permutation(len(sample))].reset_index(drop=True)
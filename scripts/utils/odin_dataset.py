@@ -0,0 +1,330 @@
+"""Several ODiN survey years as one hive-partitioned Parquet dataset.
+
+Every yearly ODiN CSV is converted once to a harmonised schema (ODIN_SCHEMA:
+the same columns and types for every year, whatever the capitalisation of the
+export's header; columns a year lacks are null, decimal commas are parsed)
+and written to
+
+    <path>/year=<YYYY>/MotiefV=<purpose>/part-0.parquet
+
+so a query on the survey year or the trip purpose only opens the matching
+directories. Each (year, purpose) file is sorted as a whole by mode (Hvm)
+and origin postcode (VertPC) and written in small row groups of
+ROW_GROUP_SIZE rows, so each row group holds one or a few modes and a
+narrow range of origin postcodes: their min/max statistics let the
+Parquet reader skip the row groups without a matching mode, or without a
+matching origin postcode among the trips of that mode (row_groups_read
+counts them). Destination postcodes (AankPC) are not sorted, so a filter
+on them reads every row group of the matching partitions.
+
+The CSV is parsed in blocks, but a survey year is held in memory until it
+is sorted and written (a year is a few hundred thousand rows).
+
+pyarrow is only needed to build and read the dataset; it is imported when
+one of these functions runs.
+"""
+import os
+import re
+import shutil
+
+import pandas as pd
+
+# Harmonised columns: name -> pyarrow type name
+ODIN_SCHEMA = {
+    'OPID': 'int64',      # Person id
+    'VerplID': 'int64',   # Trip id
+    'Jaar': 'int16',
+    'Maand': 'int16',
+    'Dag': 'int16',
+    'Geslacht': 'int16',
+    'Leeftijd': 'int16',
+    'VertPC': 'int32',    # Origin PC4
+    'AankPC': 'int32',    # Destination PC4
+    'Reisduur': 'int32',  # Travel time (minutes)
+    'Hvm': 'int16',       # Main mode of the trip
+    'VertUur': 'int16',
+    'VertMin': 'int16',
+    'AankUur': 'int16',
+    'AankMin': 'int16',
+    'WrkVervw': 'int16',  # Mode with most kilometres to work
+    'WrkVerg': 'int16',   # Travel reimbursement from the employer
+    'VergVast': 'int16',
+    'VergKm': 'int16',
+    'VergBrSt': 'int16',
+    'VergOV': 'int16',
+    'VergAans': 'int16',
+    'VergVoer': 'int16',
+    'VergBudg': 'int16',
+    'VergPark': 'int16',
+    'VergStal': 'int16',
+    'VergAnd': 'int16',
+    'FactorV': 'float64',  # Trip weight
+    'FactorP': 'float64',  # Person weight
+}
+
+# Partition columns: the survey year and the trip purpose (null for persons without trips)
+PARTITION_COLUMNS = {'year': 'int16', 'MotiefV': 'int16'}
+
+# Rows per row group (small, so the row group statistics are selective), and bytes of CSV parsed at a time
+ROW_GROUP_SIZE = 8192
+BLOCK_SIZE = 16 << 20
+
+# Directory name of a null partition value (pyarrow's hive default)
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("The partitioned ODiN dataset needs pyarrow (pip install pyarrow).") from e
+    return pyarrow
+
+
+def parse_years(text):
+    """
+    Parse a list of survey years such as '2018-2023' or '2019,2022'.
+
+    Returns:
+    list: The years, in ascending order.
+    """
+    years = set()
+    for part in str(text).split(','):
+        first, _, last = part.strip().partition('-')
+        years.update(range(int(first), int(last or first) + 1))
+    return sorted(years)
+
+
+def year_of_csv(csv_path):
+    """Return the survey year in the name of an ODiN export (e.g. ODiN2022_Databestand.csv), or None."""
+    match = re.search(r'(19|20)\d\d', os.path.basename(csv_path))
+    return int(match.group()) if match else None
+
+
+def _source_columns(csv_path):
+    # Harmonised name -> the export's own header name, matched case-insensitively
+    with open(csv_path, encoding='latin1') as csv_file:
+        header = csv_file.readline().rstrip('\r\n').split(';')
+    by_name = {column.strip().lower(): column for column in header}
+    return {column: by_name[column.lower()] for column in list(ODIN_SCHEMA) + ['MotiefV']
+            if column.lower() in by_name}
+
+
+def read_odin_csv(csv_path, block_size=BLOCK_SIZE):
+    """
+    Stream an ODiN CSV export in the harmonised schema.
+
+    Parameters:
+    csv_path (str): The ODiN export (';'-separated, latin1).
+    block_size (int): Bytes of CSV parsed at a time.
+
+    Yields:
+    pyarrow.Table: The ODIN_SCHEMA columns and MotiefV of a block of rows.
+    """
+    pa = _pyarrow()
+    import pyarrow.compute as pc
+    import pyarrow.csv
+
+    sources = _source_columns(csv_path)
+    types = dict(ODIN_SCHEMA, MotiefV=PARTITION_COLUMNS['MotiefV'])
+    # Decimal-comma weights are read as text and parsed below; blanks are missing values
+    column_types = {source: pa.string() if types[column] == 'float64' else pa.type_for_alias(types[column])
+                    for column, source in sources.items()}
+    reader = pa.csv.open_csv(
+        csv_path, read_options=pa.csv.ReadOptions(encoding='latin1', block_size=block_size),
+        parse_options=pa.csv.ParseOptions(delimiter=';'),
+        convert_options=pa.csv.ConvertOptions(include_columns=list(sources.values()), column_types=column_types,
+                                              null_values=['', ' '], strings_can_be_null=True))
+    for batch in reader:
+        if not batch.num_rows:
+            continue
+        columns = []
+        for column, type_name in types.items():
+            if column not in sources:
+                columns.append(pa.nulls(batch.num_rows, type_name))
+            elif type_name == 'float64':
+                text = pc.utf8_trim_whitespace(batch.column(sources[column]))
+                columns.append(pc.cast(pc.replace_substring(text, ',', '.'), pa.float64()))
+            else:
+                columns.append(batch.column(sources[column]))
+        yield pa.Table.from_arrays(columns, names=list(types))
+
+
+class _YearWriter:
+    """Collects the rows of one survey year per purpose and writes each purpose sorted as a whole."""
+
+    def __init__(self, year_dir, row_group_size):
+        self.year_dir = year_dir
+        self.row_group_size = row_group_size
+        self.tables = {}
+        self.rows = 0
+
+    def add(self, table):
+        import pyarrow.compute as pc
+        purposes = table.column('MotiefV')
+        for purpose in pc.unique(purposes).to_pylist():
+            rows = table.filter(pc.is_null(purposes) if purpose is None else pc.equal(purposes, purpose))
+            self.tables.setdefault(purpose, []).append(rows.drop_columns(['MotiefV']))
+
+    def close(self):
+        pa = _pyarrow()
+        for purpose in list(self.tables):
+            rows = pa.concat_tables(self.tables.pop(purpose)).combine_chunks()
+            rows = rows.sort_by([('Hvm', 'ascending'), ('VertPC', 'ascending')])
+            partition_dir = os.path.join(self.year_dir, f"MotiefV={NULL_PARTITION if purpose is None else purpose}")
+            os.makedirs(partition_dir, exist_ok=True)
+            pa.parquet.write_table(rows, os.path.join(partition_dir, 'part-0.parquet'),
+                                   row_group_size=self.row_group_size)
+            self.rows += rows.num_rows
+
+
+def write_odin_year(csv_path, dataset_path, year=None, row_group_size=ROW_GROUP_SIZE):
+    """
+    Convert one yearly ODiN CSV export into the year's partition of the dataset, replacing it.
+
+    Parameters:
+    csv_path (str): The ODiN export (';'-separated, latin1).
+    dataset_path (str): The dataset directory.
+    year (int, optional): The survey year (default: from the file name).
+    row_group_size (int): Rows per row group.
+
+    Returns:
+    int: The number of rows written.
+    """
+    year = year or year_of_csv(csv_path)
+    if year is None:
+        raise ValueError(f"No survey year in '{csv_path}'; give it explicitly.")
+
+    # The year is written next to its partition and swapped in when complete
+    year_dir = os.path.join(dataset_path, f"year={year}")
+    temporary_dir = f"{year_dir}.tmp"
+    shutil.rmtree(temporary_dir, ignore_errors=True)
+    writer = _YearWriter(temporary_dir, row_group_size)
+    try:
+        for table in read_odin_csv(csv_path):
+            writer.add(table)
+        writer.close()
+    except BaseException:
+        shutil.rmtree(temporary_dir, ignore_errors=True)
+        raise
+    shutil.rmtree(year_dir, ignore_errors=True)
+    os.replace(temporary_dir, year_dir)
+    return writer.rows
+
+
+def open_odin_dataset(dataset_path):
+    """Open the dataset as a pyarrow dataset (the partition columns 'year' and 'MotiefV' included)."""
+    pa = _pyarrow()
+    partitioning = pa.dataset.partitioning(
+        pa.schema([(column, type_name) for column, type_name in PARTITION_COLUMNS.items()]), flavor='hive')
+    return pa.dataset.dataset(dataset_path, format='parquet', partitioning=partitioning,
+                              exclude_invalid_files=True, ignore_prefixes=['.', '_'])
+
+
+def odin_filter(years=None, purposes=None, modes=None, postcodes=None):
+    """
+    Build the filter expression of a query; None leaves a dimension unfiltered.
+
+    Parameters:
+    years (list, optional): Survey years.
+    purposes (list, optional): Trip purposes (MotiefV codes).
+    modes (list, optional): Main modes (Hvm codes).
+    postcodes (list, optional): PC4 postcodes the trip starts in (VertPC).
+
+    Returns:
+    pyarrow.compute.Expression or None: The filter.
+    """
+    field = _pyarrow().dataset.field
+    conditions = []
+    if years is not None:
+        conditions.append(field('year').isin([int(year) for year in years]))
+    if purposes is not None:
+        conditions.append(field('MotiefV').isin([int(purpose) for purpose in purposes]))
+    if modes is not None:
+        conditions.append(field('Hvm').isin([int(mode) for mode in modes]))
+    if postcodes is not None:
+        postcodes = [int(postcode) for postcode in postcodes]
+        conditions.append(field('VertPC').isin(postcodes))
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def row_groups_read(dataset_path, years=None, purposes=None, modes=None, postcodes=None):
+    """
+    Count the row groups a query reads, from the partition paths and the row group min/max statistics.
+
+    Parameters:
+    dataset_path (str): The dataset directory.
+    years, purposes, modes, postcodes: The filters of odin_filter.
+
+    Returns:
+    tuple: (row groups that may hold matching rows, row groups in the dataset).
+    """
+    pa = _pyarrow()
+    dataset = open_odin_dataset(dataset_path)
+    partition_filter = odin_filter(years, purposes)
+    matching_files = {fragment.path for fragment in dataset.get_fragments(filter=partition_filter)}
+    ranges = [(column, [int(value) for value in values])
+              for column, values in [('Hvm', modes), ('VertPC', postcodes)] if values is not None]
+    matching = total = 0
+    for file_path in dataset.files:
+        metadata = pa.parquet.ParquetFile(file_path).metadata
+        total += metadata.num_row_groups
+        if file_path not in matching_files:
+            continue
+        names = metadata.schema.names
+        for index in range(metadata.num_row_groups):
+            row_group = metadata.row_group(index)
+            matching += all(_may_contain(row_group.column(names.index(column)).statistics, values)
+                            for column, values in ranges)
+    return matching, total
+
+
+def _may_contain(statistics, values):
+    # Without statistics (or with nulls only) the row group has to be read
+    if statistics is None or not statistics.has_min_max:
+        return True
+    return any(statistics.min <= value <= statistics.max for value in values)
+
+
+def _to_pandas(table):
+    # Nullable integer columns, so codes stay integers ('1', not '1.0', as text) where values are missing
+    pa = _pyarrow()
+    types = {pa.int16(): pd.Int16Dtype(), pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype()}
+    return table.to_pandas(types_mapper=types.get)
+
+
+def read_odin(dataset_path, columns=None, years=None, purposes=None, modes=None, postcodes=None):
+    """
+    Read the matching rows of the dataset; only the matching partitions and row groups are read.
+
+    Parameters:
+    dataset_path (str): The dataset directory.
+    columns (list, optional): The columns to read (default: all, with 'year' and 'MotiefV').
+    years, purposes, modes, postcodes: The filters of odin_filter.
+
+    Returns:
+    pd.DataFrame: The matching rows.
+    """
+    dataset = open_odin_dataset(dataset_path)
+    table = dataset.to_table(columns=columns, filter=odin_filter(years, purposes, modes, postcodes))
+    return _to_pandas(table)
+
+
+def iter_odin_batches(dataset_path, columns=None, years=None, purposes=None, modes=None, postcodes=None,
+                      batch_size=ROW_GROUP_SIZE):
+    """
+    Stream the matching rows of the dataset as DataFrames of at most batch_size rows, in bounded memory.
+
+    Yields:
+    pd.DataFrame: A batch of matching rows.
+    """
+    dataset = open_odin_dataset(dataset_path)
+    for batch in dataset.to_batches(columns=columns, filter=odin_filter(years, purposes, modes, postcodes),
+                                    batch_size=batch_size):
+        if batch.num_rows:
+            yield _to_pandas(batch)
@@ -0,0 +1,16 @@
+"""ODiN main modes of transport (Hvm) and the mode classes of the emission calculations."""
+
+# ODiN main mode (Hvm) -> emission factor class. Walking emits nothing; motorised two-wheelers and
+# 'other' have no factor in the WPM/WTW tables, so their emissions are left blank rather than guessed
+EMISSION_CLASS_BY_HVM = {
+    1: 'CAR', 12: 'CAR', 13: 'CAR', 14: 'CAR', 19: 'CAR', 21: 'CAR',
+    4: 'BICYCLE', 11: 'BICYCLE', 17: 'BICYCLE', 18: 'BICYCLE', 20: 'BICYCLE',
+    2: 'TRANSIT', 3: 'TRANSIT', 6: 'TRANSIT', 7: 'TRANSIT', 8: 'TRANSIT',
+    5: 'WALK',
+    9: 'OTHER', 10: 'OTHER', 15: 'OTHER', 22: 'OTHER', 23: 'OTHER', 24: 'OTHER',
+}
+EMISSION_CLASSES = ['CAR', 'BICYCLE', 'TRANSIT', 'WALK', 'OTHER']
+
+# Classes routed with OTP, under their OTP mode names; walking and the remaining modes are not routed
+ROUTED_CLASSES = ['CAR', 'BICYCLE', 'TRANSIT']
+ROUTING_MODE_BY_HVM = {hvm: mode for hvm, mode in EMISSION_CLASS_BY_HVM.items() if mode in ROUTED_CLASSES}
@@ -0,0 +1,55 @@
+"""Estimated commute distances between PC4 postcodes.
+
+The network distance of a commute between two postcodes is estimated as the
+straight-line distance between their centroids times a per-mode detour
+factor; commutes within one postcode area get a fixed distance. Distances
+are computed once per distinct (origin, destination) pair, so a roster or
+survey with many people on the same pair costs one calculation per pair.
+"""
+import numpy as np
+
+from utils.geodesy import andoyer_lambert_distance_km
+from utils.pc4_lookup import PC4_SIZE
+
+# Network distance over straight-line distance per emission class
+DETOUR_FACTORS = {'CAR': 1.3, 'BICYCLE': 1.25, 'TRANSIT': 1.4, 'WALK': 1.2, 'OTHER': 1.3}
+
+# Distance assumed for trips within one PC4 area, whose centroids coincide (km)
+INTRAZONAL_KM = 1.0
+
+
+def pair_keys(origins, destinations):
+    """
+    Combine origin and destination postcodes into one integer key per pair.
+
+    Returns:
+    np.ndarray: origin * PC4_SIZE + destination (-1 where either postcode is not a valid PC4).
+    """
+    origins = np.asarray(origins, dtype=float)
+    destinations = np.asarray(destinations, dtype=float)
+    valid = ((origins >= 0) & (origins < PC4_SIZE) & (destinations >= 0) & (destinations < PC4_SIZE)
+             & (origins == np.floor(origins)) & (destinations == np.floor(destinations)))
+    return np.where(valid, np.where(valid, origins, 0) * PC4_SIZE + np.where(valid, destinations, 0), -1).astype(np.int64)
+
+
+def straight_line_km(centroids, origins, destinations):
+    """
+    Straight-line distance between the centroids of postcode pairs, computed once per distinct pair.
+
+    Parameters:
+    centroids (PC4Centroids): The PC4 centroid lookup.
+    origins, destinations (array-like): PC4 postcodes.
+
+    Returns:
+    np.ndarray: Distances in km (INTRAZONAL_KM within one postcode, NaN for unknown postcodes).
+    """
+    keys, inverse = np.unique(pair_keys(origins, destinations), return_inverse=True)
+    valid = keys >= 0
+    origin_codes = np.where(valid, keys // PC4_SIZE, -1)
+    destination_codes = np.where(valid, keys % PC4_SIZE, -1)
+    o_lat, o_lon = centroids.coordinates(origin_codes)
+    d_lat, d_lon = centroids.coordinates(destination_codes)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        distance_km = andoyer_lambert_distance_km(o_lat, o_lon, d_lat, d_lon)
+    distance_km = np.where(valid & (origin_codes == destination_codes) & np.isfinite(o_lat), INTRAZONAL_KM, distance_km)
+    return np.asarray(distance_km, dtype=float)[inverse.ravel()]
@@ -0,0 +1,142 @@
+"""Dense, array-indexed lookup of PC4 postcode centroids and shapes.
+
+PC4 postcodes are 4-digit integers, so centroids are kept in two float arrays
+of length 10,000 indexed directly by postcode. Attaching coordinates to any
+number of trips is a single fancy-indexing operation instead of a merge.
+The parsed arrays are cached in a ``.centroids.npz`` file next to the georef
+CSV and reused until the CSV changes.
+"""
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Number of possible 4-digit postcodes (0000-9999)
+PC4_SIZE = 10000
+
+
+def _read_georef(file_path, columns):
+    # The raw OpenDataSoft export is ';'-separated, the cleaned copy is ','-separated
+    with open(file_path, encoding='utf-8') as georef_file:
+        delimiter = ';' if ';' in georef_file.readline() else ','
+    return pd.read_csv(file_path, delimiter=delimiter, usecols=columns)
+
+
+def _cache_path(file_path):
+    return os.path.splitext(file_path)[0] + '.centroids.npz'
+
+
+class PC4Centroids:
+    """
+    PC4 centroid coordinates in dense arrays indexed by postcode.
+
+    Parameters:
+    lat (np.ndarray): Latitude per postcode (NaN for unknown postcodes), length PC4_SIZE.
+    lon (np.ndarray): Longitude per postcode (NaN for unknown postcodes), length PC4_SIZE.
+    """
+
+    def __init__(self, lat, lon):
+        self.lat = lat
+        self.lon = lon
+
+    @classmethod
+    def from_georef(cls, file_path):
+        """
+        Parse the 'Geo Point' column of a georef CSV (raw or cleaned).
+
+        Parameters:
+        file_path (str): The path to the georef CSV.
+
+        Returns:
+        PC4Centroids: The centroid lookup.
+        """
+        df = _read_georef(file_path, ['PC4', 'Geo Point'])
+        points = df['Geo Point'].str.split(',', expand=True).astype(float)
+        codes = df['PC4'].to_numpy(dtype=np.int64)
+        lat = np.full(PC4_SIZE, np.nan)
+        lon = np.full(PC4_SIZE, np.nan)
+        lat[codes] = points[0].to_numpy()
+        lon[codes] = points[1].to_numpy()
+        return cls(lat, lon)
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Load the centroids from the ``.npz`` cache, rebuilding it if the CSV changed.
+
+        Parameters:
+        file_path (str): The path to the georef CSV.
+
+        Returns:
+        PC4Centroids: The centroid lookup.
+        """
+        stat = os.stat(file_path)
+        cache_path = _cache_path(file_path)
+        if os.path.exists(cache_path):
+            cache = np.load(cache_path)
+            if int(cache['source_mtime_ns']) == stat.st_mtime_ns and int(cache['source_size']) == stat.st_size:
+                return cls(cache['lat'], cache['lon'])
+        centroids = cls.from_georef(file_path)
+        centroids.save(cache_path, stat)
+        return centroids
+
+    def save(self, cache_path, source_stat):
+        np.savez(cache_path, lat=self.lat, lon=self.lon,
+                 source_mtime_ns=source_stat.st_mtime_ns, source_size=source_stat.st_size)
+
+    def coordinates(self, postcodes):
+        """
+        Look up the centroid of every postcode.
+
+        Parameters:
+        postcodes (array-like): PC4 codes (numbers or numeric strings; invalid values give NaN).
+
+        Returns:
+        tuple: (lat, lon) arrays aligned with ``postcodes``.
+        """
+        values = np.asarray(postcodes).ravel()
+        if values.dtype.kind in 'iuf':
+            codes = values.astype(float)
+        else:
+            codes = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=float)
+        valid = np.isfinite(codes) & (codes >= 0) & (codes < PC4_SIZE)
+        index = np.where(valid, codes, 0).astype(np.intp)
+        return np.where(valid, self.lat[index], np.nan), np.where(valid, self.lon[index], np.nan)
+
+    def attach(self, df, postcode_column, lat_column, lon_column):
+        """
+        Add centroid coordinate columns for a postcode column, in place.
+
+        Parameters:
+        df (pd.DataFrame): The dataset, e.g. refined commutes.
+        postcode_column (str): The PC4 column, e.g. 'OriginZipCode'.
+        lat_column (str): The name of the new latitude column.
+        lon_column (str): The name of the new longitude column.
+
+        Returns:
+        pd.DataFrame: The same DataFrame, for chaining.
+        """
+        df[lat_column], df[lon_column] = self.coordinates(df[postcode_column])
+        return df
+
+
+@lru_cache(maxsize=None)
+def load_pc4_centroids(file_path):
+    """Return the (process-wide cached) centroid lookup of a georef CSV."""
+    return PC4Centroids.load(os.path.abspath(file_path))
+
+
+@lru_cache(maxsize=None)
+def load_pc4_shapes(file_path):
+    """
+    Return the GeoJSON 'Geo Shape' strings of a georef CSV indexed by PC4 (cached per process).
+
+    Parameters:
+    file_path (str): The path to the georef CSV.
+
+    Returns:
+    pd.Series: GeoJSON polygon strings indexed by postcode.
+    """
+    df = _read_georef(os.path.abspath(file_path), ['PC4', 'Geo Shape'])
+    return df.set_index('PC4')['Geo Shape']
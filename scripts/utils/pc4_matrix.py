@@ -0,0 +1,286 @@
+"""Dense PC4 x PC4 network distance and duration matrices per mode.
+
+For every mode the matrix holds the network distance (km) and duration
+(minutes) between the centroids of all known postcodes, as float32 ``.npy``
+files that are memory-mapped when opened, so a lookup touches only the
+entries it needs. An index array of length PC4_SIZE maps a postcode to its
+row and column, which makes looking up any number of commutes a single
+fancy-indexing operation.
+
+Entries come from routing between centroids where a route is available; the
+others are filled with the straight-line distance times a detour factor and
+a speed calibrated per distance band on the routed entries. A source matrix
+records which entries were routed.
+
+Files, for a store path ``<path>``: ``<path>.index.npy`` (row per postcode,
+-1 for unknown postcodes), ``<path>.<MODE>.distance_km.npy``,
+``<path>.<MODE>.duration_min.npy``, ``<path>.<MODE>.source.npy`` and the
+calibration in ``<path>.json``.
+"""
+import json
+import os
+
+import numpy as np
+
+from utils.geodesy import andoyer_lambert_distance_km
+from utils.od_sampling import MEDIUM_MAX_KM, SHORT_MAX_KM
+from utils.pc4_distance import DETOUR_FACTORS, INTRAZONAL_KM
+from utils.pc4_lookup import PC4_SIZE
+
+# Values of the source matrices
+MISSING, ROUTED, ESTIMATED = 0, 1, 2
+
+# Distance bands over which detour factors and speeds are calibrated
+BANDS = ['short', 'medium', 'long']
+
+# Origin rows filled at a time
+FILL_BLOCK_ROWS = 256
+
+
+def _index_path(path):
+    return path + '.index.npy'
+
+
+def _matrix_path(path, mode, quantity):
+    return f"{path}.{mode}.{quantity}.npy"
+
+
+def _band_index(straight_km):
+    # Position in BANDS, with the bounds of distance_band
+    return np.where(straight_km < SHORT_MAX_KM, 0, np.where(straight_km <= MEDIUM_MAX_KM, 1, 2))
+
+
+def calibrate(straight_km, network_km, duration_min, mode):
+    """
+    Calibrate the detour factor and speed of a mode per distance band on routed entries.
+
+    Parameters:
+    straight_km, network_km, duration_min (np.ndarray): The straight-line distance, routed distance and
+        routed duration of the routed entries.
+    mode (str): The mode, whose DETOUR_FACTORS entry is used where nothing was routed.
+
+    Returns:
+    dict: Per band the median 'detour' and 'speed_kmh' and the number of 'routed' entries. Bands without
+    routed entries take the mode's overall medians (the speed is None if nothing was routed).
+    """
+    straight_km, network_km, duration_min = (np.asarray(values, dtype=float)
+                                             for values in (straight_km, network_km, duration_min))
+    usable = (straight_km > 0) & (network_km > 0) & (duration_min > 0)
+    bands = _band_index(straight_km)
+    detour = network_km / np.where(usable, straight_km, np.nan)
+    speed = network_km / np.where(usable, duration_min, np.nan) * 60
+
+    def medians(mask):
+        if not mask.any():
+            return None, None
+        return float(np.median(detour[mask])), float(np.median(speed[mask]))
+
+    overall_detour, overall_speed = medians(usable)
+    calibration = {}
+    for position, band in enumerate(BANDS):
+        band_detour, band_speed = medians(usable & (bands == position))
+        calibration[band] = {
+            'detour': band_detour if band_detour is not None else (overall_detour or DETOUR_FACTORS.get(mode, DETOUR_FACTORS['OTHER'])),
+            'speed_kmh': band_speed if band_speed is not None else overall_speed,
+            'routed': int((usable & (bands == position)).sum()),
+        }
+    return calibration
+
+
+class PC4MatrixWriter:
+    """
+    Builds the matrices of a store; the files replace the old store when it is closed.
+
+    Parameters:
+    path (str): The store path (without suffixes).
+    centroids (PC4Centroids): The PC4 centroid lookup; every postcode with a centroid gets a row.
+    modes (list): The routing modes, e.g. ['CAR', 'BICYCLE', 'TRANSIT'].
+    """
+
+    def __init__(self, path, centroids, modes):
+        self.path = path
+        self.modes = list(modes)
+        self.postcodes = np.flatnonzero(np.isfinite(centroids.lat) & np.isfinite(centroids.lon))
+        self.position = np.full(PC4_SIZE, -1, dtype=np.int32)
+        self.position[self.postcodes] = np.arange(len(self.postcodes))
+        self.lat = centroids.lat[self.postcodes]
+        self.lon = centroids.lon[self.postcodes]
+        self.calibration = {}
+
+        size = len(self.postcodes)
+        self._matrices = {}
+        for mode in self.modes:
+            for quantity, dtype, fill in [('distance_km', np.float32, np.nan), ('duration_min', np.float32, np.nan),
+                                          ('source', np.uint8, MISSING)]:
+                matrix = np.lib.format.open_memmap(_matrix_path(path, mode, quantity) + '.tmp', mode='w+',
+                                                   dtype=dtype, shape=(size, size))
+                matrix[:] = fill
+                self._matrices[mode, quantity] = matrix
+
+    def straight_km(self, rows, columns):
+        """Straight-line centroid distance between matrix rows and columns (INTRAZONAL_KM on the diagonal)."""
+        rows, columns = np.broadcast_arrays(np.asarray(rows), np.asarray(columns))
+        with np.errstate(invalid='ignore'):
+            distance_km = andoyer_lambert_distance_km(self.lat[rows], self.lon[rows], self.lat[columns], self.lon[columns])
+        return np.where(rows == columns, INTRAZONAL_KM, distance_km)
+
+    def set_routed(self, mode, origins, destinations, distance_km, duration_min):
+        """
+        Store routed entries.
+
+        Parameters:
+        mode (str): The routing mode.
+        origins, destinations (array-like): PC4 postcodes (pairs of postcodes without a row are ignored).
+        distance_km, duration_min (array-like): The routed distance and duration.
+        """
+        rows = self.position[np.asarray(origins, dtype=np.int64)]
+        columns = self.position[np.asarray(destinations, dtype=np.int64)]
+        known = (rows >= 0) & (columns >= 0)
+        rows, columns = rows[known], columns[known]
+        self._matrices[mode, 'distance_km'][rows, columns] = np.asarray(distance_km, dtype=float)[known]
+        self._matrices[mode, 'duration_min'][rows, columns] = np.asarray(duration_min, dtype=float)[known]
+        self._matrices[mode, 'source'][rows, columns] = ROUTED
+
+    def fill(self, mode):
+        """
+        Calibrate the mode on its routed entries and estimate all the others.
+
+        Returns:
+        dict: The calibration (see ``calibrate``).
+        """
+        distance, duration, source = (self._matrices[mode, quantity] for quantity in ('distance_km', 'duration_min', 'source'))
+        # Centroid to centroid routes within one postcode say nothing about the detour of a commute
+        rows, columns = np.nonzero(source[:] == ROUTED)
+        rows, columns = rows[rows != columns], columns[rows != columns]
+        calibration = calibrate(self.straight_km(rows, columns), distance[rows, columns], duration[rows, columns], mode)
+        self.calibration[mode] = calibration
+        detour = np.array([calibration[band]['detour'] for band in BANDS])
+        speed = np.array([np.nan if calibration[band]['speed_kmh'] is None else calibration[band]['speed_kmh'] for band in BANDS])
+
+        # Row blocks keep the working arrays small; routed entries are left as they are
+        columns = np.arange(len(self.postcodes))
+        for start in range(0, len(self.postcodes), FILL_BLOCK_ROWS):
+            block = slice(start, min(start + FILL_BLOCK_ROWS, len(self.postcodes)))
+            straight_km = self.straight_km(columns[block, None], columns[None, :])
+            band = _band_index(straight_km)
+            estimated_km = straight_km * detour[band]
+            estimate = source[block] != ROUTED
+            distance[block] = np.where(estimate, estimated_km, distance[block])
+            duration[block] = np.where(estimate, estimated_km / speed[band] * 60, duration[block])
+            source[block] = np.where(estimate, ESTIMATED, source[block])
+        return calibration
+
+    def close(self):
+        for matrix in self._matrices.values():
+            matrix.flush()
+        self._matrices.clear()
+        for mode in self.modes:
+            for quantity in ('distance_km', 'duration_min', 'source'):
+                os.replace(_matrix_path(self.path, mode, quantity) + '.tmp', _matrix_path(self.path, mode, quantity))
+        np.save(_index_path(self.path), self.position)
+        with open(self.path + '.json', 'w') as calibration_file:
+            json.dump({'postcodes': len(self.postcodes), 'modes': self.modes, 'calibration': self.calibration},
+                      calibration_file, indent=4)
+
+    def abort(self):
+        """Discard the partly written matrices, leaving an existing store in place."""
+        self._matrices.clear()
+        for mode in self.modes:
+            for quantity in ('distance_km', 'duration_min', 'source'):
+                temporary_path = _matrix_path(self.path, mode, quantity) + '.tmp'
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # An interrupted or failed build must not replace the previous matrices
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class PC4Matrix:
+    """
+    Read-only, memory-mapped view of the matrices of a store.
+
+    Parameters:
+    path (str): The store path (without suffixes).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + '.json') as calibration_file:
+            metadata = json.load(calibration_file)
+        self.modes = metadata['modes']
+        self.calibration = metadata['calibration']
+        self.position = np.load(_index_path(path))
+        self._matrices = {}
+
+    @staticmethod
+    def exists(path):
+        """Return whether a complete store exists at a path."""
+        return os.path.exists(path + '.json') and os.path.exists(_index_path(path))
+
+    def matrix(self, mode, quantity):
+        """Return the memory-mapped 'distance_km', 'duration_min' or 'source' matrix of a mode."""
+        if (mode, quantity) not in self._matrices:
+            self._matrices[mode, quantity] = np.load(_matrix_path(self.path, mode, quantity), mmap_mode='r')
+        return self._matrices[mode, quantity]
+
+    def _cells(self, origins, destinations):
+        origins = np.asarray(origins, dtype=float)
+        destinations = np.asarray(destinations, dtype=float)
+        valid = ((origins >= 0) & (origins < PC4_SIZE) & (destinations >= 0) & (destinations < PC4_SIZE))
+        rows = self.position[np.where(valid, origins, 0).astype(np.intp)]
+        columns = self.position[np.where(valid, destinations, 0).astype(np.intp)]
+        found = valid & (rows >= 0) & (columns >= 0)
+        return np.where(found, rows, 0), np.where(found, columns, 0), found
+
+    def lookup(self, mode, origins, destinations, quantity='distance_km'):
+        """
+        Look up the entries of postcode pairs.
+
+        Parameters:
+        mode (str): The routing mode.
+        origins, destinations (array-like): PC4 postcodes.
+        quantity (str): 'distance_km', 'duration_min' or 'source'.
+
+        Returns:
+        np.ndarray: The entries as float64 (NaN for unknown postcodes; MISSING sources for them).
+        """
+        rows, columns, found = self._cells(origins, destinations)
+        values = self.matrix(mode, quantity)[rows, columns]
+        if quantity == 'source':
+            return np.where(found, values, MISSING)
+        return np.where(found, values, np.nan)
+
+    def network_km(self, modes, origins, destinations, fallback_km):
+        """
+        Network distance of commutes, from the matrix of their mode where it has one.
+
+        Parameters:
+        modes (array-like): The mode (emission class) of every commute, e.g. 'CAR' or 'WALK'.
+        origins, destinations (array-like): PC4 postcodes.
+        fallback_km (array-like): The distance used for modes without a matrix and unknown postcodes.
+
+        Returns:
+        np.ndarray: The distances in km.
+        """
+        modes = np.asarray(modes)
+        origins = np.asarray(origins, dtype=float)
+        destinations = np.asarray(destinations, dtype=float)
+        distance_km = np.array(fallback_km, dtype=float)
+        for mode in self.modes:
+            selected = np.flatnonzero(modes == mode)
+            if len(selected):
+                found = self.lookup(mode, origins[selected], destinations[selected])
+                distance_km[selected] = np.where(np.isfinite(found), found, distance_km[selected])
+        return distance_km
+
+
+def open_pc4_matrix(path):
+    """Open the matrices at a store path, or return None when they have not been built."""
+    return PC4Matrix(path) if PC4Matrix.exists(path) else None
@@ -0,0 +1,310 @@
+"""Content-hash-aware runner for the analysis stages.
+
+Each stage is the entry-point function of an importable script together with
+the files it reads, the files it writes and its keyword parameters. The
+dependencies between stages follow from their files: a stage depends on the
+stage that last declared one of its inputs as an output. A stage is skipped
+when the content of its inputs, its parameters, its code and its outputs are
+unchanged since its last successful run; otherwise it is run as soon as its
+dependencies finished, so independent branches run concurrently in worker
+processes. The fingerprints are kept in a JSON state file.
+"""
+import hashlib
+import importlib
+import importlib.util
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+
+from utils import instrumentation
+from utils.figure_jobs import file_hash
+
+# Matches 'from utils.x import ...' and 'import utils.x'
+UTILS_IMPORT = re.compile(r'^\s*(?:from|import)\s+utils\.(\w+)', re.MULTILINE)
+
+
+class Stage:
+    """
+    One pipeline stage: a script entry point with its declared files.
+
+    Parameters:
+    name (str): The unique name of the stage.
+    module (str): The importable script, e.g. '3_OTP_routing'.
+    inputs (list): The files the stage reads.
+    outputs (list): The files the stage writes.
+    function (str): The entry point in the module.
+    params (dict, optional): Keyword arguments passed to the entry point.
+    optional_inputs (list, optional): Files the stage reads when they exist; a change, appearance or
+        removal makes the stage stale, but a missing one does not stop it.
+    """
+
+    def __init__(self, name, module, inputs, outputs, function='main', params=None, optional_inputs=None):
+        self.name = name
+        self.module = module
+        self.inputs = [os.path.abspath(path) for path in inputs]
+        self.optional_inputs = [os.path.abspath(path) for path in optional_inputs or []]
+        self.outputs = [os.path.abspath(path) for path in outputs]
+        self.function = function
+        self.params = dict(params or {})
+
+    def code_version(self):
+        """Hash of the script and of the ``utils`` modules it imports (found without importing them)."""
+        digest = hashlib.sha256(self.function.encode())
+        for source_file in sorted(_source_files(self.module)):
+            digest.update(file_hash(source_file).encode())
+        return digest.hexdigest()
+
+
+def _source_files(module_name):
+    # The script file plus, transitively, every utils module imported by it
+    source_files = set()
+    pending = [importlib.util.find_spec(module_name).origin]
+    while pending:
+        source_file = pending.pop()
+        if source_file in source_files:
+            continue
+        source_files.add(source_file)
+        with open(source_file, encoding='utf-8') as source:
+            helpers = UTILS_IMPORT.findall(source.read())
+        pending.extend(importlib.util.find_spec(f'utils.{helper}').origin for helper in helpers)
+    return source_files
+
+
+class FileHashes:
+    """
+    Content hashes of files, reused while a file's size and modification time are unchanged.
+
+    Parameters:
+    cache (dict): Path -> {'mtime_ns', 'size', 'sha256'}, as stored in the state file.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = dict(cache or {})
+
+    def get(self, path):
+        """Return the SHA-256 of a file's content, or None if it does not exist."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        entry = self.cache.get(path)
+        if entry is None or entry['mtime_ns'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+            entry = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': file_hash(path)}
+            self.cache[path] = entry
+        return entry['sha256']
+
+
+def _run_stage(module_name, function_name, params, stage_name=None):
+    """Worker entry point: import a stage script and call its entry point."""
+    module = importlib.import_module(module_name)
+    started = time.perf_counter()
+    with instrumentation.stage(stage_name or module_name):
+        getattr(module, function_name)(**params)
+    return time.perf_counter() - started
+
+
+def _run_inline(module_name, function_name, params, stage_name=None):
+    # Run in the current process but report through a Future, like a worker would
+    future = Future()
+    try:
+        future.set_result(_run_stage(module_name, function_name, params, stage_name))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+class Pipeline:
+    """
+    Ordered registry of stages with a state file of their last successful runs.
+
+    Parameters:
+    state_path (str): The JSON file recording stage fingerprints and file hashes.
+    """
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.stages = {}
+
+    def add(self, name, module, inputs, outputs, function='main', params=None, optional_inputs=None):
+        """Register a stage; stages must be added in a valid execution order."""
+        self.stages[name] = Stage(name, module, inputs, outputs, function, params, optional_inputs)
+        return self.stages[name]
+
+    def dependencies(self):
+        """
+        Derive the stage graph from the declared files.
+
+        Returns:
+        dict: Stage name -> set of the stages producing its inputs.
+        """
+        producers = {}
+        dependencies = {}
+        for name, stage in self.stages.items():
+            dependencies[name] = {producers[path] for path in stage.inputs + stage.optional_inputs if path in producers}
+            for path in stage.outputs:
+                producers[path] = name
+        return dependencies
+
+    def _with_dependencies(self, names, dependencies):
+        selected = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage '{name}'. Available stages: {', '.join(self.stages)}")
+            if name not in selected:
+                selected.add(name)
+                pending.extend(dependencies[name])
+        return [name for name in self.stages if name in selected]
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as state_file:
+                return json.load(state_file)
+        return {'stages': {}, 'files': {}}
+
+    def _save_state(self, state, hashes):
+        state['files'] = hashes.cache
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        temporary_path = f"{self.state_path}.tmp"
+        with open(temporary_path, 'w') as state_file:
+            json.dump(state, state_file, indent=2, sort_keys=True)
+        os.replace(temporary_path, self.state_path)
+
+    def fingerprint(self, stage, hashes):
+        """Hash of a stage's code, parameters and current input contents (None if an input is missing)."""
+        digest = hashlib.sha256(stage.code_version().encode())
+        digest.update(json.dumps(stage.params, sort_keys=True, default=repr).encode())
+        for path in stage.inputs:
+            content_hash = hashes.get(path)
+            if content_hash is None:
+                return None
+            digest.update(content_hash.encode())
+        for path in stage.optional_inputs:
+            digest.update((hashes.get(path) or 'absent').encode())
+        return digest.hexdigest()
+
+    def _is_current(self, stage, fingerprint, state, hashes):
+        last_run = state['stages'].get(stage.name)
+        if last_run is None or last_run['fingerprint'] != fingerprint:
+            return False
+        # Outputs that were deleted or overwritten since the last run make the stage stale
+        return all(hashes.get(path) is not None and hashes.get(path) == last_run['outputs'].get(path)
+                   for path in stage.outputs)
+
+    def status(self, names=None):
+        """
+        Report which stages are current given the files on disk now.
+
+        Parameters:
+        names (list, optional): The stages to report (default: all).
+
+        Returns:
+        dict: Stage name -> 'current', 'stale' or 'missing inputs'.
+        """
+        state = self._load_state()
+        hashes = FileHashes(state.get('files'))
+        report = {}
+        for name in names or self.stages:
+            stage = self.stages[name]
+            fingerprint = self.fingerprint(stage, hashes)
+            if fingerprint is None:
+                report[name] = 'missing inputs'
+            else:
+                report[name] = 'current' if self._is_current(stage, fingerprint, state, hashes) else 'stale'
+        return report
+
+    def run(self, names=None, force=False, workers=None, with_dependencies=True):
+        """
+        Bring the selected stages and everything they depend on up to date.
+
+        Parameters:
+        names (list, optional): The target stages (default: all).
+        force (bool): Run the selected stages even when they are current.
+        workers (int, optional): The number of concurrent worker processes (default: all CPUs).
+        with_dependencies (bool): Also update the stages the targets depend on; if False the
+            targets run on the files currently on disk (e.g. without an OTP server for routing).
+
+        Returns:
+        dict: Stage name -> 'ran', 'skipped', 'failed' or 'blocked'.
+        """
+        dependencies = self.dependencies()
+        selected = self._with_dependencies(names or list(self.stages), dependencies)
+        if not with_dependencies and names:
+            selected = [name for name in selected if name in names]
+        state = self._load_state()
+        hashes = FileHashes(state.get('files'))
+        workers = workers or os.cpu_count() or 1
+
+        status = {}
+        pending = list(selected)
+        running = {}
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            while pending or running:
+                # Start every stage whose dependencies are settled; inputs are final at this point
+                for name in list(pending):
+                    if not all(dependency in status for dependency in dependencies[name] if dependency in selected):
+                        continue
+                    pending.remove(name)
+                    stage = self.stages[name]
+                    if any(status.get(dependency) in ('failed', 'blocked') for dependency in dependencies[name]):
+                        status[name] = 'blocked'
+                        logging.warning("Stage %s blocked by a failed dependency.", name)
+                        continue
+                    fingerprint = self.fingerprint(stage, hashes)
+                    if fingerprint is None:
+                        status[name] = 'failed'
+                        missing = [path for path in stage.inputs if hashes.get(path) is None]
+                        logging.error("Stage %s is missing inputs: %s", name, ', '.join(missing))
+                        continue
+                    if not force and self._is_current(stage, fingerprint, state, hashes):
+                        status[name] = 'skipped'
+                        logging.info("Stage %s is up to date, skipping.", name)
+                        continue
+                    logging.info("Running stage %s (%s.%s)", name, stage.module, stage.function)
+                    if executor is None:
+                        future = _run_inline(stage.module, stage.function, stage.params, stage.name)
+                    else:
+                        future = executor.submit(_run_stage, stage.module, stage.function, stage.params, stage.name)
+                    running[future] = (name, fingerprint)
+
+                if not running:
+                    if pending:
+                        raise RuntimeError(f"Stages registered out of order: {', '.join(pending)}")
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, fingerprint = running.pop(future)
+                    stage = self.stages[name]
+                    try:
+                        seconds = future.result()
+                    except Exception as e:
+                        status[name] = 'failed'
+                        state['stages'].pop(name, None)
+                        logging.error("Stage %s failed: %s", name, e)
+                    else:
+                        missing = [path for path in stage.outputs if hashes.get(path) is None]
+                        if missing:
+                            status[name] = 'failed'
+                            state['stages'].pop(name, None)
+                            logging.error("Stage %s did not write: %s", name, ', '.join(missing))
+                        else:
+                            status[name] = 'ran'
+                            state['stages'][name] = {
+                                'fingerprint': fingerprint,
+                                'outputs': {path: hashes.get(path) for path in stage.outputs},
+                                'finished_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                                'seconds': round(seconds, 3)
+                            }
+                            logging.info("Stage %s finished in %.1fs", name, seconds)
+                    # Record progress after every stage so an interrupted run resumes where it stopped
+                    self._save_state(state, hashes)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        self._save_state(state, hashes)
+        return status
@@ -0,0 +1,253 @@
+"""Bootstrap confidence intervals and permutation p-values for the hypothesis tests.
+
+Resamples are drawn as NumPy index (or sign) matrices, a bounded number of
+rows at a time, and the resample budget is spread over a process pool.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Upper bound on the size of one index matrix held in memory by a worker
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+
+# Number of independent random streams the resamples are split into; fixed so that a
+# seeded run gives the same result whatever the number of workers
+N_TASKS = 32
+
+
+# Row-wise statistics on resampled matrices (one resample per row)
+def _row_means(matrix):
+    return matrix.mean(axis=1)
+
+
+def _row_variances(matrix):
+    return matrix.var(axis=1, ddof=1)
+
+
+def _f_statistic(group_matrices):
+    counts = np.array([m.shape[1] for m in group_matrices], dtype=float)
+    means = np.column_stack([_row_means(m) for m in group_matrices])
+    within = sum(((m - means[:, [g]]) ** 2).sum(axis=1) for g, m in enumerate(group_matrices))
+    grand = means @ counts / counts.sum()
+    between = ((means - grand[:, None]) ** 2) @ counts
+    dfn, dfd = len(group_matrices) - 1, counts.sum() - len(group_matrices)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (between / dfn) / (within / dfd)
+
+
+def _split_columns(matrix, sizes):
+    return np.split(matrix, np.cumsum(sizes)[:-1], axis=1)
+
+
+# Observed statistics
+def _observed_paired_mean_difference(a, b):
+    return np.mean(a - b)
+
+
+def _observed_mean_difference(a, b):
+    return np.mean(a) - np.mean(b)
+
+
+def _observed_anova_f(*groups):
+    return _f_statistic([np.asarray(g)[None, :] for g in groups])[0]
+
+
+def _observed_variance_ratio(a, b):
+    return np.var(a, ddof=1) / np.var(b, ddof=1)
+
+
+def _observed_pearson_r(x, y):
+    return np.corrcoef(x, y)[0, 1]
+
+
+# Bootstrap chunks: resample with replacement within each sample
+def _bootstrap_paired_mean_difference(rng, rows, a, b):
+    diff = a - b
+    return _row_means(diff[rng.integers(0, len(diff), size=(rows, len(diff)))])
+
+
+def _bootstrap_mean_difference(rng, rows, a, b):
+    return (_row_means(a[rng.integers(0, len(a), size=(rows, len(a)))])
+            - _row_means(b[rng.integers(0, len(b), size=(rows, len(b)))]))
+
+
+def _bootstrap_anova_f(rng, rows, *groups):
+    return _f_statistic([g[rng.integers(0, len(g), size=(rows, len(g)))] for g in groups])
+
+
+def _bootstrap_variance_ratio(rng, rows, a, b):
+    return (_row_variances(a[rng.integers(0, len(a), size=(rows, len(a)))])
+            / _row_variances(b[rng.integers(0, len(b), size=(rows, len(b)))]))
+
+
+def _bootstrap_pearson_r(rng, rows, x, y):
+    index = rng.integers(0, len(x), size=(rows, len(x)))
+    xs, ys = x[index], y[index]
+    xs = xs - xs.mean(axis=1, keepdims=True)
+    ys = ys - ys.mean(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (xs * ys).sum(axis=1) / np.sqrt((xs ** 2).sum(axis=1) * (ys ** 2).sum(axis=1))
+
+
+# Permutation chunks: resample under the null hypothesis
+def _permutation_matrix(rng, rows, n):
+    return np.stack([rng.permutation(n) for _ in range(rows)])
+
+
+def _subset_matrix(rng, rows, n, k):
+    # Indices of the first group of a random split; cheaper than a full permutation
+    return np.stack([rng.choice(n, k, replace=False, shuffle=False) for _ in range(rows)])
+
+
+def _split_sums(rng, rows, pooled, n_first):
+    """Row-wise sum and sum of squares of a random n_first-subset and of its complement."""
+    n = len(pooled)
+    k = min(n_first, n - n_first)
+    subset = pooled[_subset_matrix(rng, rows, n, k)]
+    sums, squares = subset.sum(axis=1), (subset ** 2).sum(axis=1)
+    rest_sums, rest_squares = pooled.sum() - sums, (pooled ** 2).sum() - squares
+    if k == n_first:
+        return (sums, squares), (rest_sums, rest_squares)
+    return (rest_sums, rest_squares), (sums, squares)
+
+
+def _variance_from_sums(sums, squares, n):
+    return (squares - sums ** 2 / n) / (n - 1)
+
+
+def _permute_paired_mean_difference(rng, rows, a, b):
+    # Under H0 the sign of every paired difference is exchangeable
+    diff = a - b
+    signs = rng.integers(0, 2, size=(rows, len(diff))) * 2.0 - 1.0
+    return signs @ diff / len(diff)
+
+
+def _permute_mean_difference(rng, rows, a, b):
+    (first, _), (second, _) = _split_sums(rng, rows, np.concatenate([a, b]), len(a))
+    return first / len(a) - second / len(b)
+
+
+def _permute_anova_f(rng, rows, *groups):
+    pooled = np.concatenate(groups)
+    shuffled = pooled[_permutation_matrix(rng, rows, len(pooled))]
+    return _f_statistic(_split_columns(shuffled, [len(g) for g in groups]))
+
+
+def _permute_variance_ratio(rng, rows, a, b):
+    # Centre each group so that only the spread is exchanged between groups
+    pooled = np.concatenate([a - a.mean(), b - b.mean()])
+    first, second = _split_sums(rng, rows, pooled, len(a))
+    return _variance_from_sums(*first, len(a)) / _variance_from_sums(*second, len(b))
+
+
+def _permute_pearson_r(rng, rows, x, y):
+    xc, yc = x - x.mean(), y - y.mean()
+    denominator = np.sqrt((xc ** 2).sum() * (yc ** 2).sum())
+    return (yc[_permutation_matrix(rng, rows, len(yc))] @ xc) / denominator
+
+
+# name: (observed, bootstrap chunk, permutation chunk, default alternative)
+STATISTICS = {
+    'paired_mean_difference': (_observed_paired_mean_difference, _bootstrap_paired_mean_difference,
+                               _permute_paired_mean_difference, 'two-sided'),
+    'mean_difference': (_observed_mean_difference, _bootstrap_mean_difference,
+                        _permute_mean_difference, 'two-sided'),
+    'anova_f': (_observed_anova_f, _bootstrap_anova_f, _permute_anova_f, 'greater'),
+    'variance_ratio': (_observed_variance_ratio, _bootstrap_variance_ratio, _permute_variance_ratio, 'greater'),
+    'pearson_r': (_observed_pearson_r, _bootstrap_pearson_r, _permute_pearson_r, 'two-sided'),
+}
+
+
+def _resample_task(task):
+    """Worker entry point: draw ``n_resamples`` statistics in memory-bounded chunks."""
+    statistic, kind, samples, n_resamples, seed, chunk_bytes = task
+    chunk_function = STATISTICS[statistic][1 if kind == 'bootstrap' else 2]
+    rng = np.random.default_rng(seed)
+    # Every resample row indexes all observations once (8 bytes per index)
+    rows_per_chunk = max(1, chunk_bytes // (8 * sum(len(s) for s in samples)))
+    results = []
+    remaining = n_resamples
+    while remaining > 0:
+        rows = min(rows_per_chunk, remaining)
+        results.append(chunk_function(rng, rows, *samples))
+        remaining -= rows
+    return np.concatenate(results)
+
+
+def resample_statistic(statistic, samples, kind, n_resamples=10000, seed=None, workers=None,
+                       chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Draw the resampling distribution of a test statistic.
+
+    Parameters:
+    statistic (str): One of the keys of ``STATISTICS``.
+    samples (tuple): The arrays the statistic is computed from.
+    kind (str): 'bootstrap' or 'permutation'.
+    n_resamples (int): The number of resamples.
+    seed (int, optional): The seed, for reproducible results.
+    workers (int, optional): The number of worker processes (default: all CPUs).
+    chunk_bytes (int): The maximum size of the index matrix of one chunk.
+
+    Returns:
+    np.ndarray: The statistic evaluated on every resample.
+    """
+    samples = tuple(np.asarray(s, dtype=float) for s in samples)
+    workers = workers or os.cpu_count() or 1
+    n_tasks = min(n_resamples, N_TASKS)
+    sizes = np.full(n_tasks, n_resamples // n_tasks)
+    sizes[:n_resamples % n_tasks] += 1
+    seeds = np.random.SeedSequence(seed).spawn(n_tasks)
+    tasks = [(statistic, kind, samples, int(size), s, chunk_bytes) for size, s in zip(sizes, seeds)]
+    if workers == 1:
+        return np.concatenate([_resample_task(task) for task in tasks])
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return np.concatenate(list(executor.map(_resample_task, tasks)))
+
+
+def bootstrap_ci(statistic, samples, n_resamples=10000, confidence=0.95, **kwargs):
+    """
+    Percentile bootstrap confidence interval for a test statistic.
+
+    Parameters:
+    statistic (str): One of the keys of ``STATISTICS``.
+    samples (tuple): The arrays the statistic is computed from.
+    n_resamples (int): The number of bootstrap resamples.
+    confidence (float): The confidence level of the interval.
+
+    Returns:
+    tuple: (observed statistic, lower bound, upper bound).
+    """
+    observed = STATISTICS[statistic][0](*samples)
+    distribution = resample_statistic(statistic, samples, 'bootstrap', n_resamples, **kwargs)
+    alpha = (1 - confidence) / 2
+    low, high = np.nanquantile(distribution, [alpha, 1 - alpha])
+    return observed, low, high
+
+
+def permutation_p_value(statistic, samples, n_resamples=10000, alternative=None, **kwargs):
+    """
+    Monte Carlo permutation p-value for a test statistic.
+
+    Parameters:
+    statistic (str): One of the keys of ``STATISTICS``.
+    samples (tuple): The arrays the statistic is computed from.
+    n_resamples (int): The number of permutations.
+    alternative (str, optional): 'two-sided', 'greater' or 'less' (default depends on the statistic).
+
+    Returns:
+    tuple: (observed statistic, p-value).
+    """
+    observed_function, _, _, default_alternative = STATISTICS[statistic]
+    observed = observed_function(*samples)
+    distribution = resample_statistic(statistic, samples, 'permutation', n_resamples, **kwargs)
+    alternative = alternative or default_alternative
+    # Small tolerance so that ties with the observed value count as extreme
+    tolerance = 1e-12 * max(1.0, abs(observed))
+    if alternative == 'two-sided':
+        extreme = np.abs(distribution) >= abs(observed) - tolerance
+    elif alternative == 'greater':
+        extreme = distribution >= observed - tolerance
+    else:
+        extreme = distribution <= observed + tolerance
+    return observed, (np.count_nonzero(extreme) + 1) / (n_resamples + 1)
@@ -0,0 +1,217 @@
+"""Approximate reuse of OTP itineraries for nearby origin-destination pairs.
+
+Origins and destinations are snapped to a square grid in a local
+equirectangular projection of the Netherlands; a request whose origin cell,
+destination cell and mode (plus the time of day for transit, whose itineraries
+depend on the timetable) match an earlier one is served the cached itinerary
+instead of a new OTP query. Every mode has its own cell size: a car route is
+barely affected by moving the origin 300 m, a walk to a different stop can
+change a transit trip completely.
+
+Served itineraries are corrected for the displacement of the endpoints: the
+change in straight-line access and egress distance (or OD distance for single
+leg trips) times a detour factor is added to the first and last legs, and
+their durations follow at the leg's own speed. The geometries are kept.
+
+A share of the cache hits is also routed exactly (``validation_rate``); the
+report compares those with the served itineraries, so the accuracy lost is
+stated next to the number of OTP queries saved.
+"""
+import copy
+import math
+import random
+
+from utils.geodesy import geodesic_distance_km
+from utils.running_stats import RunningStatistics
+
+# Grid cell size per routed mode (metres)
+DEFAULT_CELL_SIZE_M = {'CAR': 500, 'BICYCLE': 250, 'TRANSIT': 150}
+
+# Modes whose itineraries depend on the departure time
+TIME_SENSITIVE_MODES = ('TRANSIT',)
+
+# Network distance over straight-line distance, used for the endpoint correction
+DETOUR_FACTOR = 1.3
+
+# Projection reference latitude (the middle of the Netherlands) and metres per degree of latitude
+REFERENCE_LATITUDE = 52.1
+METRES_PER_DEGREE = 111320.0
+
+
+def _distance_km(lat1, lon1, lat2, lon2):
+    return float(geodesic_distance_km(lat1, lon1, lat2, lon2))
+
+
+class GridSnapper:
+    """
+    Snaps coordinates to square cells of a local equirectangular grid.
+
+    Parameters:
+    cell_size_m (float): The cell size in metres.
+    """
+
+    def __init__(self, cell_size_m):
+        self.cell_size_m = cell_size_m
+        self._lat_step = cell_size_m / METRES_PER_DEGREE
+        self._lon_step = cell_size_m / (METRES_PER_DEGREE * math.cos(math.radians(REFERENCE_LATITUDE)))
+
+    def cell(self, lat, lon):
+        return (math.floor(lat / self._lat_step), math.floor(lon / self._lon_step))
+
+
+def _correct_leg(leg, delta_km):
+    # Lengthen or shorten a leg, keeping its speed (or assuming walking speed for an empty leg)
+    distance_m = leg['distance']
+    speed = leg['duration'] / distance_m if distance_m > 0 else 3600 / 4800
+    leg['distance'] = max(distance_m + delta_km * 1000, 0.0)
+    leg['duration'] = leg['distance'] * speed
+
+
+def correct_endpoints(route, cached_endpoints, endpoints, detour_factor=DETOUR_FACTOR):
+    """
+    Adjust a cached itinerary for moved origin and destination points.
+
+    Parameters:
+    route (dict): The cached OTP response (not modified).
+    cached_endpoints (tuple): (origin lat, origin lon, destination lat, destination lon) it was routed for.
+    endpoints (tuple): The requested (origin lat, origin lon, destination lat, destination lon).
+    detour_factor (float): Network distance over straight-line distance.
+
+    Returns:
+    dict: A corrected copy of the response.
+    """
+    route = copy.deepcopy(route)
+    legs = route['plan']['itineraries'][0]['legs']
+    o_lat, o_lon, d_lat, d_lon = endpoints
+    c_o_lat, c_o_lon, c_d_lat, c_d_lon = cached_endpoints
+    first, last = legs[0], legs[-1]
+    has_stops = all(key in first['to'] and key in last['from'] for key in ('lat', 'lon'))
+
+    if len(legs) == 1 or not has_stops:
+        delta_km = _distance_km(o_lat, o_lon, d_lat, d_lon) - _distance_km(c_o_lat, c_o_lon, c_d_lat, c_d_lon)
+        _correct_leg(first, delta_km * detour_factor)
+    else:
+        # Access: from the origin to the end of the first leg; egress: from the start of the last leg
+        access_km = (_distance_km(o_lat, o_lon, first['to']['lat'], first['to']['lon'])
+                     - _distance_km(c_o_lat, c_o_lon, first['to']['lat'], first['to']['lon']))
+        egress_km = (_distance_km(last['from']['lat'], last['from']['lon'], d_lat, d_lon)
+                     - _distance_km(last['from']['lat'], last['from']['lon'], c_d_lat, c_d_lon))
+        _correct_leg(first, access_km * detour_factor)
+        _correct_leg(last, egress_km * detour_factor)
+    return route
+
+
+def _totals(route):
+    legs = route['plan']['itineraries'][0]['legs']
+    return sum(leg['distance'] for leg in legs) / 1000, sum(leg['duration'] for leg in legs) / 60
+
+
+def _has_itinerary(route):
+    return route is not None and bool(route.get('plan', {}).get('itineraries'))
+
+
+class RouteCache:
+    """
+    Cache of OTP itineraries keyed by snapped origin and destination cells.
+
+    Parameters:
+    cell_size_m (dict or float): The cell size per mode in metres, or one size for every mode.
+    correct_distances (bool): Whether to correct the access and egress legs of served itineraries.
+    validation_rate (float): The share of cache hits also routed exactly to measure the error.
+    seed (int, optional): The seed of the validation draws.
+    """
+
+    def __init__(self, cell_size_m=None, correct_distances=True, validation_rate=0.05, seed=None):
+        if cell_size_m is None:
+            cell_size_m = DEFAULT_CELL_SIZE_M
+        if not isinstance(cell_size_m, dict):
+            cell_size_m = {mode: cell_size_m for mode in DEFAULT_CELL_SIZE_M}
+        self.snappers = {mode: GridSnapper(size) for mode, size in cell_size_m.items()}
+        self.correct_distances = correct_distances
+        self.validation_rate = validation_rate
+        self.random = random.Random(seed)
+        self.entries = {}
+        self.counts = {}
+        self.errors = RunningStatistics()
+
+    def _key(self, mode, o_lat, o_lon, d_lat, d_lon, time_of_day):
+        snapper = self.snappers.get(mode.upper())
+        if snapper is None:
+            return None
+        time_key = time_of_day if mode.upper() in TIME_SENSITIVE_MODES else None
+        return (mode.upper(), snapper.cell(o_lat, o_lon), snapper.cell(d_lat, d_lon), time_key)
+
+    def _count(self, mode, outcome):
+        key = (mode.upper(), outcome)
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def get_or_route(self, fetch, o_lat, o_lon, d_lat, d_lon, mode, time_of_day=None):
+        """
+        Serve a cached itinerary for the cell pair, or route it with ``fetch`` and cache it.
+
+        Parameters:
+        fetch (callable): Routes the request exactly; returns the OTP response or None.
+        o_lat, o_lon, d_lat, d_lon (float): The requested origin and destination.
+        mode (str): The routed mode.
+        time_of_day (str, optional): The departure window, part of the key for time-sensitive modes.
+
+        Returns:
+        dict: The OTP response (None if routing failed).
+        """
+        key = self._key(mode, o_lat, o_lon, d_lat, d_lon, time_of_day)
+        entry = self.entries.get(key) if key is not None else None
+        if entry is None:
+            self._count(mode, 'routed')
+            route = fetch()
+            if key is not None and _has_itinerary(route):
+                self.entries[key] = (route, (o_lat, o_lon, d_lat, d_lon))
+            return route
+
+        self._count(mode, 'served')
+        cached_route, cached_endpoints = entry
+        if self.correct_distances:
+            route = correct_endpoints(cached_route, cached_endpoints, (o_lat, o_lon, d_lat, d_lon))
+        else:
+            route = cached_route
+        if self.validation_rate and self.random.random() < self.validation_rate:
+            self._count(mode, 'validated')
+            exact = fetch()
+            if _has_itinerary(exact):
+                self.record_error(mode, route, exact)
+                return exact
+        return route
+
+    def record_error(self, mode, served, exact):
+        """Add the relative distance and duration error of a served itinerary against the exact one."""
+        served_km, served_min = _totals(served)
+        exact_km, exact_min = _totals(exact)
+        if exact_km > 0:
+            self.errors.update('route_cache', 'abs_error_km_pct', mode.upper(), abs(served_km - exact_km) / exact_km * 100)
+            self.errors.update('route_cache', 'error_km_pct', mode.upper(), (served_km - exact_km) / exact_km * 100)
+        if exact_min > 0:
+            self.errors.update('route_cache', 'abs_error_duration_pct', mode.upper(),
+                               abs(served_min - exact_min) / exact_min * 100)
+
+    def report(self):
+        """
+        Summarise the saved OTP queries and the measured accuracy loss.
+
+        Returns:
+        dict: Per mode and overall: requests, OTP queries, cache hits, hit rate, validated hits
+        and the error statistics (percent of the exact distance and duration).
+        """
+        modes = sorted({mode for mode, _ in self.counts})
+        report = {'modes': {}, 'errors': self.errors.summary()}
+        for mode in modes + ['ALL']:
+            counts = {outcome: sum(count for (m, o), count in self.counts.items()
+                                   if o == outcome and mode in (m, 'ALL'))
+                      for outcome in ('routed', 'served', 'validated')}
+            requests = counts['routed'] + counts['served']
+            report['modes'][mode] = {
+                'requests': requests,
+                'otp_queries': counts['routed'] + counts['validated'],
+                'cache_hits': counts['served'],
+                'hit_rate': counts['served'] / requests if requests else None,
+                'validated': counts['validated'],
+            }
+        return report
@@ -0,0 +1,274 @@
+"""Compact columnar store of routed itineraries.
+
+``3_OTP_routing`` used to keep one dict per route holding the pair's
+addresses and coordinates, a dict per leg (transit legs twice, in
+``all_legs`` and ``transit_details``) and the concatenated route shape.
+Here the pairs, routes and legs are three struct-of-arrays tables in typed
+``array.array`` buffers: every pair is stored once and shared by its routes,
+a route is a row pointing at a contiguous range of legs, and all strings
+(modes, places, agencies, stops, addresses) are interned in one pool and
+stored as integer codes. Consecutive routes of the same OTP response (a car
+route reused at every slot of the departure grid) share their legs.
+
+``frames`` exposes the tables as DataFrames over the same buffers, with the
+strings as categoricals of the shared pool; ``write_summary_csv`` writes the
+route summary in the same format as before, a chunk at a time.
+"""
+from array import array
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# Leg modes whose agency, route and stop details are kept in 'transit_details'
+TRANSIT_LEG_MODES = ('BUS', 'RAIL', 'TRAM', 'SUBWAY', 'FERRY')
+
+# Transit leg fields: (route summary key, OTP leg key, read from the leg's 'from'/'to' place or the leg itself)
+TRANSIT_FIELDS = [
+    ('agency_name', 'agencyName', None),
+    ('agency_id', 'agencyId', None),
+    ('route', 'route', None),
+    ('route_name', 'routeLongName', None),
+    ('from_station', 'stopId', 'from'),
+    ('to_station', 'stopId', 'to'),
+]
+
+# Code of a missing string
+MISSING = -1
+
+# Departure times are stored as whole seconds since this (naive) epoch
+EPOCH = datetime(1970, 1, 1)
+
+# Columns of the route summary CSV, in order
+SUMMARY_COLUMNS = ['origin_address', 'destination_address', 'origin_latitude', 'origin_longitude',
+                   'destination_latitude', 'destination_longitude', 'departure_time', 'time_of_day', 'mode',
+                   'total_km', 'total_duration_min', 'transit_details', 'all_legs', 'route_shape']
+
+
+class StringPool:
+    """Interns strings (or any hashable values) as consecutive integer codes."""
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def code(self, value):
+        if value is None:
+            return MISSING
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def value(self, code):
+        return None if code == MISSING else self.values[code]
+
+
+class RouteStore:
+    """
+    Pairs, routes and legs of a routing run in typed column buffers.
+    """
+
+    def __init__(self):
+        self.strings = StringPool()
+        self.pairs = {name: array(typecode) for name, typecode in [
+            ('origin_address', 'i'), ('destination_address', 'i'), ('origin_latitude', 'd'),
+            ('origin_longitude', 'd'), ('destination_latitude', 'd'), ('destination_longitude', 'd'),
+            ('sample_weight', 'd')]}
+        self.routes = {name: array(typecode) for name, typecode in [
+            ('pair', 'i'), ('mode', 'i'), ('departure_time', 'q'), ('time_of_day', 'i'),
+            ('total_km', 'd'), ('total_duration_min', 'd'), ('first_leg', 'q'), ('n_legs', 'i'), ('weight_share', 'd')]}
+        self.legs = {name: array(typecode) for name, typecode in
+                     [('mode', 'i'), ('distance_km', 'd'), ('duration_min', 'd'), ('from_place', 'i'), ('to_place', 'i')]
+                     + [(field, 'i') for field, _, _ in TRANSIT_FIELDS]}
+        # Encoded polylines are unique per leg, so they are kept as a list rather than interned
+        self.leg_geometries = []
+        self.has_sample_weight = False
+        self._last_route = None
+
+    def __len__(self):
+        return len(self.routes['pair'])
+
+    def add_pair(self, origin, destination, sample_weight=None):
+        """
+        Add an origin-destination pair.
+
+        Parameters:
+        origin (dict or pd.Series): 'Address', 'Latitude' and 'Longitude' of the origin.
+        destination (dict or pd.Series): The same for the destination.
+        sample_weight (float, optional): The number of commutes the pair stands for.
+
+        Returns:
+        int: The pair index.
+        """
+        columns = self.pairs
+        columns['origin_address'].append(self.strings.code(origin['Address']))
+        columns['destination_address'].append(self.strings.code(destination['Address']))
+        columns['origin_latitude'].append(float(origin['Latitude']))
+        columns['origin_longitude'].append(float(origin['Longitude']))
+        columns['destination_latitude'].append(float(destination['Latitude']))
+        columns['destination_longitude'].append(float(destination['Longitude']))
+        columns['sample_weight'].append(np.nan if sample_weight is None else float(sample_weight))
+        self.has_sample_weight = self.has_sample_weight or sample_weight is not None
+        return len(columns['origin_address']) - 1
+
+    def _add_legs(self, legs):
+        columns = self.legs
+        total_km = 0
+        total_duration_min = 0
+        for leg in legs:
+            distance_km = leg['distance'] / 1000
+            duration_min = leg['duration'] / 60
+            total_km += distance_km
+            total_duration_min += duration_min
+            columns['mode'].append(self.strings.code(leg['mode']))
+            columns['distance_km'].append(distance_km)
+            columns['duration_min'].append(duration_min)
+            columns['from_place'].append(self.strings.code(leg['from']['name']))
+            columns['to_place'].append(self.strings.code(leg['to']['name']))
+            self.leg_geometries.append(leg.get('legGeometry', {}).get('points', ''))
+            transit = leg['mode'] in TRANSIT_LEG_MODES
+            for field, key, place in TRANSIT_FIELDS:
+                value = (leg[place].get(key) if place else leg.get(key)) if transit else None
+                columns[field].append(self.strings.code(value))
+        return total_km, total_duration_min
+
+    def add_route(self, pair, route, mode, departure_time, time_of_day, weight_share=1.0):
+        """
+        Add the first itinerary of an OTP response.
+
+        Parameters:
+        pair (int): The pair index of ``add_pair``.
+        route (dict): The OTP response.
+        mode (str): The requested mode.
+        departure_time (datetime): The departure time.
+        time_of_day (str): 'morning' or 'evening'.
+        weight_share (float): The share of the pair's sample_weight the route carries (1 / slots when a
+        pair is routed at several departure times).
+
+        Returns:
+        int: The route index, or None if the response has no itinerary.
+        """
+        if route is None or 'plan' not in route or 'itineraries' not in route['plan'] or not route['plan']['itineraries']:
+            return None
+        if self._last_route is not None and self._last_route[0] is route:
+            # The same response as the previous route: share its legs
+            _, first_leg, n_legs, totals = self._last_route
+        else:
+            legs = route['plan']['itineraries'][0]['legs']
+            first_leg = len(self.leg_geometries)
+            totals = self._add_legs(legs)
+            n_legs = len(legs)
+            self._last_route = (route, first_leg, n_legs, totals)
+
+        columns = self.routes
+        columns['pair'].append(pair)
+        columns['mode'].append(self.strings.code(mode))
+        columns['departure_time'].append(int((departure_time - EPOCH).total_seconds()))
+        columns['time_of_day'].append(self.strings.code(time_of_day))
+        columns['total_km'].append(totals[0])
+        columns['total_duration_min'].append(totals[1])
+        columns['first_leg'].append(first_leg)
+        columns['n_legs'].append(n_legs)
+        columns['weight_share'].append(float(weight_share))
+        return len(columns['pair']) - 1
+
+    def totals(self, index):
+        """Return (total_km, total_duration_min) of a route."""
+        return self.routes['total_km'][index], self.routes['total_duration_min'][index]
+
+    def nbytes(self):
+        """Return the size of the column buffers in bytes (the interned strings and polylines not included)."""
+        return sum(column.itemsize * len(column)
+                   for table in (self.pairs, self.routes, self.legs) for column in table.values())
+
+    def _frame(self, table, string_columns):
+        dtype = pd.CategoricalDtype(self.strings.values)
+        data = {}
+        for name, column in table.items():
+            values = np.frombuffer(column, dtype=column.typecode) if len(column) else np.array([], column.typecode)
+            data[name] = pd.Categorical.from_codes(values, dtype=dtype) if name in string_columns else values
+        return pd.DataFrame(data, copy=False)
+
+    def frames(self):
+        """
+        Expose the tables as DataFrames over the column buffers (the buffers must not grow while they are used).
+
+        Returns:
+        tuple: (pairs, routes, legs) DataFrames; routes point at their pair and at legs
+        [first_leg, first_leg + n_legs), and string columns are categoricals of the shared string pool.
+        """
+        pairs = self._frame(self.pairs, {'origin_address', 'destination_address'})
+        routes = self._frame(self.routes, {'mode', 'time_of_day'})
+        legs = self._frame(self.legs, {'mode', 'from_place', 'to_place'} | {field for field, _, _ in TRANSIT_FIELDS})
+        legs['leg_geometry'] = self.leg_geometries
+        return pairs, routes, legs
+
+    def route_legs(self, index):
+        """
+        Rebuild the leg dicts of a route as ``process_route`` returned them.
+
+        Returns:
+        tuple: (all_legs, transit_details, route_shape).
+        """
+        first_leg = self.routes['first_leg'][index]
+        columns, value = self.legs, self.strings.value
+        all_legs = []
+        transit_details = []
+        for leg in range(first_leg, first_leg + self.routes['n_legs'][index]):
+            leg_info = {
+                'mode': value(columns['mode'][leg]),
+                'distance_km': columns['distance_km'][leg],
+                'duration_min': columns['duration_min'][leg],
+                'from_place': value(columns['from_place'][leg]),
+                'to_place': value(columns['to_place'][leg]),
+                'leg_geometry': self.leg_geometries[leg],
+            }
+            if leg_info['mode'] in TRANSIT_LEG_MODES:
+                leg_info.update({field: value(columns[field][leg]) for field, _, _ in TRANSIT_FIELDS})
+                transit_details.append(leg_info)
+            all_legs.append(leg_info)
+        route_shape = ''.join(self.leg_geometries[first_leg:first_leg + self.routes['n_legs'][index]])
+        return all_legs, transit_details, route_shape
+
+    def summary_frame(self, start=0, stop=None):
+        """
+        Build the route summary rows of routes [start, stop) in the original CSV layout.
+
+        Returns:
+        pd.DataFrame: The SUMMARY_COLUMNS (plus 'sample_weight' for flow-weighted pairs).
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        routes, pairs, value = self.routes, self.pairs, self.strings.value
+        rows = []
+        for index in range(start, stop):
+            pair = routes['pair'][index]
+            all_legs, transit_details, route_shape = self.route_legs(index)
+            row = {
+                'origin_address': value(pairs['origin_address'][pair]),
+                'destination_address': value(pairs['destination_address'][pair]),
+                'origin_latitude': pairs['origin_latitude'][pair],
+                'origin_longitude': pairs['origin_longitude'][pair],
+                'destination_latitude': pairs['destination_latitude'][pair],
+                'destination_longitude': pairs['destination_longitude'][pair],
+                'departure_time': (EPOCH + timedelta(seconds=routes['departure_time'][index])).strftime('%Y-%m-%d %H:%M:%S'),
+                'time_of_day': value(routes['time_of_day'][index]),
+                'mode': value(routes['mode'][index]),
+                'total_km': routes['total_km'][index],
+                'total_duration_min': routes['total_duration_min'][index],
+                'transit_details': transit_details,
+                'all_legs': all_legs,
+                'route_shape': route_shape,
+            }
+            if self.has_sample_weight:
+                row['sample_weight'] = pairs['sample_weight'][pair] * routes['weight_share'][index]
+            rows.append(row)
+        columns = SUMMARY_COLUMNS + (['sample_weight'] if self.has_sample_weight else [])
+        return pd.DataFrame(rows, columns=columns)
+
+    def write_summary_csv(self, path, chunk_rows=10000):
+        """Write the route summary CSV, building chunk_rows rows at a time."""
+        with open(path, 'w', newline='') as summary_file:
+            for start in range(0, max(len(self), 1), chunk_rows):
+                self.summary_frame(start, start + chunk_rows).to_csv(summary_file, index=False, header=start == 0)
@@ -0,0 +1,294 @@
+"""Online descriptive statistics updated trip by trip during long pipeline runs.
+
+Each tracked series keeps Welford moments and a log-bucketed quantile sketch
+(DDSketch style, relative accuracy ``alpha``). Both merge exactly: moments with
+the Chan et al. pairwise update, sketches by adding bucket counts, so the
+state of parallel workers can be combined into the same result a single
+process would produce. The state is periodically written to a JSON snapshot.
+"""
+import json
+import math
+import os
+import time
+
+# Percentiles reported in snapshots
+SNAPSHOT_PERCENTILES = [5, 25, 50, 75, 95]
+
+
+class RunningMoments:
+    """Count, mean, variance, minimum and maximum of a stream (Welford's algorithm)."""
+
+    def __init__(self, n=0, mean=0.0, m2=0.0, minimum=math.inf, maximum=-math.inf):
+        self.n = n
+        self.mean = mean
+        self.m2 = m2
+        self.min = minimum
+        self.max = maximum
+
+    def update(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """Add the state of another accumulator (Chan et al. pairwise update)."""
+        if other.n == 0:
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else math.nan
+
+    def to_dict(self):
+        return {'n': self.n, 'mean': self.mean, 'm2': self.m2,
+                'min': self.min if self.n else None, 'max': self.max if self.n else None}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(state['n'], state['mean'], state['m2'],
+                   state['min'] if state['min'] is not None else math.inf,
+                   state['max'] if state['max'] is not None else -math.inf)
+
+
+class QuantileSketch:
+    """
+    Log-bucketed quantile sketch with relative accuracy ``alpha`` (DDSketch).
+
+    Values are counted in buckets whose bounds grow geometrically by
+    gamma = (1 + alpha) / (1 - alpha); exact zeros (e.g. bicycle emissions) have
+    their own counter. Merging adds bucket counts and is therefore exact.
+
+    Parameters:
+    alpha (float): The relative accuracy of the returned quantiles.
+    """
+
+    def __init__(self, alpha=0.01):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _bucket(self, value):
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _bucket_value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value):
+        self.count += 1
+        if value > 0:
+            key = self._bucket(value)
+            self.positive[key] = self.positive.get(key, 0) + 1
+        elif value < 0:
+            key = self._bucket(-value)
+            self.negative[key] = self.negative.get(key, 0) + 1
+        else:
+            self.zero_count += 1
+
+    def merge(self, other):
+        if other.alpha != self.alpha:
+            raise ValueError("Cannot merge sketches with different relative accuracy.")
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q):
+        """
+        Return the approximate q-quantile (0 <= q <= 1).
+
+        Parameters:
+        q (float): The quantile to compute.
+
+        Returns:
+        float: A value within relative error ``alpha`` of the exact quantile (NaN when empty).
+        """
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._bucket_value(key)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._bucket_value(key)
+        return self._bucket_value(max(self.positive))
+
+    def to_dict(self):
+        return {'alpha': self.alpha, 'zero_count': self.zero_count, 'count': self.count,
+                'positive': {str(k): v for k, v in self.positive.items()},
+                'negative': {str(k): v for k, v in self.negative.items()}}
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state['alpha'])
+        sketch.zero_count = state['zero_count']
+        sketch.count = state['count']
+        sketch.positive = {int(k): v for k, v in state['positive'].items()}
+        sketch.negative = {int(k): v for k, v in state['negative'].items()}
+        return sketch
+
+
+class RunningStatistics:
+    """
+    Running moments and quantiles per (stage, metric, mode), with periodic JSON snapshots.
+
+    Parameters:
+    snapshot_path (str, optional): Where ``maybe_snapshot`` writes the state.
+    snapshot_interval (float): The minimum number of seconds between two snapshots.
+    alpha (float): The relative accuracy of the quantile sketches.
+    """
+
+    def __init__(self, snapshot_path=None, snapshot_interval=30.0, alpha=0.01):
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.alpha = alpha
+        self.series = {}
+        self._last_snapshot = time.monotonic()
+
+    def _series(self, key):
+        if key not in self.series:
+            self.series[key] = (RunningMoments(), QuantileSketch(self.alpha))
+        return self.series[key]
+
+    def update(self, stage, metric, mode, value):
+        """
+        Add one observation, both to its mode and to the 'ALL' aggregate.
+
+        Parameters:
+        stage (str): The pipeline stage, e.g. 'routing' or 'co2'.
+        metric (str): The measured quantity, e.g. 'co2_emissions_method_1_g'.
+        mode (str): The transport mode of the trip.
+        value (float): The observed value (NaN values are ignored).
+        """
+        if value is None or value != value:
+            return
+        for key in ((stage, metric, mode), (stage, metric, 'ALL')):
+            moments, sketch = self._series(key)
+            moments.update(value)
+            sketch.add(value)
+
+    def merge(self, other):
+        """Add the state of another RunningStatistics (e.g. from a parallel worker)."""
+        for key, (moments, sketch) in other.series.items():
+            own_moments, own_sketch = self._series(key)
+            own_moments.merge(moments)
+            own_sketch.merge(sketch)
+
+    def summary(self):
+        """
+        Return the current statistics of every series.
+
+        Returns:
+        list: One dict per series with count, mean, variance, min, max and percentiles.
+        """
+        rows = []
+        for (stage, metric, mode), (moments, sketch) in sorted(self.series.items()):
+            row = {'stage': stage, 'metric': metric, 'mode': mode, 'n': moments.n, 'mean': moments.mean,
+                   'variance': moments.variance, 'min': moments.min, 'max': moments.max}
+            for percentile in SNAPSHOT_PERCENTILES:
+                row[f'p{percentile}'] = sketch.quantile(percentile / 100)
+            rows.append(row)
+        return rows
+
+    def to_dict(self):
+        return {'alpha': self.alpha,
+                'series': [{'key': list(key), 'moments': moments.to_dict(), 'sketch': sketch.to_dict()}
+                           for key, (moments, sketch) in self.series.items()]}
+
+    @classmethod
+    def from_dict(cls, state, **kwargs):
+        statistics = cls(alpha=state['alpha'], **kwargs)
+        for entry in state['series']:
+            statistics.series[tuple(entry['key'])] = (RunningMoments.from_dict(entry['moments']),
+                                                      QuantileSketch.from_dict(entry['sketch']))
+        return statistics
+
+    def snapshot(self, path=None):
+        """
+        Atomically write the summary and the mergeable state to a JSON file.
+
+        Parameters:
+        path (str, optional): The output file (defaults to ``snapshot_path``).
+        """
+        path = path or self.snapshot_path
+        snapshot = {'updated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'summary': self.summary(), 'state': self.to_dict()}
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, 'w') as snapshot_file:
+            # NaN/inf are not valid JSON; write them as null
+            json.dump(_replace_non_finite(snapshot), snapshot_file, indent=2)
+        os.replace(temporary_path, path)
+        self._last_snapshot = time.monotonic()
+
+    def maybe_snapshot(self):
+        """Write a snapshot if ``snapshot_interval`` seconds passed since the last one."""
+        if self.snapshot_path and time.monotonic() - self._last_snapshot >= self.snapshot_interval:
+            self.snapshot()
+
+
+def _replace_non_finite(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {k: _replace_non_finite(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_replace_non_finite(v) for v in value]
+    return value
+
+
+def load_snapshot(path):
+    """
+    Rebuild a RunningStatistics object from a snapshot file.
+
+    Parameters:
+    path (str): The snapshot written by ``RunningStatistics.snapshot``.
+
+    Returns:
+    RunningStatistics: The restored accumulators.
+    """
+    with open(path) as snapshot_file:
+        return RunningStatistics.from_dict(json.load(snapshot_file)['state'])
+
+
+def merge_snapshots(paths, output_path=None):
+    """
+    Merge the snapshots of several parallel workers into one.
+
+    Parameters:
+    paths (list): The worker snapshot files.
+    output_path (str, optional): Where to write the merged snapshot.
+
+    Returns:
+    RunningStatistics: The merged accumulators.
+    """
+    merged = None
+    for path in paths:
+        statistics = load_snapshot(path)
+        if merged is None:
+            merged = statistics
+        else:
+            merged.merge(statistics)
+    if merged is not None and output_path:
+        merged.snapshot(output_path)
+    return merged
@@ -0,0 +1,228 @@
+"""Spatial queries over the routed trips and legs of the CO2 outputs.
+
+Answers "how much is emitted by the commutes that pass through, start in or
+end in this area" without loading the GeoJSON into a GIS. Legs are found
+through an STRtree over their bounding boxes (from the geometry store
+index); only the candidates are built as line strings, from zero-copy views
+of the memory-mapped coordinates, and clipped to the area. A leg's distance
+and emissions are attributed in proportion to the share of its length
+inside the area. Areas are given as a geometry, a bounding box or a set of
+PC4 postcodes, whose polygons sit in a second STRtree.
+
+Lengths are compared in a local equirectangular projection (longitudes
+scaled by the cosine of the reference latitude), which keeps the clipped
+shares within a fraction of a percent in the Netherlands.
+"""
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import shape
+from shapely.strtree import STRtree
+
+from utils.geometry_store import GeometryStore
+from utils.route_cache import REFERENCE_LATITUDE
+
+# Longitude scale of the local projection
+LON_SCALE = math.cos(math.radians(REFERENCE_LATITUDE))
+
+# Columns of the leg and trip tables written by 4_CO2_Calculator
+LEG_COLUMNS = ['trip_id', 'leg_index', 'mode', 'distance_km', 'co2_emissions_method_1_g', 'co2_emissions_method_2_g']
+TRIP_COLUMNS = ['trip_id', 'mode', 'origin_lat', 'origin_lon', 'destination_lat', 'destination_lon', 'total_km',
+                'total_co2_emissions_method_1_g', 'total_co2_emissions_method_2_g']
+
+
+def _project(geometry):
+    return shapely.transform(geometry, lambda xy: xy * np.array([LON_SCALE, 1.0]))
+
+
+def _by_mode(frame, count_column, value_columns):
+    # Totals per mode plus an 'ALL' row; trips are counted once even when several of their legs match
+    groups = frame.groupby('mode', sort=True)
+    summary = groups[value_columns].sum()
+    summary.insert(0, 'trips', groups[count_column].nunique())
+    summary.loc['ALL'] = [frame[count_column].nunique()] + frame[value_columns].sum().tolist()
+    summary['trips'] = summary['trips'].astype(int)
+    return summary.rename_axis('mode').reset_index()
+
+
+class SpatialQuery:
+    """
+    Area queries over the legs in a geometry store and the trips of the CO2 summary.
+
+    Parameters:
+    store (GeometryStore): The leg geometries.
+    legs (pd.DataFrame): The LEG_COLUMNS, one row per stored leg.
+    trips (pd.DataFrame, optional): The TRIP_COLUMNS, for the start and end queries.
+    pc4_shapes (pd.Series, optional): GeoJSON polygons indexed by PC4, for areas given as postcodes.
+    """
+
+    def __init__(self, store, legs, trips=None, pc4_shapes=None):
+        self.store = store
+        index = pd.DataFrame({'trip_id': store.index['trip_id'], 'leg_index': store.index['leg_index']})
+        self.legs = index.merge(legs[LEG_COLUMNS], on=['trip_id', 'leg_index'], how='left', validate='one_to_one')
+        self.trips = trips
+
+        # Legs with at least two points, indexed by their (projected) bounding boxes
+        self._rows = np.flatnonzero(store.index['length'] >= 2)
+        bounds = store.index[self._rows]
+        self._tree = STRtree(shapely.box(bounds['min_lon'] * LON_SCALE, bounds['min_lat'],
+                                         bounds['max_lon'] * LON_SCALE, bounds['max_lat']))
+
+        self.pc4_codes = None
+        if pc4_shapes is not None:
+            self.pc4_codes = pc4_shapes.index.to_numpy()
+            self.pc4_polygons = shapely.from_geojson(pc4_shapes.to_numpy())
+            self._pc4_tree = STRtree(self.pc4_polygons)
+
+    @classmethod
+    def from_outputs(cls, csv_dir, georef_path=None):
+        """
+        Open the outputs of 4_CO2_Calculator in a directory.
+
+        Parameters:
+        csv_dir (str): The directory with co2_emissions_summary.csv, co2_emissions_legs.csv and leg_geometries.*.
+        georef_path (str, optional): The georef CSV with the PC4 polygons.
+
+        Returns:
+        SpatialQuery: The query object.
+        """
+        from utils.pc4_lookup import load_pc4_shapes
+        store = GeometryStore(os.path.join(csv_dir, 'leg_geometries'))
+        legs = pd.read_csv(os.path.join(csv_dir, 'co2_emissions_legs.csv'), usecols=LEG_COLUMNS)
+        trips = pd.read_csv(os.path.join(csv_dir, 'co2_emissions_summary.csv'), usecols=TRIP_COLUMNS)
+        pc4_shapes = load_pc4_shapes(georef_path) if georef_path else None
+        return cls(store, legs, trips, pc4_shapes)
+
+    def area(self, geometry=None, bbox=None, pc4=None):
+        """
+        Build a query area (longitude, latitude) from exactly one of the arguments.
+
+        Parameters:
+        geometry (shapely geometry or dict, optional): A polygon, or a GeoJSON geometry dict.
+        bbox (tuple, optional): (min lon, min lat, max lon, max lat).
+        pc4 (list, optional): PC4 postcodes whose polygons are merged, e.g. a municipality's postcodes.
+
+        Returns:
+        shapely.Geometry: The area.
+        """
+        if sum(argument is not None for argument in (geometry, bbox, pc4)) != 1:
+            raise ValueError("Give exactly one of geometry, bbox or pc4.")
+        if bbox is not None:
+            return shapely.box(*bbox)
+        if geometry is not None:
+            return shape(geometry) if isinstance(geometry, dict) else geometry
+        if self.pc4_codes is None:
+            raise ValueError("PC4 areas need the PC4 polygons (pc4_shapes).")
+        found = np.isin(self.pc4_codes, np.asarray(pc4, dtype=self.pc4_codes.dtype))
+        if not found.any():
+            raise ValueError(f"None of the postcodes {list(pc4)} are known.")
+        return shapely.union_all(self.pc4_polygons[found])
+
+    def pc4_at(self, lon, lat):
+        """
+        Find the PC4 postcode containing each point.
+
+        Returns:
+        np.ndarray: The postcode per point (-1 outside every PC4 polygon).
+        """
+        if self.pc4_codes is None:
+            raise ValueError("Locating postcodes needs the PC4 polygons (pc4_shapes).")
+        points = shapely.points(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+        point_index, polygon_index = self._pc4_tree.query(points, predicate='within')
+        codes = np.full(len(points), -1, dtype=np.int64)
+        codes[point_index] = self.pc4_codes[polygon_index]
+        return codes
+
+    def clipped_legs(self, area):
+        """
+        Clip the legs intersecting an area.
+
+        Parameters:
+        area (shapely.Geometry): The area (longitude, latitude).
+
+        Returns:
+        pd.DataFrame: The LEG_COLUMNS of the intersecting legs with 'share_inside', and the distance and
+        emissions scaled by it ('km_inside', 'ttw_co2_g', 'wtw_co2_g').
+        """
+        projected = _project(area)
+        # Query with the parts of a multi-part area, so its overall envelope does not select every leg in between
+        _, tree_index = self._tree.query(shapely.get_parts(projected), predicate='intersects')
+        candidates = self._rows[np.unique(tree_index)]
+        index = self.store.index[candidates]
+        lengths = index['length'].astype(np.int64)
+
+        # Gather the coordinates of the candidates from the mapped file in one indexing operation
+        starts = np.repeat(index['offset'] - (np.cumsum(lengths) - lengths), lengths)
+        coordinates = self.store.coordinates[starts + np.arange(lengths.sum())] * np.array([LON_SCALE, 1.0])
+
+        # Clip segment by segment: clipping whole lines would merge the stretches a leg travels twice
+        leg_of_point = np.repeat(np.arange(len(candidates)), lengths)
+        segment_start = np.flatnonzero(leg_of_point[:-1] == leg_of_point[1:])
+        start, end = coordinates[segment_start], coordinates[segment_start + 1]
+        segment_length = np.hypot(*(end - start).T)
+        inside_length = np.zeros(len(segment_start))
+
+        # Segments outside the area's envelope are skipped; of the others only those crossing the boundary
+        # are clipped, the rest lie entirely inside or outside, as their midpoint does
+        min_x, min_y, max_x, max_y = shapely.bounds(projected)
+        near = np.flatnonzero((np.maximum(start[:, 0], end[:, 0]) >= min_x) & (np.minimum(start[:, 0], end[:, 0]) <= max_x)
+                              & (np.maximum(start[:, 1], end[:, 1]) >= min_y) & (np.minimum(start[:, 1], end[:, 1]) <= max_y))
+        segments = shapely.linestrings(np.stack([start[near], end[near]], axis=1)) if len(near) else np.array([])
+        boundary = shapely.boundary(projected)
+        shapely.prepare(projected)
+        shapely.prepare(boundary)
+        crossing = shapely.intersects(boundary, segments)
+        middle = (start[near] + end[near]) / 2
+        inside_length[near] = np.where(shapely.contains_xy(projected, middle[:, 0], middle[:, 1]),
+                                       segment_length[near], 0.0)
+        inside_length[near[crossing]] = shapely.length(shapely.intersection(segments[crossing], projected))
+
+        total_length = np.bincount(leg_of_point[segment_start], weights=segment_length, minlength=len(candidates))
+        total_inside = np.bincount(leg_of_point[segment_start], weights=inside_length, minlength=len(candidates))
+        share_inside = np.divide(total_inside, total_length, out=np.zeros(len(candidates)), where=total_length > 0)
+        share_inside = np.minimum(share_inside, 1.0)
+
+        legs = self.legs.iloc[candidates].reset_index(drop=True)
+        legs['share_inside'] = share_inside
+        legs['km_inside'] = legs['distance_km'] * share_inside
+        legs['ttw_co2_g'] = legs['co2_emissions_method_1_g'] * share_inside
+        legs['wtw_co2_g'] = legs['co2_emissions_method_2_g'] * share_inside
+        return legs[share_inside > 0].reset_index(drop=True)
+
+    def passing_through(self, area):
+        """
+        Total the emissions of the leg parts inside an area.
+
+        Returns:
+        pd.DataFrame: Per leg mode (and 'ALL'): trips, legs, km inside and TTW / WTW grams inside.
+        """
+        legs = self.clipped_legs(area)
+        summary = _by_mode(legs, 'trip_id', ['km_inside', 'ttw_co2_g', 'wtw_co2_g'])
+        legs_per_mode = legs.groupby('mode').size()
+        summary.insert(2, 'legs', summary['mode'].map(legs_per_mode).fillna(len(legs)).astype(int))
+        return summary
+
+    def _trip_endpoints_in(self, area, lat_column, lon_column):
+        if self.trips is None:
+            raise ValueError("Start and end queries need the trips table.")
+        shapely.prepare(area)
+        inside = shapely.contains_xy(area, self.trips[lon_column].to_numpy(), self.trips[lat_column].to_numpy())
+        trips = self.trips[inside].rename(columns={'total_co2_emissions_method_1_g': 'ttw_co2_g',
+                                                   'total_co2_emissions_method_2_g': 'wtw_co2_g'})
+        return _by_mode(trips, 'trip_id', ['total_km', 'ttw_co2_g', 'wtw_co2_g'])
+
+    def starting_in(self, area):
+        """
+        Total the emissions of the whole trips starting in an area.
+
+        Returns:
+        pd.DataFrame: Per trip mode (and 'ALL'): trips, total km and TTW / WTW grams.
+        """
+        return self._trip_endpoints_in(area, 'origin_lat', 'origin_lon')
+
+    def ending_in(self, area):
+        """Total the emissions of the whole trips ending in an area (see ``starting_in``)."""
+        return self._trip_endpoints_in(area, 'destination_lat', 'destination_lon')
@@ -0,0 +1,265 @@
+"""Out-of-core ordinary least squares for trip-level regressions (H8).
+
+The model accumulates X'X, X'Y and Y'Y over chunks of the trips dataset and
+solves the normal equations with a Cholesky factorisation, so the full dataset
+never has to be in memory. Several targets (e.g. one per emission methodology)
+share the same design matrix and are fitted in the same pass. Heteroscedasticity
+-robust (HC1) standard errors need the residuals, which a second pass over the
+chunks provides.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+from scipy import linalg, stats
+
+
+class OLSResult:
+    """
+    Fitted coefficients and inference for one regression target.
+
+    Parameters:
+    target (str): The name of the dependent variable.
+    terms (list): The names of the regressors.
+    coefficients (np.ndarray): The estimated coefficients.
+    standard_errors (np.ndarray): The classical standard errors.
+    robust_standard_errors (np.ndarray or None): HC1 standard errors (None without a residual pass).
+    r_squared (float): The coefficient of determination.
+    n (int): The number of observations used.
+    """
+
+    def __init__(self, target, terms, coefficients, standard_errors, robust_standard_errors, r_squared, n):
+        self.target = target
+        self.terms = list(terms)
+        self.coefficients = coefficients
+        self.standard_errors = standard_errors
+        self.robust_standard_errors = robust_standard_errors
+        self.r_squared = r_squared
+        self.n = n
+
+    def summary(self):
+        """Return a coefficient table, using the robust standard errors when available."""
+        se = self.robust_standard_errors if self.robust_standard_errors is not None else self.standard_errors
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_values = self.coefficients / se
+        p_values = 2 * stats.t.sf(np.abs(t_values), self.n - len(self.terms))
+        return pd.DataFrame({
+            'coef': self.coefficients,
+            'std_err': self.standard_errors,
+            'robust_std_err': self.robust_standard_errors if self.robust_standard_errors is not None else np.nan,
+            't': t_values,
+            'p_value': p_values,
+        }, index=self.terms)
+
+
+class StreamingOLS:
+    """
+    Linear regression of one or more targets on numeric and categorical regressors, fitted chunk by chunk.
+
+    Categorical columns are dummy-encoded on the fly: every level seen gets a column,
+    and the reference level is dropped when solving. Because earlier rows have a zero
+    for a level that appears later, growing the accumulators keeps them exact.
+
+    Parameters:
+    targets (list): The dependent variables, fitted jointly on the same rows.
+    numeric (list): The numeric regressors.
+    categorical (dict, optional): Column -> reference level (None, or a level that does not occur, for the
+    first level in sorted order).
+    intercept (bool): Whether to include a constant term.
+    """
+
+    def __init__(self, targets, numeric, categorical=None, intercept=True):
+        self.targets = list(targets)
+        self.numeric = list(numeric)
+        self.categorical = dict(categorical or {})
+        self.intercept = intercept
+        self.levels = {column: [] for column in self.categorical}
+        self._unobserved_references = set()
+        self.n = 0
+        p = len(self._all_terms())
+        self.xtx = np.zeros((p, p))
+        self.xty = np.zeros((p, len(self.targets)))
+        self.yty = np.zeros(len(self.targets))
+        self.y_sum = np.zeros(len(self.targets))
+        self.beta = None
+        self.meat = None
+        self.sse = None
+
+    def _all_terms(self):
+        terms = (['Intercept'] if self.intercept else []) + self.numeric
+        for column, levels in self.levels.items():
+            terms += [f'{column}[{level}]' for level in levels]
+        return terms
+
+    def _reference_levels(self):
+        references = {}
+        for column, reference in self.categorical.items():
+            levels = self.levels[column]
+            if not levels:
+                continue
+            # Dropping a reference level no row has would leave a collinear design
+            if reference is None or reference not in levels:
+                if reference is not None and column not in self._unobserved_references:
+                    logging.warning(f"Reference level {reference!r} of '{column}' does not occur; "
+                                    f"using {sorted(levels, key=str)[0]!r} instead.")
+                    self._unobserved_references.add(column)
+                reference = sorted(levels, key=str)[0]
+            references[column] = reference
+        return references
+
+    def _kept_columns(self):
+        dropped = {f'{column}[{level}]' for column, level in self._reference_levels().items()}
+        return [i for i, term in enumerate(self._all_terms()) if term not in dropped]
+
+    def terms(self):
+        """Return the names of the regressors of the solved model (reference levels dropped)."""
+        all_terms = self._all_terms()
+        return [all_terms[i] for i in self._kept_columns()]
+
+    def _register_levels(self, chunk):
+        new_columns = 0
+        for column in self.categorical:
+            seen = set(self.levels[column])
+            for level in pd.unique(chunk[column].dropna()):
+                if level not in seen:
+                    self.levels[column].append(level)
+                    seen.add(level)
+                    new_columns += 1
+        if new_columns:
+            self.xtx = np.pad(self.xtx, ((0, new_columns), (0, new_columns)))
+            self.xty = np.pad(self.xty, ((0, new_columns), (0, 0)))
+
+    def _design(self, chunk):
+        """Return the full design matrix, the targets and the mask of complete rows of a chunk."""
+        parts = []
+        if self.intercept:
+            parts.append(np.ones((len(chunk), 1)))
+        if self.numeric:
+            parts.append(chunk[self.numeric].to_numpy(dtype=float))
+        for column, levels in self.levels.items():
+            codes = pd.Categorical(chunk[column], categories=levels).codes
+            dummies = np.zeros((len(chunk), len(levels)))
+            known = codes >= 0
+            dummies[np.flatnonzero(known), codes[known]] = 1.0
+            parts.append(dummies)
+        x = np.hstack(parts)
+        y = chunk[self.targets].to_numpy(dtype=float)
+        complete = np.isfinite(x).all(axis=1) & np.isfinite(y).all(axis=1)
+        for column in self.categorical:
+            complete &= chunk[column].notna().to_numpy()
+        return x[complete], y[complete]
+
+    def update(self, chunk):
+        """
+        Accumulate the cross-products of one chunk of rows.
+
+        Parameters:
+        chunk (pd.DataFrame): Rows containing the regressor and target columns.
+        """
+        self._register_levels(chunk)
+        x, y = self._design(chunk)
+        self.n += len(x)
+        self.xtx += x.T @ x
+        self.xty += x.T @ y
+        self.yty += (y ** 2).sum(axis=0)
+        self.y_sum += y.sum(axis=0)
+        self.beta = None
+
+    def solve(self):
+        """
+        Solve the normal equations for every target.
+
+        Returns:
+        np.ndarray: The (regressors, targets) coefficient matrix.
+        """
+        kept = self._kept_columns()
+        xtx = self.xtx[np.ix_(kept, kept)]
+        xty = self.xty[kept]
+        try:
+            factor = linalg.cho_factor(xtx)
+            self.beta = linalg.cho_solve(factor, xty)
+            self._xtx_inverse = linalg.cho_solve(factor, np.eye(len(kept)))
+        except linalg.LinAlgError:
+            logging.warning("X'X is not positive definite (collinear regressors); using the pseudo-inverse.")
+            self._xtx_inverse = np.linalg.pinv(xtx)
+            self.beta = self._xtx_inverse @ xty
+        self.meat = None
+        self.sse = None
+        return self.beta
+
+    def update_residuals(self, chunk):
+        """
+        Accumulate the residual terms needed for robust standard errors (second pass).
+
+        Parameters:
+        chunk (pd.DataFrame): Rows containing the regressor and target columns.
+        """
+        if self.beta is None:
+            self.solve()
+        kept = self._kept_columns()
+        x, y = self._design(chunk)
+        x = x[:, kept]
+        residuals = y - x @ self.beta
+        if self.meat is None:
+            self.meat = np.zeros((len(self.targets), len(kept), len(kept)))
+            self.sse = np.zeros(len(self.targets))
+        for t in range(len(self.targets)):
+            weighted = x * residuals[:, [t]]
+            self.meat[t] += weighted.T @ weighted
+        self.sse += (residuals ** 2).sum(axis=0)
+
+    def results(self):
+        """
+        Return the fitted model of every target.
+
+        Returns:
+        dict: Target name -> OLSResult.
+        """
+        if self.beta is None:
+            self.solve()
+        kept = self._kept_columns()
+        p = len(kept)
+        xtx = self.xtx[np.ix_(kept, kept)]
+        xty = self.xty[kept]
+        results = {}
+        for t, target in enumerate(self.targets):
+            beta = self.beta[:, t]
+            if self.sse is not None:
+                sse = self.sse[t]
+            else:
+                sse = self.yty[t] - 2 * beta @ xty[:, t] + beta @ xtx @ beta
+            sst = self.yty[t] - self.y_sum[t] ** 2 / self.n
+            sigma2 = sse / (self.n - p)
+            standard_errors = np.sqrt(np.diag(self._xtx_inverse) * sigma2)
+            robust = None
+            if self.meat is not None:
+                covariance = self._xtx_inverse @ self.meat[t] @ self._xtx_inverse * self.n / (self.n - p)
+                robust = np.sqrt(np.diag(covariance))
+            results[target] = OLSResult(target, self.terms(), beta, standard_errors, robust,
+                                        1 - sse / sst if sst > 0 else np.nan, self.n)
+        return results
+
+
+def fit_streaming_ols(read_chunks, targets, numeric, categorical=None, intercept=True, robust=True):
+    """
+    Fit a StreamingOLS model over a chunked data source.
+
+    Parameters:
+    read_chunks (callable): Returns a fresh iterator of DataFrame chunks each time it is called.
+    targets (list): The dependent variables.
+    numeric (list): The numeric regressors.
+    categorical (dict, optional): Column -> reference level.
+    intercept (bool): Whether to include a constant term.
+    robust (bool): Whether to make a second pass for HC1 standard errors.
+
+    Returns:
+    dict: Target name -> OLSResult.
+    """
+    model = StreamingOLS(targets, numeric, categorical, intercept)
+    for chunk in read_chunks():
+        model.update(chunk)
+    model.solve()
+    if robust:
+        for chunk in read_chunks():
+            model.update_residuals(chunk)
+    return model.results()
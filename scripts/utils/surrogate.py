@@ -0,0 +1,257 @@
+"""Surrogate of OTP routing and the CO2 calculation for unrouted trips.
+
+One linear model per routed mode predicts the network distance, the duration
+and both emission totals of a trip from its straight-line distance, the
+coarse regions of its origin and destination, and its time of day. The
+straight-line distance is the Andoyer-Lambert approximation: a few metres off
+at most, which is plenty here, and much cheaper than Vincenty's iteration.
+The models are fitted out of core with ``StreamingOLS`` on the output of
+``4_CO2_Calculator`` (the routed trips of ``3_OTP_routing``), holding out a
+hashed share of the trips to measure the prediction error.
+
+Prediction is vectorised: the categorical effects are looked up in arrays
+instead of being dummy-encoded, so millions of trips are scored per second.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+from utils.geodesy import andoyer_lambert_distance_km
+from utils.streaming_ols import StreamingOLS
+
+TARGETS = ['total_km', 'total_duration_min', 'total_co2_emissions_method_1_g', 'total_co2_emissions_method_2_g']
+NUMERIC = ['straight_km', 'straight_km_squared', 'log_straight_km']
+CATEGORICAL = ['origin_region', 'destination_region', 'time_of_day']
+
+# Time-of-day codes (unknown or missing values get code 0)
+TIME_OF_DAY_LEVELS = ['unknown', 'morning', 'evening']
+
+# Size of the regions (degrees of latitude, longitude), roughly 55 x 50 km in the Netherlands
+REGION_SIZE_DEG = (0.5, 0.75)
+
+# Columns of the CO2 summary the surrogate is trained on
+TRAINING_COLUMNS = ['trip_id', 'mode', 'origin_lat', 'origin_lon', 'destination_lat', 'destination_lon',
+                    'time_of_day'] + TARGETS
+
+
+def region_codes(lat, lon, region_size=REGION_SIZE_DEG):
+    """
+    Number the coarse grid regions of coordinates.
+
+    Returns:
+    np.ndarray: Integer region codes (-1 for missing coordinates).
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    valid = np.isfinite(lat) & np.isfinite(lon)
+    row = np.floor(np.where(valid, lat, 0) / region_size[0]).astype(np.int64)
+    column = np.floor(np.where(valid, lon, 0) / region_size[1]).astype(np.int64)
+    return np.where(valid, row * 1000 + column, -1)
+
+
+def trip_features(o_lat, o_lon, d_lat, d_lon, time_of_day=None, region_size=REGION_SIZE_DEG):
+    """
+    Compute the regressors of trips.
+
+    Parameters:
+    o_lat, o_lon, d_lat, d_lon (array-like): Origin and destination coordinates.
+    time_of_day (array-like, optional): 'morning' / 'evening' per trip ('unknown' when not given).
+    region_size (tuple): The region size in degrees of latitude and longitude.
+
+    Returns:
+    pd.DataFrame: The NUMERIC and CATEGORICAL columns (all categorical columns as integer codes).
+    """
+    straight_km = andoyer_lambert_distance_km(np.asarray(o_lat, dtype=float), np.asarray(o_lon, dtype=float),
+                                              np.asarray(d_lat, dtype=float), np.asarray(d_lon, dtype=float))
+    # Identical points give 0/0 in the approximation
+    straight_km = np.nan_to_num(np.asarray(straight_km, dtype=float), nan=0.0)
+    if time_of_day is None:
+        time_codes = np.zeros(len(straight_km), dtype=np.int64)
+    else:
+        time_codes = np.maximum(pd.Categorical(np.asarray(time_of_day), categories=TIME_OF_DAY_LEVELS).codes, 0)
+    return pd.DataFrame({
+        'straight_km': straight_km,
+        'straight_km_squared': straight_km ** 2,
+        'log_straight_km': np.log1p(straight_km),
+        'origin_region': region_codes(o_lat, o_lon, region_size),
+        'destination_region': region_codes(d_lat, d_lon, region_size),
+        'time_of_day': time_codes.astype(np.int64),
+    })
+
+
+def held_out(trip_ids, test_fraction, seed=0):
+    """
+    Select the held-out trips by hashing their IDs, so the split is the same in every chunk and every pass.
+
+    Returns:
+    np.ndarray: Boolean mask of the held-out trips.
+    """
+    ids = np.asarray(trip_ids, dtype=np.int64).astype(np.uint64) + np.uint64(seed)
+    with np.errstate(over='ignore'):
+        mixed = (ids * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(40)
+    return (mixed % np.uint64(1000000)).astype(float) < test_fraction * 1000000
+
+
+class SurrogateModel:
+    """
+    Per-mode linear predictors of network distance, duration and emissions.
+
+    Parameters:
+    coefficients (dict): Mode -> {'intercept': [...], 'numeric': [[...]], 'categorical': {column: {level: [...]}}},
+        each vector holding one value per target.
+    region_size (tuple): The region size in degrees of latitude and longitude.
+    """
+
+    def __init__(self, coefficients, region_size=REGION_SIZE_DEG):
+        self.coefficients = coefficients
+        self.region_size = tuple(region_size)
+        self._lookups = {}
+
+    @classmethod
+    def fit(cls, read_chunks, test_fraction=0.2, seed=0, region_size=REGION_SIZE_DEG):
+        """
+        Fit the models on chunks of the CO2 summary, leaving out the held-out trips.
+
+        Parameters:
+        read_chunks (callable): Returns a fresh iterator of DataFrame chunks with the TRAINING_COLUMNS.
+        test_fraction (float): The share of trips held out.
+        seed (int): The seed of the held-out split.
+        region_size (tuple): The region size in degrees of latitude and longitude.
+
+        Returns:
+        SurrogateModel: The fitted model.
+        """
+        models = {}
+        for chunk in read_chunks():
+            chunk = chunk[~held_out(chunk['trip_id'], test_fraction, seed)]
+            features = trip_features(chunk['origin_lat'], chunk['origin_lon'], chunk['destination_lat'],
+                                     chunk['destination_lon'], chunk.get('time_of_day'), region_size)
+            features[TARGETS] = chunk[TARGETS].to_numpy(dtype=float)
+            for mode, rows in features.groupby(chunk['mode'].str.upper().to_numpy()):
+                if mode not in models:
+                    models[mode] = StreamingOLS(TARGETS, NUMERIC, {column: None for column in CATEGORICAL})
+                models[mode].update(rows)
+
+        coefficients = {}
+        for mode, model in models.items():
+            if model.n <= len(model.terms()):
+                continue
+            beta = model.solve()
+            terms = dict(zip(model.terms(), beta))
+            coefficients[mode] = {
+                'n': model.n,
+                'intercept': terms['Intercept'].tolist(),
+                'numeric': [terms[column].tolist() for column in NUMERIC],
+                'categorical': {column: {str(level): terms[f'{column}[{level}]'].tolist()
+                                         for level in model.levels[column] if f'{column}[{level}]' in terms}
+                                for column in CATEGORICAL},
+            }
+        return cls(coefficients, region_size)
+
+    def _lookup(self, mode, column):
+        # Sorted levels and their effects; unseen levels fall back to the reference level (zero effect)
+        key = (mode, column)
+        if key not in self._lookups:
+            effects = self.coefficients[mode]['categorical'][column]
+            levels = list(effects)
+            order = np.argsort([int(level) for level in levels])
+            level_values = np.array([int(levels[i]) for i in order], dtype=np.int64)
+            values = np.array([effects[levels[i]] for i in order], dtype=float).reshape(len(levels), len(TARGETS))
+            self._lookups[key] = (level_values, values)
+        return self._lookups[key]
+
+    def _effect(self, mode, column, codes):
+        level_values, values = self._lookup(mode, column)
+        if len(level_values) == 0:
+            return 0.0
+        position = np.clip(np.searchsorted(level_values, codes), 0, len(level_values) - 1)
+        found = level_values[position] == codes
+        return np.where(found[:, None], values[position], 0.0)
+
+    def predict(self, mode, o_lat, o_lon, d_lat, d_lon, time_of_day=None):
+        """
+        Predict the targets of trips.
+
+        Parameters:
+        mode (str or array-like): The routed mode (CAR, BICYCLE or TRANSIT), one for all trips or one per trip.
+        o_lat, o_lon, d_lat, d_lon (array-like): Origin and destination coordinates.
+        time_of_day (array-like, optional): 'morning' / 'evening' per trip.
+
+        Returns:
+        pd.DataFrame: One column per target (NaN for modes without a model), clipped at zero.
+        """
+        features = trip_features(o_lat, o_lon, d_lat, d_lon, time_of_day, self.region_size)
+        n = len(features)
+        if isinstance(mode, str):
+            mode_names, mode_codes = [mode.upper()], np.zeros(n, dtype=np.int8)
+        else:
+            modes = pd.Categorical(np.asarray(mode))
+            mode_names, mode_codes = [str(name).upper() for name in modes.categories], modes.codes
+        numeric = features[NUMERIC].to_numpy()
+        prediction = np.full((n, len(TARGETS)), np.nan)
+        for code, mode_name in enumerate(mode_names):
+            if mode_name not in self.coefficients:
+                continue
+            rows = np.flatnonzero(mode_codes == code)
+            coefficients = self.coefficients[mode_name]
+            values = np.asarray(coefficients['intercept']) + numeric[rows] @ np.asarray(coefficients['numeric'])
+            for column in CATEGORICAL:
+                values = values + self._effect(mode_name, column, features[column].to_numpy()[rows])
+            prediction[rows] = values
+        return pd.DataFrame(np.maximum(prediction, 0.0), columns=TARGETS)
+
+    def save(self, path):
+        with open(path, 'w') as model_file:
+            json.dump({'region_size': list(self.region_size), 'targets': TARGETS, 'numeric': NUMERIC,
+                       'coefficients': self.coefficients}, model_file, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as model_file:
+            state = json.load(model_file)
+        return cls(state['coefficients'], state['region_size'])
+
+
+def evaluate(model, trips):
+    """
+    Compare the predictions with the routed values of trips.
+
+    Parameters:
+    model (SurrogateModel): The fitted model.
+    trips (pd.DataFrame): Routed trips with the TRAINING_COLUMNS.
+
+    Returns:
+    pd.DataFrame: Per mode and target: n, mean, bias, MAE, RMSE, median absolute % error, R² and the
+    relative error of the total (the error left when the trips are summed, e.g. national emissions).
+    """
+    prediction = model.predict(trips['mode'], trips['origin_lat'], trips['origin_lon'], trips['destination_lat'],
+                               trips['destination_lon'], trips.get('time_of_day'))
+    modes = trips['mode'].str.upper().to_numpy()
+    rows = []
+    for mode in sorted(pd.unique(modes)) + ['ALL']:
+        mask = np.ones(len(trips), dtype=bool) if mode == 'ALL' else modes == mode
+        for target in TARGETS:
+            actual = trips[target].to_numpy(dtype=float)[mask]
+            predicted = prediction[target].to_numpy()[mask]
+            valid = np.isfinite(actual) & np.isfinite(predicted)
+            actual, predicted = actual[valid], predicted[valid]
+            if len(actual) == 0:
+                continue
+            error = predicted - actual
+            with np.errstate(divide='ignore', invalid='ignore'):
+                percentage = np.abs(error[actual > 0]) / actual[actual > 0] * 100
+            sst = ((actual - actual.mean()) ** 2).sum()
+            rows.append({
+                'mode': mode,
+                'target': target,
+                'n': len(actual),
+                'mean': actual.mean(),
+                'bias': error.mean(),
+                'mae': np.abs(error).mean(),
+                'rmse': np.sqrt((error ** 2).mean()),
+                'median_abs_pct_error': np.median(percentage) if len(percentage) else np.nan,
+                'r_squared': 1 - (error ** 2).sum() / sst if sst > 0 else np.nan,
+                'total_error_pct': (predicted.sum() / actual.sum() - 1) * 100 if actual.sum() > 0 else np.nan,
+            })
+    return pd.DataFrame(rows)
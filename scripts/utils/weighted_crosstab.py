@@ -0,0 +1,143 @@
+"""Survey-weighted crosstabs of categorical columns.
+
+Every column is encoded once as integer category codes, and the codes of all
+columns are combined into one key per row (mixed radix). A single
+``np.bincount`` over that key gives the unweighted count, the sum of weights
+and the sum of squared weights of every cell of the full joint table; the
+crosstab of any subset of the columns is a sum of that table over the other
+axes, so any number of breakdowns costs one pass over the rows.
+
+Weighted shares are ratio estimates (weighted count of the cell over the
+weighted count of its group). Their standard errors use the linearised
+with-replacement variance
+
+    var(p) = n / (n - 1) * sum(w_i^2 * (y_i - p)^2) / (sum w_i)^2,
+
+which follows from the three sums per cell. It treats the weighted rows as
+independent, so it understates the error of a clustered design such as ODiN's
+(persons within households) somewhat.
+"""
+import numpy as np
+import pandas as pd
+
+# Largest joint table built in one pass (cells)
+MAX_CELLS = 1 << 26
+
+
+def encode(values):
+    """
+    Encode a column as integer category codes.
+
+    Returns:
+    tuple: (codes, categories); missing values get a category of their own, after the others.
+    """
+    codes, categories = pd.factorize(pd.Series(values), sort=True, use_na_sentinel=True)
+    if (codes < 0).any():
+        codes = np.where(codes < 0, len(categories), codes)
+        categories = categories.append(pd.Index([np.nan]))
+    return codes.astype(np.int64), categories
+
+
+class WeightedCrosstab:
+    """
+    The joint weighted table of categorical columns, from which any crosstab of them is taken.
+
+    Parameters:
+    frame (pd.DataFrame): The data.
+    columns (list): The categorical columns.
+    weight (str or array-like, optional): A weight column or array; every row counts once without it.
+    """
+
+    def __init__(self, frame, columns, weight=None):
+        self.columns = list(columns)
+        if weight is None:
+            weights = np.ones(len(frame))
+        elif isinstance(weight, str):
+            weights = pd.to_numeric(frame[weight], errors='coerce').to_numpy(dtype=float)
+        else:
+            weights = np.asarray(weight, dtype=float)
+        # Rows without a usable weight are left out
+        weights = np.where(np.isfinite(weights) & (weights > 0), weights, 0.0)
+        used = weights > 0
+
+        self.categories = {}
+        key = np.zeros(len(frame), dtype=np.int64)
+        shape = []
+        for column in self.columns:
+            codes, categories = encode(frame[column].to_numpy())
+            key = key * len(categories) + codes
+            self.categories[column] = categories
+            shape.append(len(categories))
+        cells = int(np.prod(shape, dtype=np.int64))
+        if cells > MAX_CELLS:
+            raise ValueError(f"The joint table of {self.columns} has {cells:,} cells; crosstab fewer columns at a time.")
+
+        key, weights = key[used], weights[used]
+        self.shape = tuple(shape)
+        self.n = np.bincount(key, minlength=cells).reshape(self.shape).astype(float)
+        self.weight = np.bincount(key, weights=weights, minlength=cells).reshape(self.shape)
+        self.weight_squared = np.bincount(key, weights=weights ** 2, minlength=cells).reshape(self.shape)
+
+    def marginal(self, columns):
+        """
+        Sum the joint table over all but the given columns.
+
+        Returns:
+        tuple: (n, weight, weight_squared) arrays with one axis per column, in the given order.
+        """
+        axes = [self.columns.index(column) for column in columns]
+        other = tuple(axis for axis in range(len(self.columns)) if axis not in axes)
+        order = np.argsort(np.argsort(axes))
+        return tuple(np.transpose(table.sum(axis=other), order) if axes else table.sum(axis=other)
+                     for table in (self.n, self.weight, self.weight_squared))
+
+    def _without_missing(self, columns, tables):
+        # Drop the missing-value category of every column that has one (it is the last category)
+        index = tuple(slice(0, -1) if pd.isna(self.categories[column][-1]) else slice(None) for column in columns)
+        categories = [self.categories[column][:-1] if pd.isna(self.categories[column][-1]) else self.categories[column]
+                      for column in columns]
+        return categories, tuple(table[index] for table in tables)
+
+    def shares(self, outcome, by=(), dropna=True):
+        """
+        Weighted shares of the categories of a column, within the groups of other columns.
+
+        Parameters:
+        outcome (str): The column whose categories are shared out.
+        by (list): The grouping columns (none for overall shares).
+        dropna (bool): Leave out rows with a missing outcome or grouping value, as pandas does.
+
+        Returns:
+        pd.DataFrame: One row per group and outcome category: the grouping values, 'category', 'n'
+        (unweighted rows), 'weighted', 'share' and its standard error 'se' (NaN for groups of one row).
+        """
+        by = list(by)
+        categories = [self.categories[column] for column in by + [outcome]]
+        n, weight, weight_squared = self.marginal(by + [outcome])
+        if dropna:
+            categories, (n, weight, weight_squared) = self._without_missing(by + [outcome], (n, weight, weight_squared))
+        group_n = n.sum(axis=-1, keepdims=True)
+        group_weight = weight.sum(axis=-1, keepdims=True)
+        group_weight_squared = weight_squared.sum(axis=-1, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = weight / group_weight
+            # sum(w^2 (y - p)^2) over the group: the cell's rows have y = 1, the others y = 0
+            deviation = weight_squared * (1 - share) ** 2 + (group_weight_squared - weight_squared) * share ** 2
+            se = np.sqrt(group_n / (group_n - 1) * deviation) / group_weight
+        se = np.where(group_n > 1, se, np.nan)
+
+        index = pd.MultiIndex.from_product(categories, names=by + ['category'])
+        table = pd.DataFrame({'n': n.ravel().astype(np.int64), 'weighted': weight.ravel(), 'share': share.ravel(),
+                              'se': np.broadcast_to(se, share.shape).ravel()}, index=index)
+        return table[np.broadcast_to(group_n > 0, n.shape).ravel()].reset_index()
+
+    def totals(self, columns):
+        """
+        Weighted counts of the cells of a crosstab.
+
+        Returns:
+        pd.DataFrame: One row per cell: the column values, 'n' and 'weighted'.
+        """
+        n, weight, _ = self.marginal(columns)
+        index = pd.MultiIndex.from_product([self.categories[column] for column in columns], names=columns)
+        return pd.DataFrame({'n': n.ravel().astype(np.int64), 'weighted': weight.ravel()}, index=index).reset_index()